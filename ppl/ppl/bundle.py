@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import struct
+from typing import List, Optional
+
+import ppl.packetDefinitions as pd
+from ppl.configTemplate import CompiledConfig, CompiledSlot, configUid
+from ppl.exceptions import BundleError
+from ppl.protocol import EncodedMessage, get_protocol_versions
+from ppl.util import StyleAdapter, getLogger
+
+"""
+Precompiled configurations
+
+    A bundle holds the encoded messages of a configuration (see configTemplate.compileConfig())
+    in the order of the configure transaction, without header and sequence number, so a rollout
+    from a bundle doesn't need to load, validate or encode the json. The config json is kept
+    compact for the error output only.
+
+    Layout (big endian):
+        "PPLB", format, UID (u64), md5 of the json file, count and (subprotocol, version) pairs
+        json length (u32), json
+        SetGlobalHostConfig frame
+        slot count (u8), per slot: slot id (u8), SetMACConfig frame, SetHostConfig frame,
+            AddHostRoutes count (u16) and frames
+    Each frame is the command (u8) of the CONFIGURATION subprotocol, the length (u16) and the body.
+
+    A bundle is only loaded with the protocol versions it was compiled for. The cache keys the
+    bundles by the md5 of the json file and the protocol versions, configure takes a bundle from
+    the cache instead of the json if there is one.
+"""
+
+logger = StyleAdapter(getLogger(__name__))
+
+BUNDLE_MAGIC = b"PPLB"
+# Incremented with every change of the layout
+BUNDLE_FORMAT = 1
+# Appended to the cache key
+BUNDLE_SUFFIX = ".pplb"
+
+_bundleHdr = struct.Struct(">4sBQ16sB")
+_versionEntry = struct.Struct(">BB")
+_jsonLength = struct.Struct(">I")
+_frameHdr = struct.Struct(">BH")
+_slotHdr = struct.Struct(">B")
+_batchCount = struct.Struct(">H")
+
+
+def defaultCacheDir() -> str:
+    cacheDir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cacheDir, "ppl")
+
+
+def protocolKey() -> str:
+    """The protocol versions as part of a file name, e.g. 1.2-2.1-3.8."""
+    return "-".join(f"{subprot.value}.{version}" for subprot, version in _versions())
+
+
+def cachePath(data: bytes, cacheDir: Optional[str] = None) -> str:
+    """Path of the bundle of the json file content data in the cache."""
+    if cacheDir is None:
+        cacheDir = defaultCacheDir()
+    return os.path.join(cacheDir, f"{hashlib.md5(data).hexdigest()}-{protocolKey()}{BUNDLE_SUFFIX}")
+
+
+def _versions():
+    return sorted(get_protocol_versions().items(), key=lambda item: item[0].value)
+
+
+def _frame(message: EncodedMessage) -> bytes:
+    cmd = pd.ConfigSubProt(message).cmd
+    return _frameHdr.pack(cmd, len(message.body)) + message.body
+
+
+def dumpBundle(compiled: CompiledConfig, data: bytes) -> bytes:
+    """
+    :param data: Content of the json file compiled has been compiled from
+    """
+    versions = _versions()
+    parts = [_bundleHdr.pack(BUNDLE_MAGIC, BUNDLE_FORMAT, compiled.uid, hashlib.md5(data).digest(), len(versions))]
+    parts.extend(_versionEntry.pack(subprot.value, version) for subprot, version in versions)
+    config = json.dumps(compiled.config, separators=(",", ":")).encode()
+    parts.append(_jsonLength.pack(len(config)))
+    parts.append(config)
+    parts.append(_frame(compiled.globalHostConfig))
+    parts.append(_slotHdr.pack(len(compiled.slots)))
+    for slot in compiled.slots:
+        parts.append(_slotHdr.pack(slot.slotId))
+        parts.append(_frame(slot.macConfig))
+        parts.append(_frame(slot.hostConfig))
+        parts.append(_batchCount.pack(len(slot.routeBatches)))
+        parts.extend(_frame(batch) for batch in slot.routeBatches)
+    return b"".join(parts)
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, packer: struct.Struct) -> tuple:
+        try:
+            values = packer.unpack_from(self.data, self.offset)
+        except struct.error:
+            raise BundleError("Bundle is truncated")
+        self.offset += packer.size
+        return values
+
+    def bytes(self, length: int) -> bytes:
+        if self.offset + length > len(self.data):
+            raise BundleError("Bundle is truncated")
+        value = bytes(self.data[self.offset : self.offset + length])
+        self.offset += length
+        return value
+
+    def frame(self, expected) -> EncodedMessage:
+        cmd, length = self.unpack(_frameHdr)
+        packetType = pd.ConfigSubProt.getRegisteredPackets().get(cmd)
+        if packetType is not expected:
+            raise BundleError("Expected a {} frame, bundle has command {}".format(expected.name, cmd))
+        return EncodedMessage(packetType.name, self.bytes(length))
+
+
+def loadBundle(data: bytes, digest: Optional[bytes] = None) -> CompiledConfig:
+    """
+    :param digest: md5 of the json file the bundle must have been compiled from
+    :raises BundleError: The bundle is invalid or for other protocol versions or another json
+    """
+    reader = _Reader(data)
+    magic, bundleFormat, uid, bundleDigest, versionCount = reader.unpack(_bundleHdr)
+    if magic != BUNDLE_MAGIC:
+        raise BundleError("Not a configuration bundle")
+    if bundleFormat != BUNDLE_FORMAT:
+        raise BundleError("Bundle has format {}, supported is {}".format(bundleFormat, BUNDLE_FORMAT))
+    if digest is not None and digest != bundleDigest:
+        raise BundleError("Bundle was compiled from another json")
+    versions = [reader.unpack(_versionEntry) for _ in range(versionCount)]
+    expected = [(subprot.value, version) for subprot, version in _versions()]
+    if versions != expected:
+        raise BundleError("Bundle was compiled for protocol versions {}, have {}".format(versions, expected))
+
+    (length,) = reader.unpack(_jsonLength)
+    try:
+        config = json.loads(reader.bytes(length))
+    except ValueError as e:
+        raise BundleError("Bundle has an invalid config: {}".format(e))
+    globalHostConfig = reader.frame(pd.SetGlobalHostConfig)
+    slots = []  # type: List[CompiledSlot]
+    (slotCount,) = reader.unpack(_slotHdr)
+    for _ in range(slotCount):
+        (slotId,) = reader.unpack(_slotHdr)
+        macConfig = reader.frame(pd.SetMACConfig)
+        hostConfig = reader.frame(pd.SetHostConfig)
+        (batchCount,) = reader.unpack(_batchCount)
+        routeBatches = [reader.frame(pd.AddHostRoutes) for _ in range(batchCount)]
+        validateMacConfig = EncodedMessage(pd.ValidateMACConfig.name, macConfig.body)
+        slots.append(CompiledSlot(slotId, validateMacConfig, macConfig, hostConfig, routeBatches))
+    if reader.offset != len(data):
+        raise BundleError("Bundle has {} superfluous bytes".format(len(data) - reader.offset))
+    return CompiledConfig(uid, globalHostConfig, slots, config)
+
+
+def writeBundle(path: str, compiled: CompiledConfig, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Written completely or not at all, a concurrent configure may read the cache
+    tmpPath = f"{path}.{os.getpid()}.tmp"
+    with open(tmpPath, "wb") as file:
+        file.write(dumpBundle(compiled, data))
+    os.replace(tmpPath, path)
+
+
+def readBundle(path: str) -> CompiledConfig:
+    with open(path, "rb") as file:
+        return loadBundle(file.read())
+
+
+def cachedBundle(data: bytes, cacheDir: Optional[str] = None) -> Optional[CompiledConfig]:
+    """
+    The bundle of the json file content data from the cache, None if there is none (or an
+    unusable one).
+    """
+    path = cachePath(data, cacheDir)
+    try:
+        with open(path, "rb") as file:
+            compiled = loadBundle(file.read(), hashlib.md5(data).digest())
+    except FileNotFoundError:
+        return None
+    except BundleError as e:
+        logger.warning("Ignoring cached bundle {}: {}", path, e)
+        return None
+    if compiled.uid != configUid(data):
+        logger.warning("Ignoring cached bundle {}: UID doesn't match", path)
+        return None
+    logger.debug("Using cached bundle {}", path)
+    return compiled
@@ -1,11 +1,11 @@
-import asyncio
 import json
 import os
 import ppl.packetDefinitions as pd
 from ppl.client import PplClient
 from ppl.constants import SERVERPORT
 from ppl.exceptions import PplException
-from ppl.util import ts_print, enableLog
+from ppl.tracing import addStatsArguments, runMainWithStats
+from ppl.util import addLoggingArguments, addLoopArguments, enableLog, setupLoggingFromArgs, ts_print
 from ppl.enums import ConfigStorageMode
 
 
@@ -34,7 +34,7 @@ async def execute(args: dict):
             return
 
     try:
-        client = PplClient(
+        client = await PplClient.create(
             ownaddress=ownaddress,
             ownport=ownport,
             timeout=timeout
@@ -44,12 +44,19 @@ async def execute(args: dict):
             enableLog(True)
         if command == "validate":
             client.runCmdValidateJson(jsonPath)
+        elif command == "compile":
+            client.runCmdCompile(jsonPath, args.bundle_file)
+        elif command == "template":
+            client.runCmdTemplate(args.template_file, args.devices_file, args.output_dir)
         elif command == "test":
             await client.runCmdTest(address, jsonPath, force_unpair)
         elif command == "clear":
             await client.runCmdClear(address, force_unpair)
         elif command == "configure":
-            await client.runCmdConfigure(address, force_unpair, skip_test, skip_clear, jsonPath)
+            if args.bundle is not None:
+                await client.runCmdConfigureBundle(address, force_unpair, skip_test, skip_clear, args.bundle)
+            else:
+                await client.runCmdConfigure(address, force_unpair, skip_test, skip_clear, jsonPath)
         else:
             ts_print(f"Unknown command '{command}'!")
             
@@ -106,6 +113,10 @@ def main():
         "--enable_logging", action='store_true', required=False, help="Enable extended logging in the console"
     )
 
+    addLoggingArguments(parser)
+    addLoopArguments(parser)
+    addStatsArguments(parser)
+
     subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
     subparsers.required = True
 
@@ -117,6 +128,31 @@ def main():
         "input_file", type=str, help="path to configuration json"
     )
     
+    # Compile
+    subparser_compile = subparsers.add_parser(
+        "compile", help="validate and encode the given json once, configure uses the result")
+
+    subparser_compile.add_argument(
+        "input_file", type=str, help="path to configuration json"
+    )
+    subparser_compile.add_argument(
+        "-b", "--bundle_file", required=False, help="writes the bundle to this file for 'configure --bundle' instead of the cache"
+    )
+
+    # Template
+    subparser_template = subparsers.add_parser(
+        "template", help="render and validate the configs of many devices from one template json")
+
+    subparser_template.add_argument(
+        "template_file", type=str, help="path to the configuration json used as template"
+    )
+    subparser_template.add_argument(
+        "devices_file", type=str, help="path to a json with the overrides of each device by its name, e.g. {\"door\": {\"ip\": \"192.168.100.34\", \"macAddress\": \"00:00:00:00:00:03\"}}"
+    )
+    subparser_template.add_argument(
+        "-od", "--output_dir", required=False, help="writes the config of each device to <name>.json in this directory"
+    )
+
     # Test
     subparser_test = subparsers.add_parser(
         "test", help="send MAC validation packets to the IP"
@@ -148,7 +184,10 @@ def main():
         "ip", type=str, help="ip address to test"
     )
     subparser_configure.add_argument(
-        "input_file", type=str, help="path to configuration json"
+        "input_file", type=str, nargs="?", help="path to configuration json"
+    )
+    subparser_configure.add_argument(
+        "-b", "--bundle", required=False, help="rolls out a bundle from 'ppl compile' instead of a json"
     )
     subparser_configure.add_argument(
          "-fu","--force_unpair", action="store_true", required=False, help="force unpairs before"
@@ -167,8 +206,13 @@ def main():
     )
 
     args = parser.parse_args()
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(execute(args))
+    if args.command == "configure" and (args.input_file is None) == (args.bundle is None):
+        parser.error("configure needs either input_file or --bundle")
+    if args.enable_logging and not args.log:
+        # Extended logging includes the protocol traffic of the client
+        args.log = ["ppl=DEBUG"]
+    setupLoggingFromArgs(args)
+    runMainWithStats(execute(args), args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+import timeit
+from typing import Any, Callable, Dict
+
+import ppl.packetDefinitions as pd
+from ppl.protocol import serialize_message
+
+"""
+Microbenchmark of the ppl encoder
+
+    Creates (validates) and serializes the messages of a configuration with synthetic content,
+    the time per message is the best of several rounds.
+"""
+
+
+def macConfigData(subnets: int) -> Dict[str, Any]:
+    data = pd.SetMACConfig.default().getDict()
+    data["addr_mac"] = "01:00:00:00:00:01"
+    data["subnets"] = [
+        {"addr_subnet_id": i & 0xFF, "channel": i % 16, "txPower": 10.0} for i in range(subnets)
+    ]
+    data["queue_sizes"] = [8] * 8
+    return data
+
+
+def hostConfigData(routes: int) -> Dict[str, Any]:
+    return {
+        "multicast_group": "225.224.223.0",
+        "multicast_port": 32145,
+        "traffic_filters": [{"action": 1, "entries": [{"index": 12, "value": 8}]}],
+        "routes": [
+            {
+                "macaddress": f"01:00:00:00:{i >> 8:02x}:{i & 0xFF:02x}",
+                "llcaddress": f"02:00:00:00:{i >> 8:02x}:{i & 0xFF:02x}",
+            }
+            for i in range(routes)
+        ],
+    }
+
+
+def measure(function: Callable[[], Any], number: int, repeat: int) -> float:
+    """Best time of one call in microseconds."""
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measures how fast configuration messages are created and serialized.")
+    parser.add_argument("-n", "--number", type=int, default=1000, help="Calls per round")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Rounds, the best one counts")
+    parser.add_argument("--subnets", type=int, default=32, help="Subnets of the SetMACConfig")
+    parser.add_argument(
+        "--routes", type=int, default=110, help="Routes of the SetHostConfig (at most 115 fit into one packet)"
+    )
+    args = parser.parse_args()
+
+    messages = [
+        (pd.SetMACConfig, macConfigData(args.subnets)),
+        (pd.SetHostConfig, hostConfigData(args.routes)),
+    ]
+    for packetType, data in messages:
+        message = pd.ConfigSubProt(packetType(**data))
+        size = len(serialize_message(message, 1))
+        create = measure(lambda: packetType(**data), args.number, args.repeat)
+        serialize = measure(lambda: serialize_message(message, 1), args.number, args.repeat)
+        print(f"{packetType.name:<14} {size:>5} bytes  create {create:8.1f} us  serialize {serialize:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
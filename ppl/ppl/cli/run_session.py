@@ -0,0 +1,97 @@
+import os
+import sys
+
+from ppl.constants import SERVERPORT
+from ppl.exceptions import PplException
+from ppl.session import PplService
+from ppl.util import addLoggingArguments, addLoopArguments, runMain, setupLoggingFromArgs, ts_print
+from r3erci.cli.run_session import call, splitCallArguments
+from r3erci.constants import PORT
+from r3erci.session import ErciService, SessionServer, defaultSocketPath
+
+
+async def serve(args) -> None:
+    server = SessionServer(args.socket)
+    services = [await PplService.create(args.ownaddress, args.ownport, args.timeout)]
+    server.register(services[0].handlers(), errors=(PplException,))
+    if args.erci:
+        services.append(await ErciService.create(args.ownaddress, args.erci_port, args.timeout))
+        server.register(services[1].handlers())
+    await server.start()
+    ts_print(f"Session daemon listening on {server.path}")
+    try:
+        await server.serve()
+    finally:
+        for service in services:
+            service.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Long-lived ppl session daemon keeping the socket open, and a thin client for it."
+    )
+    parser.add_argument(
+        "--socket", type=str, default=defaultSocketPath("ppl"), help="Unix socket of the session daemon"
+    )
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    subparsers.required = True
+
+    subparser_serve = subparsers.add_parser("serve", help="Runs the session daemon")
+    subparser_serve.add_argument(
+        "-t", "--timeout", type=float, default=3.0, help="Time to wait for a response"
+    )
+    subparser_serve.add_argument(
+        "-a", "--ownaddress", type=str, default="0.0.0.0", help="The interface to be used"
+    )
+    subparser_serve.add_argument(
+        "-p", "--ownport", type=int, default=SERVERPORT, help="The port to be used"
+    )
+    subparser_serve.add_argument(
+        "--erci",
+        action="store_true",
+        default=False,
+        help="Additionally serve the ERCI commands (see r3erci-session)",
+    )
+    subparser_serve.add_argument(
+        "--erci-port", type=int, default=PORT, help="The port to be used for ERCI"
+    )
+    addLoggingArguments(subparser_serve)
+    addLoopArguments(subparser_serve)
+
+    subparser_call = subparsers.add_parser(
+        "call", help="Sends one command to the session daemon and prints the JSON response"
+    )
+    subparser_call.add_argument("session_command", help="e.g. configure, nodestate or ping")
+    subparser_call.add_argument("address", nargs="?", default=None, help="ip address of the bridge")
+    subparser_call.add_argument(
+        "args", nargs="*", metavar="KEY=VALUE", help="Command arguments, e.g. input_file=Anchor.json"
+    )
+    subparser_call.add_argument(
+        "-t", "--timeout", type=float, default=120.0, help="Time to wait for the daemon"
+    )
+    subparser_call.add_argument(
+        "--pretty", action="store_true", default=False, help="Indent the JSON response"
+    )
+
+    args = parser.parse_args()
+    if args.command == "call":
+        splitCallArguments(args)
+        # The daemon may run in another directory
+        args.args = [
+            "input_file=" + os.path.abspath(arg[len("input_file="):]) if arg.startswith("input_file=") else arg
+            for arg in args.args
+        ]
+        sys.exit(call(args))
+
+    setupLoggingFromArgs(args)
+    try:
+        runMain(serve(args), args.loop)
+    except KeyboardInterrupt:
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+from ipaddress import IPv4Address
+
+from ppl.constants import CLIENTPORT, SERVERPORT
+from ppl.simulator import BRIDGE_BASE_ADDRESS, BridgeSimulator
+from ppl.util import addLoopArguments, enableLog, runMain
+from r3erci.simulator import NetworkConditions
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Simulates bridges on consecutive loopback addresses for tests of the ppl client."
+        f" Bridge n is reachable at base + n, clients use their usual port {SERVERPORT}."
+    )
+    parser.add_argument("count", type=int, nargs="?", default=1, help="Number of bridges to simulate")
+    parser.add_argument(
+        "-b",
+        "--base",
+        type=IPv4Address,
+        default=BRIDGE_BASE_ADDRESS,
+        help="Address of the first bridge",
+    )
+    parser.add_argument("-p", "--port", type=int, default=CLIENTPORT, help="The port to be used")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Response delay in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Additional random response delay in seconds"
+    )
+    parser.add_argument(
+        "--loss", type=float, default=0.0, help="Probability that a response is dropped"
+    )
+    parser.add_argument(
+        "--meas-interval", type=float, default=0.1, help="Seconds between two measurement reports"
+    )
+    parser.add_argument(
+        "--update-steps", type=int, default=10, help="Number of progress reports of an update"
+    )
+    parser.add_argument(
+        "--stats", type=float, default=None, help="Print counters every STATS seconds"
+    )
+    addLoopArguments(parser)
+
+    args = parser.parse_args()
+    enableLog(True)
+
+    simulator = BridgeSimulator.fromCount(
+        args.count,
+        base=args.base,
+        port=args.port,
+        conditions=NetworkConditions(latency=args.latency, jitter=args.jitter, loss=args.loss),
+        measInterval=args.meas_interval,
+        updateSteps=args.update_steps,
+    )
+    try:
+        runMain(simulator.serve(args.stats), args.loop)
+    except KeyboardInterrupt:
+        print("")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import asyncio
-import hashlib
 import json
 import os
+import struct
+import time
 
 import ppl.packetDefinitions as pd
 
@@ -9,74 +10,195 @@ from datetime import datetime
 from ipaddress import IPv4Address, ip_address
 from jsonschema import validate
 from jsonschema.exceptions import ValidationError, SchemaError
-from typing import Tuple
+from typing import List, Optional, Tuple
 
-from ppl.constants import SERVERPORT, SCHEMAPATH, SCHEMAPATHWHEEL
+from ppl.bundle import cachePath, cachedBundle, readBundle, writeBundle
+from ppl.configTemplate import CompiledConfig, ConfigTemplate, compileConfig, configUid, loadSchema
+from ppl.constants import SERVERPORT
 from ppl.enums import ConfigStorageMode
-from ppl.exceptions import TimeoutError, ResponseError
-from ppl.protocol import BaseMessage
+from ppl.exceptions import (
+    BundleError,
+    DeserializeError,
+    DeserializeVersionError,
+    NodeNotIdleError,
+    ResponseDecodeError,
+    ResponseError,
+    SerializeError,
+    TemplateError,
+    TimeoutError,
+    VersionMismatchError,
+)
+from ppl.protocol import HDR_STR, BaseMessage
 from ppl.protocol import SubProtocol
+from ppl.tracing import (
+    PHASE_HANDLER,
+    PHASE_QUERY_LOCK,
+    PHASE_RECEIVE,
+    PHASE_SEND,
+    PHASE_SERIALIZE,
+    tracer,
+)
 from ppl.udpServer import UdpServer
-from ppl.util import ts_print
+from ppl.util import StyleAdapter, getLogger, ts_print
+
+logger = StyleAdapter(getLogger(__name__))
+
+# Upper bound of commands sent by send_pipelined() before their responses arrived
+PIPELINE_DEPTH = 8
 
 
 class PplQuery:
-    def __init__(self, udpServer : UdpServer, timeout):
+    def __init__(self, udpServer : UdpServer, timeout, matchSequence: bool = False):
+        """
+        :param matchSequence: Match the response by its sequence as well, needed if several
+            queries of the same subprotocol run at once
+        """
         self.udpServer = udpServer
         self.timeout = timeout
+        self.matchSequence = matchSequence
         self.rx_address = Tuple[str, int]
         self.response = None
         self.error = None
 
     @staticmethod
-    def _wait_for(event: asyncio.Event, timeout: float):
-        return asyncio.wait_for(event.wait(), timeout)
+    def _wait_for(future: asyncio.Future, timeout: float):
+        return asyncio.wait_for(future, timeout)
 
     async def execute(
         self, data: bytes, address: IPv4Address, subProtocol: SubProtocol
     ) -> Tuple[bytes, Tuple[str, int]]:
-        queryEvent = asyncio.Event()
-
-        async def responseHandler(
-            sequence: int, message: BaseMessage, address: Tuple[str, int]
-        ) -> bool:
-            if not isinstance(message, pd.GenericError):
-                ts_print(f"GotResp: {subProtocol.get_subprotocol()}:  {repr(message)[13:]}")
-            self.response = message
-            self.rx_address = address
-            queryEvent.set()
-            return True
-        
-        with self.udpServer.subscriberFilterContext(
-            responseHandler,
-            filterAddr=str(address), filterSP=subProtocol.get_subprotocol()
-        ):
-            self.udpServer.sendPacket(data, address)
+        # Responses are matched by subprotocol, unless matchSequence is set the sequence only
+        # fails the query early on responses which can't be deserialized
+        _, sentSeq, _, _ = struct.unpack_from(HDR_STR, data)
+        with self.udpServer.expectResponse(
+            str(address),
+            filterSP=subProtocol.get_subprotocol(),
+            filterSeq=sentSeq if self.matchSequence else None,
+            sentSeq=sentSeq,
+        ) as response:
+            if tracer.enabled:
+                command = subProtocol.packet_content.name
+                start = tracer.now()
+                self.udpServer.sendPacket(data, address)
+                sent = tracer.since(PHASE_SEND, command, address, start)
+            else:
+                self.udpServer.sendPacket(data, address)
             try:
-                await self._wait_for(queryEvent, self.timeout)
-                queryEvent.clear()
+                _, _, self.response, self.rx_address = await self._wait_for(response, self.timeout)
             except asyncio.TimeoutError:
                 contentStr = repr(subProtocol.packet_content)
                 raise TimeoutError(f"{contentStr[13:contentStr.find('(')]}: No response in {self.timeout} seconds.")
+            except DeserializeVersionError as e:
+                raise VersionMismatchError(
+                    f"{subProtocol.get_subprotocol()}: Device answered with version {e.subprot_version},"
+                    f" want {e.expected_version}",
+                    subProtocol.get_subprotocol(),
+                    e.subprot_version,
+                    e.expected_version,
+                ) from e
+            except DeserializeError as e:
+                raise ResponseDecodeError(f"{subProtocol.get_subprotocol()}: Invalid response: {e}") from e
+            if tracer.enabled:
+                tracer.since(PHASE_RECEIVE, command, address, sent)
         if isinstance(self.response, pd.GenericError):
             self.error = self.response.get("ErrorMsg")
             raise ResponseError(f"{subProtocol.get_subprotocol()}: {self.error}")
+        logger.debug("GotResp: {}:  {!r}", subProtocol.get_subprotocol(), self.response)
         assert self.response is not None
         return self.response, self.rx_address
 
 
+class PairedSession:
+    """
+    Pairing with one node kept across several commands, e.g. test and configure.
+
+    Entering queries the node state once and pairs, an idle node is paired without unpairing it
+    first even if forceUnpair is set. Sessions can be entered again by nested commands, the node
+    is unpaired once when the outermost one is left. After a timeout the node is not unpaired,
+    that would only wait for the timeout again.
+
+    :param forceUnpair: Unpair a node which is not idle (e.g. paired with another server) first,
+                        otherwise entering raises NodeNotIdleError
+    """
+
+    def __init__(self, client: "PplClient", address: str, forceUnpair: bool = False):
+        self.client = client
+        self.address = address
+        self.forceUnpair = forceUnpair
+        self.nodeState = None  # type: Optional[BaseMessage]
+        self.paired = False
+        self.depth = 0
+
+    async def pair(self) -> None:
+        if self.paired:
+            return
+        self.nodeState, _ = await self.client.send_command(
+            self.address, pd.DiscovSubProt(pd.GetNodeState()), logSucc=False
+        )
+        state = self.nodeState.get("state")
+        if not state.isIdle():
+            if not self.forceUnpair:
+                # PairNode would only fetch the refusal of the bridge
+                error = NodeNotIdleError(f"{self.address} is not idle ({state.name}), force unpair to pair it", state)
+                self.client._logErr(str(error))
+                raise error
+            await self.client.send_command(self.address, pd.PairSubProt(pd.UnpairNode()), logSucc=False)
+        await self.client.send_command(self.address, pd.PairSubProt(pd.PairNode()), logSucc=False)
+        self.paired = True
+
+    async def unpair(self, **kwargs) -> None:
+        """
+        :param kwargs: Passed on to PplClient.send_command()
+        """
+        if not self.paired:
+            return
+        self.paired = False
+        await self.client.send_command(self.address, pd.PairSubProt(pd.UnpairNode()), logSucc=False, **kwargs)
+
+    async def __aenter__(self) -> "PairedSession":
+        await self.pair()
+        self.depth += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.depth -= 1
+        if exc_type is not None and not issubclass(exc_type, ResponseError):
+            self.paired = False
+        if self.depth == 0:
+            await self.unpair(raiseRespException=exc_type is None, raiseTOException=exc_type is None)
+
+
 class PplClient:
     def __init__(
         self,
         ownaddress: str = "0.0.0.0",
         ownport: int = SERVERPORT,
         timeout: int = 3,
+        batched: bool = False,
+        udpServer: Optional[UdpServer] = None,
     ):
         self.timeout = timeout
         self.queryLock = asyncio.Lock()
-        self.udpServer = UdpServer(ownaddress, ownport)
+        if udpServer is not None:
+            self.udpServer = udpServer
+        else:
+            self.udpServer = UdpServer(ownaddress, ownport, batched=batched)
         self.output = {'response': [], 'timestamp': [], 'message': []}
 
+    @classmethod
+    async def create(
+        cls,
+        ownaddress: str = "0.0.0.0",
+        ownport: int = SERVERPORT,
+        timeout: int = 3,
+        batched: bool = False,
+    ) -> "PplClient":
+        """
+        Creates the client from within a running event loop, see UdpServer.create().
+        """
+        udpServer = await UdpServer.create(ownaddress, ownport, batched=batched)
+        return cls(timeout=timeout, udpServer=udpServer)
+
     def _handle_response(self, message: BaseMessage, addr: Tuple[str, int]):
         # handle response if neccessary
         return
@@ -102,10 +224,19 @@ class PplClient:
     ) -> dict:
         ip = ip_address(address)
         try:
+            if tracer.enabled:
+                command = subprotocol.packet_content.name
+                start = tracer.now()
             async with self.queryLock:
-                ts_print(f"Executing {address}: {repr(subprotocol)}")
+                logger.debug("Executing {}: {!r}", address, subprotocol)
+                if tracer.enabled:
+                    locked = tracer.since(PHASE_QUERY_LOCK, command, ip, start)
                 data = self.udpServer.createPacket(subprotocol)
+                if tracer.enabled:
+                    tracer.since(PHASE_SERIALIZE, command, ip, locked)
                 message, rx_address = await self._send_command_and_handle_response(data, ip, subprotocol)
+                if tracer.enabled:
+                    tracer.since(PHASE_HANDLER, command, ip, start)
                 if logSucc:
                     self._logSucc()
                 return message, rx_address
@@ -113,7 +244,8 @@ class PplClient:
             if logRespErr:
                 self._logErr(e.__str__())
             if raiseRespException:
-                raise ResponseError(e.__str__())
+                # Keeps the type, e.g. VersionMismatchError with the version of the device
+                raise
         except TimeoutError as e:
             if logTOError:
                 self._logErr(e.__str__())
@@ -121,6 +253,41 @@ class PplClient:
                 raise TimeoutError(e.__str__())
 
 
+    async def send_pipelined(self, address: str, subprotocols: List[SubProtocol], logSucc: bool = True) -> list:
+        """
+        Sends the commands without waiting for each response, at most PIPELINE_DEPTH at once.
+        Only for commands the node may execute in any order. Responses are matched by their
+        sequence, errors are logged and the first one is raised after all commands finished.
+
+        :returns: The responses in the order of subprotocols
+        """
+        if not subprotocols:
+            return []
+        ip = ip_address(address)
+        window = asyncio.Semaphore(PIPELINE_DEPTH)
+
+        async def execute(subprotocol: SubProtocol):
+            async with window:
+                data = self.udpServer.createPacket(subprotocol)
+                response, _ = await PplQuery(self.udpServer, self.timeout, matchSequence=True).execute(
+                    data, ip, subprotocol
+                )
+                return response
+
+        async with self.queryLock:
+            logger.debug("Executing {} pipelined: {} commands", address, len(subprotocols))
+            results = await asyncio.gather(*(execute(sp) for sp in subprotocols), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        for error in errors:
+            if not isinstance(error, (ResponseError, TimeoutError)):
+                raise error
+            self._logErr(error.__str__())
+        if errors:
+            raise errors[0]
+        if logSucc:
+            self._logSucc()
+        return results
+
     # Commands
     def runCmdValidateJson(self, path):
         isValid, error = self._validateJson(path)
@@ -131,131 +298,203 @@ class PplClient:
             
         return isValid
         
-    async def runCmdTest(self, address, path, force_unpair, calledByConfigure = False):
-        """Validate the json locally and then validate the MacConfig on the bridge"""
-        error, device_config, networks = self._parseJson(path)
-        if error is not None:
-            self._logErr(f"Failed to validate json: {error.__str__()}")
-            return []
+    def runCmdCompile(self, jsonPath, bundlePath=None):
+        """
+        Validates and compiles the json into a bundle, configure --bundle sends it as it is.
+
+        :param bundlePath: Where to write the bundle, by default into the cache which configure
+            looks up for the json
+        :returns: Path of the bundle, None if the json is invalid
+        """
+        compiled = self._compileJson(jsonPath)
+        if compiled is None:
+            return None
+        with open(jsonPath, 'rb') as file:
+            data = file.read()
+        if bundlePath is None:
+            bundlePath = cachePath(data)
+        writeBundle(bundlePath, compiled, data)
+        ts_print(f"Compiled '{jsonPath}' to '{bundlePath}'")
+        self._logSucc()
+        return bundlePath
+
+    def runCmdTemplate(self, templatePath, devicesPath, outputDir=None):
+        """
+        Renders and checks the configurations of a fleet from a template
+
+        :param devicesPath: json with the overrides (by path or alias) of each device by its name
+        :param outputDir: Writes the configuration of each device to <name>.json in this directory
+        """
         try:
-            resp = []
-            if force_unpair:
-                await self.send_command(address, pd.PairSubProt(pd.UnpairNode()), logTOError=False, logSucc=False, raiseTOException=False)
+            template = ConfigTemplate.fromFile(templatePath)
+            devices = self._loadJson(devicesPath)
+            start = time.perf_counter()
+            files = {}
+            for name, overrides in devices.items():
+                files[name], _ = template.device(overrides, name)
+            elapsed = time.perf_counter() - start
+        except FileNotFoundError as e:
+            self._logErr(f"Error during loading of json file: {e}")
+            return False
+        except (ValidationError, SchemaError) as e:
+            self._logErr(f"Template is invalid: {e.message}")
+            return False
+        except (TemplateError, SerializeError) as e:
+            self._logErr(e.__str__())
+            return False
+        ts_print(f"{len(files)} device configs rendered and checked in {elapsed * 1000:.1f}ms")
+        if outputDir is not None:
+            os.makedirs(outputDir, exist_ok=True)
+            for name, text in files.items():
+                with open(os.path.join(outputDir, f"{name}.json"), 'w') as file:
+                    file.write(text)
+        self._logSucc()
+        return True
 
-            respPN = await self.send_command(address, pd.PairSubProt(pd.PairNode()), logSucc=False)
+    async def runCmdTest(
+        self,
+        address,
+        path,
+        force_unpair,
+        session: Optional[PairedSession] = None,
+        compiled: Optional[CompiledConfig] = None,
+    ):
+        """
+        Validate the json locally and then validate the MacConfig on the bridge
 
-            macConfigs = self.udpServer.createPacketDataMacConfig(networks)
-            i = 1
-            for config in macConfigs:
-                try:
-                    await self.send_command(address, pd.ConfigSubProt(pd.ValidateMACConfig(**config)), logRespErr=False)
-                    resp.append(True)
-                except ResponseError as e:
-                    resp.append(False)
-                    self._logErr(f"Failed to validate config {i}. {e.__str__()}")
-                except TimeoutError:
-                    resp.append(False)
-                    raise TimeoutError()
-                finally:
-                    i+=1
-
-            if not calledByConfigure:
-                await self.send_command(address, pd.PairSubProt(pd.UnpairNode()), logSucc=False)
-            return resp
-        except ResponseError as e:
-            return resp
+        :param session: Pairing to validate in, the node stays paired. By default the node is
+            paired for the test only.
+        :param compiled: Messages of the json at path if they were compiled already
+        """
+        if compiled is None:
+            compiled = self._compileJson(path)
+            if compiled is None:
+                return []
+        if session is None:
+            session = PairedSession(self, address, force_unpair)
+        resp = []
+        try:
+            async with session:
+                for i, slot in enumerate(compiled.slots, 1):
+                    try:
+                        await self.send_command(address, pd.ConfigSubProt(slot.validateMacConfig), logRespErr=False)
+                        resp.append(True)
+                    except ResponseError as e:
+                        resp.append(False)
+                        self._logErr(f"Failed to validate config {i}. {e.__str__()}")
+                    except TimeoutError:
+                        resp.append(False)
+                        raise
+        except ResponseError:
+            pass
         except TimeoutError:
-            return resp
+            pass
+        return resp
 
     async def runCmdClear(self, address, force_unpair):
         try:
-            if force_unpair:
-                await self.send_command(address, pd.PairSubProt(pd.UnpairNode()), logSucc=False, logTOError=False, raiseTOException=False)
-            await self.send_command(address, pd.PairSubProt(pd.PairNode()), logSucc=False)
-            await self.send_command(address, pd.ConfigSubProt(pd.ClearConfigSet()), raiseRespException=False)
-            await self.send_command(address, pd.PairSubProt(pd.UnpairNode()), logSucc=False)
+            async with PairedSession(self, address, force_unpair):
+                await self.send_command(address, pd.ConfigSubProt(pd.ClearConfigSet()), raiseRespException=False)
         except TimeoutError:
             return
         except ResponseError:
             return
-        
 
     async def runCmdConfigure(self, address, force_unpair, skip_test, skip_clear, jsonPath):
+        compiled = None
         try:
-            error, device_config, networks = self._parseJson(jsonPath)
-            if error is not None:
-                self._logErr(f"Failed to validate json: {error.__str__()}")
+            with open(jsonPath, 'rb') as file:
+                # A bundle compiled from this json before saves validating and encoding it
+                compiled = cachedBundle(file.read())
+        except FileNotFoundError:
+            pass
+        if compiled is not None:
+            ts_print(f"Using the compiled bundle of '{jsonPath}'")
+        else:
+            compiled = self._compileJson(jsonPath)
+            if compiled is None:
                 return
-            
-            if not skip_test:
-                isConfigValid = await self.runCmdTest(address, jsonPath, force_unpair, True)
-                if len(isConfigValid) == 0:
-                    return
-                elif not all(isConfigValid):
-                    await self.send_command(address, pd.PairSubProt(pd.UnpairNode()), logSucc=False, raiseRespException=False, raiseTOException=False)
+        await self.runCmdConfigureCompiled(address, force_unpair, skip_test, skip_clear, compiled)
+
+    async def runCmdConfigureBundle(self, address, force_unpair, skip_test, skip_clear, bundlePath):
+        try:
+            compiled = readBundle(bundlePath)
+        except FileNotFoundError as e:
+            self._logErr(f"Error during loading of bundle: {e}")
+            return
+        except BundleError as e:
+            self._logErr(f"Bundle '{bundlePath}' can't be used: {e}")
+            return
+        await self.runCmdConfigureCompiled(address, force_unpair, skip_test, skip_clear, compiled)
+
+    async def runCmdConfigureCompiled(self, address, force_unpair, skip_test, skip_clear, compiled: CompiledConfig):
+        """
+        Rolls out a compiled configuration, e.g. of a device rendered from a ConfigTemplate.
+        """
+        device_config = compiled.config['device']
+        networks = compiled.config['networks']
+        session = PairedSession(self, address, force_unpair)
+        try:
+            # Test and configuration share one pairing, leaving the session unpairs
+            async with session:
+                if not skip_test:
+                    isConfigValid = await self.runCmdTest(address, None, force_unpair, session, compiled)
+                    if len(isConfigValid) == 0 or not all(isConfigValid):
+                        return
+
+                # reseting the output, so it is empty for the config calls
+                self.output = {'response': [], 'timestamp': [], 'message': []}
+
+                if not skip_clear:
+                    await self.send_command(address, pd.ConfigSubProt(pd.ClearConfigSet()), logSucc=False)
+
+                configSlots = [slot.slotId for slot in compiled.slots]
+                packet = pd.StartConfigSetTransaction(storage = ConfigStorageMode.PERSIST, slots=configSlots)
+                await self.send_command(address, pd.ConfigSubProt(packet), logSucc=False)
+
+                uid = compiled.uid
+
+                try:
+                    await self.send_command(address, pd.ConfigSubProt(compiled.globalHostConfig), logSucc=False)
+                except ResponseError:
+                    self.output['message'].append(f"Packet data: {self.udpServer.createPacketDataSetGlobalHostConfig(device_config, isOutput=True)}")
+                    await self.send_command(address, pd.ConfigSubProt(pd.CommitConfigSet(UID=uid)), logSucc=False, raiseRespException=False)
                     return
-            else: 
-                if force_unpair:
-                    await self.send_command(address, pd.PairSubProt(pd.UnpairNode()), logSucc=False, logTOError=False, raiseTOException=False)
-                rspPair = await self.send_command(address, pd.PairSubProt(pd.PairNode()), logSucc=False)
-                
-            # reseting the output, so it is empty for the config calls 
-            self.output = {'response': [], 'timestamp': [], 'message': []}
-            
-            globalHostConfig = self.udpServer.createPacketDataSetGlobalHostConfig(device_config)
-            macConfigs = self.udpServer.createPacketDataMacConfig(networks)
-            hostConfigs = self.udpServer.createPacketDataSetHostConfig(networks)
-        
-            if not skip_clear:
-                rspCCS = await self.send_command(address, pd.ConfigSubProt(pd.ClearConfigSet()), logSucc=False)
 
-            configSlots = [int(id) for id in networks]
-            packet = pd.StartConfigSetTransaction(storage = ConfigStorageMode.PERSIST, slots=configSlots)
-            rspSCST = await self.send_command(address, pd.ConfigSubProt(packet), logSucc=False)
+                i = 0
+                try:
+                    for slot in compiled.slots:
+                        rspSCS = await self.send_command(address, pd.ConfigSubProt(pd.SelectConfigSlot(slotid=slot.slotId)), logSucc=False)
+                        rspSMC = await self.send_command(address, pd.ConfigSubProt(slot.macConfig), logSucc=False)
+                        await self.send_command(address, pd.ConfigSubProt(slot.hostConfig), logSucc=False)
+                        # Routes not fitting into the SetHostConfig packet follow in AddHostRoutes
+                        rspSHC = await self.send_pipelined(
+                            address, [pd.ConfigSubProt(routes) for routes in slot.routeBatches], logSucc=False
+                        )
+                        rspFCS = await self.send_command(address, pd.ConfigSubProt(pd.FinalizeConfigSlot()), logSucc=False)
+                        i += 1
+                        self._logSucc()
+                except ResponseError as e:
+                    self._logErr(e.__str__())
+                    if not 'rspSCS' in locals():
+                        ...
+                    elif not 'rspSMC' in locals():
+                        self.output['message'].append(f'Packet data: {(self.udpServer.createPacketDataMacConfig(networks, isOutput=True))[i]}')
+                    elif not 'rspSHC' in locals():
+                        self.output['message'].append(f'Packet data: {(self.udpServer.createPacketDataSetHostConfig(networks, isOutput=True))[i]}')
+                    if not 'rspFCS' in locals():
+                        ...
 
-            rspSGHC = await self.send_command(address, pd.ConfigSubProt(pd.SetGlobalHostConfig(**globalHostConfig)), logSucc=False)
+                    if not len(compiled.slots) == 1 and i > 0:
+                        msg = "'ppl clear' highly recommended"
+                        ts_print(msg)
+                        self.output['message'].append(msg)
+                        await self.send_command(address, pd.ConfigSubProt(pd.FinalizeConfigSlot()), logSucc=False, raiseRespException=False)
 
-            uid = self._getConfigUid(jsonPath)
-            
-            i = 0
-            try: 
-                for config in macConfigs:
-                    rspSCS = await self.send_command(address, pd.ConfigSubProt(pd.SelectConfigSlot(slotid=configSlots[i])), logSucc=False)
-                    rspSMC = await self.send_command(address, pd.ConfigSubProt(pd.SetMACConfig(**config)), logSucc=False)
-                    rspSHC = await self.send_command(address, pd.ConfigSubProt(pd.SetHostConfig(**hostConfigs[i])), logSucc=False) 
-                    rspFCS = await self.send_command(address, pd.ConfigSubProt(pd.FinalizeConfigSlot()), logSucc=False)
-                    i += 1
-                    self._logSucc()
-            except ResponseError as e:
-                self._logErr(e.__str__())
-                if not 'rspSCS' in locals():
-                    ...
-                elif not 'rspSMC' in locals():
-                    self.output['message'].append(f'Packet data: {(self.udpServer.createPacketDataMacConfig(networks, isOutput=True))[i]}')
-                elif not 'rspSHC' in locals():
-                    self.output['message'].append(f'Packet data: {(self.udpServer.createPacketDataSetHostConfig(networks, isOutput=True))[i]}')
-                if not 'rspFCS' in locals():
-                    ...
-
-                if not len(macConfigs) == 1 and i > 0:
-                    msg = "'ppl clear' highly recommended"
-                    ts_print(msg)
-                    self.output['message'].append(msg)
-                    await self.send_command(address, pd.ConfigSubProt(pd.FinalizeConfigSlot()), logSucc=False, raiseRespException=False)
-                 
-            await self.send_command(address, pd.ConfigSubProt(pd.CommitConfigSet(UID=uid)), logSucc=False, raiseRespException=False)
-            await self.send_command(address, pd.PairSubProt(pd.UnpairNode()), logSucc=False)
-        except ResponseError as e:
-            if not 'rspPair' in locals():
-                ...
-            elif (not skip_clear and not 'rspCCS' in locals()) or not 'rspSCST' in locals():
-                await self.send_command(address, pd.PairSubProt(pd.UnpairNode()), logSucc=False, raiseRespException=False, raiseTOException=False)
-            elif not 'rspSGHC' in locals():
-                self.output['message'].append(f"Packet data: {self.udpServer.createPacketDataSetGlobalHostConfig(device_config, isOutput=True)}")
-                message, _ = await self.send_command(address, pd.ConfigSubProt(pd.CommitConfigSet(UID=uid)), logSucc=False, raiseRespException=False, raiseTOException=False)
-                if message is not None:
-                    await self.send_command(address, pd.PairSubProt(pd.UnpairNode()), logSucc=False, raiseRespException=False, raiseTOException=False)
-        except TimeoutError as e:
+                await self.send_command(address, pd.ConfigSubProt(pd.CommitConfigSet(UID=uid)), logSucc=False, raiseRespException=False)
+        except ResponseError:
+            return
+        except TimeoutError:
             return
 
 
@@ -264,12 +503,7 @@ class PplClient:
             isValid = False
             error = None
             json = self._loadJson(jsonPath)
-            try:
-                schema = self._loadJson(SCHEMAPATH)
-            except FileNotFoundError as e:
-                currentDir = os.path.dirname(__file__)
-                fullPath = os.path.join(currentDir, SCHEMAPATHWHEEL) 
-                schema = self._loadJson(fullPath)
+            schema = loadSchema()
             validate(json, schema)
             ts_print(f"Json at '{jsonPath}' successfully validated")
             isValid = True
@@ -295,15 +529,24 @@ class PplClient:
         version_info = data['version']
         return error, device_info, networks_info
 
+    def _compileJson(self, jsonPath) -> Optional[CompiledConfig]:
+        """
+        Validates and compiles the json at jsonPath, None if it is invalid (logged).
+        """
+        error, device_config, networks = self._parseJson(jsonPath)
+        if error is not None:
+            self._logErr(f"Failed to validate json: {error.__str__()}")
+            return None
+        config = {'device': device_config, 'networks': networks}
+        return compileConfig(config, self._getConfigUid(jsonPath))
+
     def _loadJson(self, path):
         with open(path, 'r') as file:
             return json.load(file)
 
     def _getConfigUid(self, jsonPath):
         with open(jsonPath, 'rb') as file:
-            file_contents = file.read()
-            md5_hash = hashlib.md5(file_contents).hexdigest()
-            return abs(int(md5_hash, 16)) & 0xFFFFFFFFFFFFFFFF
+            return configUid(file.read())
     
     def _logSucc(self):
         self.output['response'].append("OK")
@@ -0,0 +1,363 @@
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+from jsonschema.exceptions import ValidationError
+from jsonschema.validators import validator_for
+
+import ppl.packetDefinitions as pd
+from ppl.constants import SCHEMAPATH, SCHEMAPATHWHEEL
+from ppl.exceptions import TemplateError
+from ppl.protocol import EncodedMessage
+from ppl.udpServer import UdpServer
+from ppl.util import StyleAdapter, getLogger
+
+"""
+Configurations of a fleet from one template
+
+    A template is a complete configuration (like Anchor.json), it is validated against the schema
+    once. Devices are described by overrides of single values, given by their path in the
+    configuration ("device/ip", "networks/1/stationConfiguration/macAddress", "*" stands for every
+    key of a level) or by one of the ALIASES. Rendering a device copies only the containers along
+    the overridden paths, everything else is shared with the template, and validates only the
+    objects holding an overridden value.
+
+    compile() turns a configuration into the encoded messages of a configure run. Network slots
+    (or their MAC / host part) and the device part which a device shares with the template reuse
+    the messages encoded for the template.
+"""
+
+logger = StyleAdapter(getLogger(__name__))
+
+# Short names of the values which differ between the devices of a fleet
+ALIASES = {
+    "ip": "device/ip",
+    "macAddress": "networks/*/stationConfiguration/macAddress",
+    "stationPTT": "networks/*/stationConfiguration/stationPTT",
+    "isAnchor": "networks/*/stationConfiguration/options/isAnchor",
+    "isStatic": "networks/*/stationConfiguration/options/isStatic",
+    "isExtRelay": "networks/*/stationConfiguration/options/isExtRelay",
+}
+
+PathType = Tuple[Union[str, int], ...]
+
+CompiledSlot = NamedTuple(
+    "CompiledSlot",
+    [
+        ("slotId", int),
+        ("validateMacConfig", EncodedMessage),
+        ("macConfig", EncodedMessage),
+        ("hostConfig", EncodedMessage),
+        # AddHostRoutes with the routes not fitting into the SetHostConfig
+        ("routeBatches", List[EncodedMessage]),
+    ],
+)
+
+CompiledConfig = NamedTuple(
+    "CompiledConfig",
+    [
+        ("uid", int),
+        ("globalHostConfig", EncodedMessage),
+        ("slots", List[CompiledSlot]),
+        # The configuration the messages were compiled from
+        ("config", Dict[str, Any]),
+    ],
+)
+
+
+def loadSchema() -> Dict[str, Any]:
+    try:
+        with open(SCHEMAPATH, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        with open(os.path.join(os.path.dirname(__file__), SCHEMAPATHWHEEL), "r") as file:
+            return json.load(file)
+
+
+def configUid(data: bytes) -> int:
+    """UID of a configuration stored on the device, derived from the content of its file."""
+    return abs(int(hashlib.md5(data).hexdigest(), 16)) & 0xFFFFFFFFFFFFFFFF
+
+
+def dumpConfig(config: Dict[str, Any]) -> str:
+    """The configuration as written to a file, configUid() of a rendered device is taken from it."""
+    return json.dumps(config, indent=2) + "\n"
+
+
+def _compileGlobalHostConfig(device: Dict[str, Any]) -> EncodedMessage:
+    return EncodedMessage.encode(pd.SetGlobalHostConfig(**UdpServer.createPacketDataSetGlobalHostConfig(device)))
+
+
+def _compileMacConfig(network: Dict[str, Any]) -> Tuple[EncodedMessage, EncodedMessage]:
+    macConfig = EncodedMessage.encode(pd.SetMACConfig(**UdpServer.createPacketDataMacConfig({"": network})[0]))
+    # Both messages have the same fields
+    return EncodedMessage(pd.ValidateMACConfig.name, macConfig.body), macConfig
+
+
+def _compileHostConfig(network: Dict[str, Any]) -> Tuple[EncodedMessage, List[EncodedMessage]]:
+    hostConfig, routeBatches = pd.split_host_config(UdpServer.createPacketDataSetHostConfig({"": network})[0])
+    return (
+        EncodedMessage.encode(pd.SetHostConfig(**hostConfig)),
+        [EncodedMessage.encode(pd.AddHostRoutes(routes=routes)) for routes in routeBatches],
+    )
+
+
+def _sameMacSections(network: Dict[str, Any], other: Dict[str, Any]) -> bool:
+    return (
+        network["macConfiguration"] is other["macConfiguration"]
+        and network["stationConfiguration"] is other["stationConfiguration"]
+        and network["subnetConfiguration"] is other["subnetConfiguration"]
+        and network.get("llcConfiguration", {}).get("priorityFilters")
+        is other.get("llcConfiguration", {}).get("priorityFilters")
+    )
+
+
+def compileConfig(config: Dict[str, Any], uid: int, reuse: Optional[CompiledConfig] = None) -> CompiledConfig:
+    """
+    Creates and encodes the messages of a validated configuration.
+
+    :param reuse: Messages of a configuration sharing parts (by identity) with config, e.g. of its
+        template. Their messages are taken instead of encoding the parts again.
+    """
+    if reuse is not None and config["device"] is reuse.config["device"]:
+        globalHostConfig = reuse.globalHostConfig
+    else:
+        globalHostConfig = _compileGlobalHostConfig(config["device"])
+
+    reuseSlots = {}  # type: Dict[str, Tuple[Dict[str, Any], CompiledSlot]]
+    if reuse is not None:
+        for (slotId, network), slot in zip(reuse.config["networks"].items(), reuse.slots):
+            reuseSlots[slotId] = (network, slot)
+
+    slots = []
+    for slotId, network in config["networks"].items():
+        if slotId in reuseSlots:
+            other, slot = reuseSlots[slotId]
+            if network is other:
+                slots.append(slot)
+                continue
+            if _sameMacSections(network, other):
+                validateMacConfig, macConfig = slot.validateMacConfig, slot.macConfig
+            else:
+                validateMacConfig, macConfig = _compileMacConfig(network)
+            if network.get("llcConfiguration") is other.get("llcConfiguration"):
+                hostConfig, routeBatches = slot.hostConfig, slot.routeBatches
+            else:
+                hostConfig, routeBatches = _compileHostConfig(network)
+        else:
+            validateMacConfig, macConfig = _compileMacConfig(network)
+            hostConfig, routeBatches = _compileHostConfig(network)
+        slots.append(CompiledSlot(int(slotId), validateMacConfig, macConfig, hostConfig, routeBatches))
+    return CompiledConfig(uid, globalHostConfig, slots, config)
+
+
+def splitPath(path: str) -> PathType:
+    """Parts of an override path or alias, indices of arrays stay strings until they are used."""
+    return tuple(ALIASES.get(path, path).split("/"))
+
+
+class ConfigTemplate:
+    """
+    Renders the configurations of many devices from one template, see the module description.
+
+    :param base: The template, a complete configuration
+    :param schema: Schema of the configurations, defaults to the ppl schema
+    """
+
+    def __init__(self, base: Dict[str, Any], schema: Optional[Dict[str, Any]] = None):
+        self.schema = loadSchema() if schema is None else schema
+        validatorClass = validator_for(self.schema)
+        validatorClass.check_schema(self.schema)
+        self.validatorClass = validatorClass
+        # The template is checked once, devices only where they differ
+        validatorClass(self.schema).validate(base)
+        self.base = base
+        self.validators = {}  # type: Dict[int, Any]
+        self.compiled = None  # type: Optional[CompiledConfig]
+
+    @classmethod
+    def fromFile(cls, path: str, schema: Optional[Dict[str, Any]] = None) -> "ConfigTemplate":
+        with open(path, "r") as file:
+            return cls(json.load(file), schema)
+
+    def _resolve(self, schema: Dict[str, Any]) -> Dict[str, Any]:
+        while "$ref" in schema:
+            ref = schema["$ref"]
+            if not ref.startswith("#/"):
+                raise TemplateError("Only local references are supported in the schema: {}".format(ref))
+            schema = self.schema
+            for part in ref[2:].split("/"):
+                schema = schema[part]
+        return schema
+
+    def _childSchema(self, schema: Optional[Dict[str, Any]], key: Union[str, int]) -> Optional[Dict[str, Any]]:
+        if schema is None:
+            return None
+        schema = self._resolve(schema)
+        if isinstance(key, int):
+            items = schema.get("items")
+            return items if isinstance(items, dict) else None
+        if key in schema.get("properties", {}):
+            return schema["properties"][key]
+        for pattern, subschema in schema.get("patternProperties", {}).items():
+            if re.search(pattern, key):
+                return subschema
+        additional = schema.get("additionalProperties")
+        return additional if isinstance(additional, dict) else None
+
+    def _inline(self, schema: Any, refs: Tuple[str, ...] = ()) -> Any:
+        """Copy of schema with the local references replaced by what they refer to."""
+        if isinstance(schema, list):
+            items = [self._inline(item, refs) for item in schema]
+            return None if any(item is None for item in items) else items
+        if not isinstance(schema, dict):
+            return schema
+        if "$ref" in schema:
+            ref = schema["$ref"]
+            if ref in refs or any(key not in ("$ref", "description") for key in schema):
+                # Recursive or combined with other keywords, left to the validator
+                return None
+            return self._inline(self._resolve(schema), refs + (ref,))
+        inlined = {}
+        for key, value in schema.items():
+            if key == "$defs":
+                continue
+            if key not in ("enum", "const", "default", "examples"):
+                value = self._inline(value, refs)
+                if value is None:
+                    return None
+            inlined[key] = value
+        return inlined
+
+    def _validator(self, schema: Dict[str, Any]):
+        validator = self.validators.get(id(schema))
+        if validator is None:
+            # Without references a validation doesn't need to look them up
+            inlined = self._inline(schema)
+            if inlined is None:
+                # Subschemas refer to the definitions of the whole schema
+                inlined = {**schema, "$defs": self.schema.get("$defs", {})}
+            validator = self.validatorClass(inlined)
+            self.validators[id(schema)] = validator
+        return validator
+
+    def _expand(self, config: Any, path: PathType) -> List[PathType]:
+        """Replaces the "*" in path by the keys of config."""
+        paths = [()]  # type: List[PathType]
+        for part in path:
+            expanded = []
+            for prefix in paths:
+                if part != "*":
+                    expanded.append(prefix + (part,))
+                    continue
+                node = config
+                for key in prefix:
+                    node = node[int(key)] if isinstance(node, list) else node[key]
+                keys = range(len(node)) if isinstance(node, list) else node.keys()
+                expanded.extend(prefix + (key,) for key in keys)
+            paths = expanded
+        return paths
+
+    def render(self, overrides: Dict[str, Any], name: str = "") -> Dict[str, Any]:
+        """
+        The configuration of one device.
+
+        :param overrides: Values by path or alias
+        :param name: Name of the device for error messages
+        :raises TemplateError: A path can't be set or the result is invalid
+        """
+        config = dict(self.base)
+        # Containers copied for this device, keyed by their path
+        copies = {(): config}  # type: Dict[PathType, Any]
+        checked = set()  # type: Set[PathType]
+        for path, value in overrides.items():
+            try:
+                leafs = self._expand(config, splitPath(path))
+            except (KeyError, IndexError, ValueError, TypeError, AttributeError):
+                raise TemplateError("{}: No such path in the template: {}".format(name, path))
+            for leaf in leafs:
+                node = config
+                for i, part in enumerate(leaf[:-1]):
+                    prefix = leaf[: i + 1]
+                    try:
+                        if isinstance(node, list):
+                            part = int(part)
+                        child = copies.get(prefix)
+                        if child is None:
+                            original = node.get(part, {}) if isinstance(node, dict) else node[part]
+                            if not isinstance(original, (dict, list)):
+                                raise TypeError()
+                            child = copies[prefix] = type(original)(original)
+                            node[part] = child
+                    except (IndexError, ValueError, TypeError):
+                        raise TemplateError("{}: No such path in the template: {}".format(name, path))
+                    node = child
+                last = leaf[-1]
+                try:
+                    node[int(last) if isinstance(node, list) else last] = value
+                except (IndexError, ValueError):
+                    raise TemplateError("{}: No such path in the template: {}".format(name, path))
+                checked.add(self._checkedPath(config, leaf))
+
+        for path in sorted(checked, key=len):
+            # Objects within another checked one are validated with it
+            if any(path[: len(other)] == other for other in checked if len(other) < len(path)):
+                continue
+            self._validatePath(config, path, name)
+        return config
+
+    @staticmethod
+    def _checkedPath(config: Dict[str, Any], leaf: PathType) -> PathType:
+        """
+        Path of the object to validate for a changed value: the object holding it, or the object
+        holding the array of it (an array checks its items against each other).
+        """
+        path = leaf[:-1]
+        nodes = [config]
+        for part in path:
+            node = nodes[-1]
+            nodes.append(node[int(part)] if isinstance(node, list) else node[part])
+        while path and (isinstance(nodes[-1], list) or isinstance(nodes[-2], list)):
+            path = path[:-1]
+            nodes.pop()
+        return path
+
+    def _validatePath(self, config: Dict[str, Any], path: PathType, name: str) -> None:
+        schema = self.schema  # type: Dict[str, Any]
+        node = config
+        for i, part in enumerate(path):
+            if isinstance(node, list):
+                part = int(part)
+            childSchema = self._childSchema(schema, part)
+            if childSchema is None:
+                # Not described by the schema, the object holding it tells whether it is allowed
+                path = path[:i]
+                break
+            schema = childSchema
+            node = node[part]
+        try:
+            self._validator(schema).validate(node)
+        except ValidationError as e:
+            location = "/".join(str(part) for part in path + tuple(e.absolute_path))
+            raise TemplateError("{}: Invalid value at {}: {}".format(name, location or "/", e.message)) from e
+
+    def compile(self, config: Dict[str, Any], uid: int) -> CompiledConfig:
+        """
+        Messages of a configuration rendered from this template, parts shared with the template
+        reuse its messages.
+        """
+        if self.compiled is None:
+            self.compiled = compileConfig(self.base, configUid(dumpConfig(self.base).encode()))
+        return compileConfig(config, uid, self.compiled)
+
+    def device(self, overrides: Dict[str, Any], name: str = "") -> Tuple[str, CompiledConfig]:
+        """
+        Renders and compiles a device.
+
+        :returns: The configuration file of the device and its messages
+        """
+        config = self.render(overrides, name)
+        text = dumpConfig(config)
+        return text, self.compile(config, configUid(text.encode()))
@@ -0,0 +1,196 @@
+import asyncio
+import inspect
+import os
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import ppl.packetDefinitions as pd
+from ppl.protocol import HDR_SIZE, HDR_STR, subProtocols
+from ppl.udpServer import UdpServer
+from ppl.util import StyleAdapter, getLogger
+
+logger = StyleAdapter(getLogger(__name__))
+
+# Upper bound of datagrams decoded by one worker call
+DECODE_BATCH_SIZE = 256
+# Upper bound of batches handed to the workers and not yet delivered, further datagrams are dropped
+MAX_PENDING_BATCHES = 64
+
+_hdrPacker = struct.Struct(HDR_STR)
+
+# Compact result of decoding one datagram in a worker. The message classes are created at
+# runtime and can't be pickled, so the content is returned as plain dict (BaseMessage.getDict()).
+# name and fields are None if the datagram could not be deserialized.
+DecodedRecord = NamedTuple(
+    "DecodedRecord",
+    [
+        ("timestamp", float),
+        ("address", Tuple[str, int]),
+        ("subProtocol", int),
+        ("sequence", Optional[int]),
+        ("name", Optional[str]),
+        ("fields", Optional[Dict[str, Any]]),
+    ],
+)
+
+RawBatch = List[Tuple[float, bytes, Tuple[str, int]]]
+RecordHandlerType = Callable[[List[DecodedRecord]], Any]
+
+
+def decodeBatch(batch: RawBatch, rawAddresses: bool = False) -> List[DecodedRecord]:
+    """
+    Worker side: decodes the datagrams of one batch in order.
+
+    :param rawAddresses: MAC and IP addresses in the fields are ints, cheaper to create and pickle
+    """
+    records = []
+    for timestamp, data, address in batch:
+        subProtocol, sequence, message = pd.deserialize_message(data, rawAddresses)
+        if message is None:
+            records.append(DecodedRecord(timestamp, address, int(subProtocol.value), sequence, None, None))
+        else:
+            records.append(
+                DecodedRecord(timestamp, address, int(subProtocol.value), sequence, message.name, message.getDict())
+            )
+    return records
+
+
+def isFreeThreaded() -> bool:
+    isGilEnabled = getattr(sys, "_is_gil_enabled", None)
+    return isGilEnabled is not None and not isGilEnabled()
+
+
+def createExecutor(workers: Optional[int] = None) -> Executor:
+    """
+    Threads if the interpreter runs without GIL, otherwise processes.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if isFreeThreaded():
+        return ThreadPoolExecutor(workers, thread_name_prefix="ppl-decode")
+    return ProcessPoolExecutor(workers)
+
+
+class DecodePool:
+    """
+    Optional pipeline stage decoding raw datagrams on all cores.
+
+    Attached to a UdpServer as raw tap, datagrams of the selected subprotocols are taken before
+    they are decoded on the event loop. Everything received during one loop iteration forms a
+    batch which is decoded by a worker, results are handed to the handler as lists of
+    DecodedRecord in receive order. Datagrams from devices with a pending query are left to
+    the UdpServer, so responses still reach their query.
+    """
+
+    def __init__(
+        self,
+        handler: RecordHandlerType,
+        subProtocolFilter: Iterable[subProtocols] = (subProtocols.MEASUREMENT,),
+        workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        batchSize: int = DECODE_BATCH_SIZE,
+        maxPending: int = MAX_PENDING_BATCHES,
+        rawAddresses: bool = False,
+    ):
+        """
+        :param handler: Called with each list of decoded records, coroutines are awaited
+        :param subProtocolFilter: Subprotocols decoded by the pool
+        :param workers: Number of workers of the default executor, defaults to the number of cores
+        :param executor: Use this executor instead of creating one, it is not shut down by close()
+        :param batchSize: Maximum number of datagrams per worker call
+        :param maxPending: Maximum number of batches in flight before datagrams are dropped
+        :param rawAddresses: Decode MAC and IP addresses to ints instead of address objects
+        """
+        self.handler = handler
+        self.subProtocolFilter = frozenset(int(sp.value) for sp in subProtocolFilter)
+        self.ownExecutor = executor is None
+        self.executor = executor if executor is not None else createExecutor(workers)
+        self.batchSize = batchSize
+        self.maxPending = maxPending
+        self.rawAddresses = rawAddresses
+        self.loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self.udpServer = None  # type: Optional[UdpServer]
+        self.batch = []  # type: RawBatch
+        self.flushScheduled = False
+        self.pending = deque()  # type: Deque[asyncio.Future]
+        self.deliverTask = None  # type: Optional[asyncio.Future]
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def attach(self, udpServer: UdpServer) -> None:
+        """
+        Taps the datagrams of udpServer, must be called from within its running event loop.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.udpServer = udpServer
+        udpServer.addRawTap(self.feed)
+
+    def detach(self) -> None:
+        if self.udpServer is not None:
+            self.udpServer.removeRawTap(self.feed)
+            self.udpServer = None
+
+    async def close(self) -> None:
+        """
+        Detaches from the UdpServer and delivers everything received so far.
+        """
+        self.detach()
+        self.flush()
+        if self.deliverTask is not None:
+            await self.deliverTask
+        if self.ownExecutor:
+            self.executor.shutdown()
+
+    def feed(self, data: bytes, address: Tuple[str, int]) -> bool:
+        if len(data) < HDR_SIZE or _hdrPacker.unpack_from(data)[2] not in self.subProtocolFilter:
+            return False
+        self.received += 1
+        if len(self.pending) >= self.maxPending:
+            self.dropped += 1
+            logger.debug("Decode workers fall behind, dropped datagram from {}", address[0])
+            return True
+        self.batch.append((time.time(), bytes(data), address))
+        if len(self.batch) >= self.batchSize:
+            self.flush()
+        elif not self.flushScheduled:
+            self.flushScheduled = True
+            self.loop.call_soon(self.flush)
+        return True
+
+    def flush(self) -> None:
+        self.flushScheduled = False
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        self.pending.append(self.loop.run_in_executor(self.executor, decodeBatch, batch, self.rawAddresses))
+        if self.deliverTask is None:
+            self.deliverTask = asyncio.ensure_future(self._deliver())
+
+    async def _deliver(self) -> None:
+        # Batches finish in any order, they are delivered in the order they were submitted
+        try:
+            while self.pending:
+                future = self.pending[0]
+                try:
+                    records = await future
+                except Exception:
+                    logger.exception("Decoding a batch failed")
+                    records = []
+                finally:
+                    self.pending.popleft()
+                if not records:
+                    continue
+                self.delivered += len(records)
+                try:
+                    result = self.handler(records)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    logger.exception("An error occured in the record handler")
+        finally:
+            self.deliverTask = None
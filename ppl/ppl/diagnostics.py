@@ -0,0 +1,188 @@
+import struct
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import ppl.packetDefinitions as pd
+from ppl.exceptions import DeserializeError, DeserializeVersionError
+from ppl.protocol import HDR_SIZE, HDR_STR, BaseMessage, subProtocols, tlv_spans
+
+DiagnosticKey = Tuple[int, int]
+DecoderType = Callable[[memoryview], Any]
+
+# Typed decoders per (component, valueId). TLVs without a decoder are returned as bytes.
+_decoders = {}  # type: Dict[DiagnosticKey, DecoderType]
+
+_countPacker = struct.Struct(">H")
+_hdrPacker = struct.Struct(HDR_STR)
+
+
+def _diagnostics_cmd() -> int:
+    for cmd, packet_type in pd.DevControlSubProt.getRegisteredPackets().items():
+        if packet_type is pd.DeviceDiagnostics:
+            return cmd
+    raise RuntimeError("DeviceDiagnostics is not part of DevControlSubProt")
+
+
+DIAGNOSTICS_CMD = _diagnostics_cmd()
+
+
+def register_decoder(component: int, valueId: int, decoder: Optional[DecoderType] = None):
+    """
+    Register a typed decoder for a diagnostic value. Can be used as decorator.
+
+    The decoder receives the TLV data (including alignment padding) as memoryview.
+
+    :param      component:  Component of the diagnostic value
+    :param      valueId:    Id of the value within the component
+    :param      decoder:    Callable converting the raw data to a value
+    """
+
+    def _register(func: DecoderType) -> DecoderType:
+        _decoders[(component, valueId)] = func
+        return func
+
+    if decoder is not None:
+        return _register(decoder)
+    return _register
+
+
+def unregister_decoder(component: int, valueId: int) -> None:
+    _decoders.pop((component, valueId), None)
+
+
+def struct_decoder(fmt: str) -> DecoderType:
+    """
+    Decoder unpacking the start of the data with the given struct format.
+    Formats with a single member return the member itself, otherwise a tuple.
+    """
+    packer = struct.Struct(fmt)
+    if len(packer.unpack(bytes(packer.size))) == 1:
+        return lambda data: packer.unpack_from(data)[0]
+    return lambda data: packer.unpack_from(data)
+
+
+def string_decoder(data: memoryview) -> str:
+    return bytes(data).split(b"\0", 1)[0].decode(errors="backslashreplace")
+
+
+class DiagnosticsIndex:
+    """
+    Index over the TLVs of a DeviceDiagnostics packet.
+
+    The buffer is scanned once, only offsets are stored. Values are decoded on first
+    access using the registered decoders. If a (component, valueId) pair occurs more
+    than once, the last occurrence wins.
+    """
+
+    __slots__ = ("_buffer", "_spans", "_values")
+
+    def __init__(self, buffer: bytes, spans: Dict[DiagnosticKey, Tuple[int, int]]):
+        self._buffer = memoryview(buffer)
+        self._spans = spans
+        self._values = {}  # type: Dict[DiagnosticKey, Any]
+
+    @classmethod
+    def fromBody(cls, data: bytes, offset: int = 0) -> "DiagnosticsIndex":
+        """
+        Index the encoded DeviceDiagnostics body (array length + TLVs) starting at offset.
+        """
+        try:
+            (count,) = _countPacker.unpack_from(data, offset)
+        except struct.error:
+            raise DeserializeError("DeviceDiagnostics is too short: {} bytes".format(len(data)))
+        spans = {}
+        end = offset + _countPacker.size
+        for component, valueId, start, end in tlv_spans(data, end, count):
+            spans[(component, valueId)] = (start, end)
+        if end != len(data):
+            raise DeserializeError(
+                "DeviceDiagnostics has superfluous(unread) bytes: {}".format(len(data) - end)
+            )
+        return cls(data, spans)
+
+    @classmethod
+    def fromPacket(cls, data: bytes) -> "DiagnosticsIndex":
+        """
+        Index a complete received DeviceDiagnostics frame (header included) without
+        deserializing it into message objects.
+        """
+        if len(data) < HDR_SIZE + 1:
+            raise DeserializeError("Too small packet: {}".format(len(data)))
+        length, sequence, subprot, prot_ver = _hdrPacker.unpack_from(data)
+        if subprot != subProtocols.DEVICE_CONTROL.value:
+            raise DeserializeError("Not a DeviceControl packet: subprotocol {}".format(subprot))
+        if prot_ver != pd.DevControlSubProt.version:
+            raise DeserializeVersionError(
+                "Subprotcol {} version doesn't match: have {} want {}".format(
+                    subprot, prot_ver, pd.DevControlSubProt.version
+                ),
+                subprot,
+                prot_ver,
+                sequence,
+                pd.DevControlSubProt.version,
+            )
+        if length != len(data):
+            raise DeserializeError("Packet has superfluous bytes: {}".format(data[length:]))
+        if data[HDR_SIZE] != DIAGNOSTICS_CMD:
+            raise DeserializeError("Not a DeviceDiagnostics packet: {}".format(data[HDR_SIZE]))
+        return cls.fromBody(data, HDR_SIZE + 1)
+
+    @classmethod
+    def fromMessage(cls, message: BaseMessage) -> "DiagnosticsIndex":
+        """
+        Index an already deserialized DeviceDiagnostics message.
+        """
+        buffer = bytearray()
+        spans = {}
+        for tlv in message["diagnostics"]:
+            start = len(buffer)
+            buffer.extend(tlv["data"])
+            spans[(tlv["component"], tlv["valueId"])] = (start, len(buffer))
+        return cls(bytes(buffer), spans)
+
+    def __contains__(self, key: DiagnosticKey) -> bool:
+        return key in self._spans
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+    def __iter__(self) -> Iterator[DiagnosticKey]:
+        return iter(self._spans)
+
+    def __getitem__(self, key: DiagnosticKey) -> Any:
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        start, end = self._spans[key]
+        raw = self._buffer[start:end]
+        decoder = _decoders.get(key)
+        value = decoder(raw) if decoder is not None else bytes(raw)
+        self._values[key] = value
+        return value
+
+    def get(self, component: int, valueId: int, default: Any = None) -> Any:
+        key = (component, valueId)
+        if key not in self._spans:
+            return default
+        return self[key]
+
+    def raw(self, component: int, valueId: int) -> Optional[memoryview]:
+        span = self._spans.get((component, valueId))
+        if span is None:
+            return None
+        return self._buffer[span[0] : span[1]]
+
+    def keys(self):
+        return self._spans.keys()
+
+    def components(self) -> Dict[int, Tuple[int, ...]]:
+        res = {}  # type: Dict[int, Tuple[int, ...]]
+        for component, valueId in self._spans:
+            res[component] = res.get(component, ()) + (valueId,)
+        return res
+
+    def getDict(self) -> Dict[DiagnosticKey, Any]:
+        return {key: self[key] for key in self._spans}
+
+    def __repr__(self):
+        return "DiagnosticsIndex(%s)" % ", ".join("%d:%d" % k for k in self._spans)
@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 class PplException(Exception):
     pass
 
@@ -8,17 +11,49 @@ class TimeoutError(PplException):
 class ResponseError(PplException):
     pass
 
+class ResponseDecodeError(ResponseError):
+    """The device answered a query with a packet which could not be deserialized."""
+    pass
+
+class VersionMismatchError(ResponseDecodeError):
+    """The device answered a query with another version of the subprotocol."""
+    def __init__(self, message: str, subprotocol, device_version: int, expected_version: Optional[int]):
+        super().__init__(message)
+        self.subprot = subprotocol
+        self.device_version = device_version
+        self.expected_version = expected_version
+
+class NodeNotIdleError(ResponseError):
+    """The node can't be paired with, it is e.g. paired with another server. Unpair it first (forceUnpair)."""
+    def __init__(self, message: str, state):
+        super().__init__(message)
+        self.state = state
+
+class TemplateError(PplException):
+    """A device of a config template could not be rendered, see ppl.configTemplate."""
+    pass
+
+class BundleError(PplException):
+    """A configuration bundle can't be used, see ppl.bundle."""
+    pass
+
 """ Serialization related exceptions """
 
 class DeserializeError(PplException):
-    pass
+    def __init__(self, message: str, subprotocol=None, sequence: Optional[int] = None):
+        """
+        :param subprotocol: Subprotocol from the header, if the header could be read
+        :param sequence: Sequence number from the header, if the header could be read
+        """
+        super().__init__(message)
+        self.subprot = subprotocol
+        self.sequence_number = sequence
 
 class DeserializeVersionError(DeserializeError):
-    def __init__(self, message: str, subprotocol, subprot_ver: int, sequence: int):
-        super(DeserializeError, self).__init__(message)
-        self.subprot = subprotocol
+    def __init__(self, message: str, subprotocol, subprot_ver: int, sequence: int, expected_ver: Optional[int] = None):
+        super().__init__(message, subprotocol, sequence)
         self.subprot_version = subprot_ver
-        self.sequence_number = sequence
+        self.expected_version = expected_ver
 
 class SerializeError(PplException):
-    pass
\ No newline at end of file
+    pass
@@ -1,16 +1,34 @@
 import string
-from typing import Union
+from typing import Any, Dict, Iterable, List, Union
 
 
 class MacAddressValueError(ValueError):
     pass
 
 
+# Value of every valid octet string ("0" to "ff", either case), parses an octet by one lookup
+_OCTETS = {}  # type: Dict[str, int]
+for _high in string.hexdigits:
+    _OCTETS[_high] = int(_high, 16)
+    for _low in string.hexdigits:
+        _OCTETS[_high + _low] = int(_high + _low, 16)
+del _high, _low
+
+
 class MacAddress:
-    __slots__ = ("_mac", "__weakref__")
+    __slots__ = ("_mac", "_str", "__weakref__")
 
     @classmethod
     def _parse_from_string(cls, mac_str):
+        try:
+            o1, o2, o3, o4, o5, o6 = mac_str.split(":")
+            return (
+                _OCTETS[o1] << 40 | _OCTETS[o2] << 32 | _OCTETS[o3] << 24
+                | _OCTETS[o4] << 16 | _OCTETS[o5] << 8 | _OCTETS[o6]
+            )
+        except (ValueError, KeyError):
+            pass
+        # Invalid, the slow path finds out why
         if not mac_str:
             raise MacAddressValueError("MAC cannot be empty.")
 
@@ -38,6 +56,35 @@ class MacAddress:
         octet_int = int(octet_str, 16)
         return octet_int
 
+    @classmethod
+    def fromInt(cls, value: int) -> "MacAddress":
+        """
+        Wraps a 48 bit value without checking it, for values known to fit (e.g. decoded ones).
+        """
+        mac = object.__new__(cls)
+        mac._mac = value
+        mac._str = None
+        return mac
+
+    @classmethod
+    def parseMany(cls, values: Iterable[Union[bytes, str, int, "MacAddress"]]) -> List["MacAddress"]:
+        """
+        Converts many addresses at once, e.g. the routes of a configuration. Each distinct
+        address is parsed once, repeated ones (like the next hop of routes) share the instance.
+        """
+        parsed = {}  # type: Dict[Any, MacAddress]
+        result = []
+        for value in values:
+            if isinstance(value, MacAddress):
+                result.append(value)
+                continue
+            try:
+                mac = parsed[value]
+            except KeyError:
+                mac = parsed[value] = cls(value)
+            result.append(mac)
+        return result
+
     def __init__(self, value: Union[bytes, str, int]):
         if isinstance(value, bytes):
             if len(value) != 6:
@@ -53,6 +100,7 @@ class MacAddress:
             # Assume input argument to be string or any object representation
             # which converts into a formatted MAC string.
             self._mac = self._parse_from_string(str(value))
+        self._str = None
 
     def __int__(self):
         return self._mac
@@ -79,10 +127,13 @@ class MacAddress:
         return "%s(%r)" % (self.__class__.__name__, str(self))
 
     def __str__(self):
-        return ":".join(map("{:02x}".format, self._mac.to_bytes(6, "big")))
+        # Formatted once, addresses are immutable
+        if self._str is None:
+            self._str = ":".join(map("{:02x}".format, self._mac.to_bytes(6, "big")))
+        return self._str
 
     def __reduce__(self):
         return self.__class__, (self._mac,)
 
     def __hash__(self):
-        return hash(hex(int(self._mac)))
+        return hash(self._mac)
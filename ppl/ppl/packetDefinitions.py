@@ -37,7 +37,9 @@ from .protocol import (
     subProtocols,
 )
 
-from ppl.util import ts_print
+from ppl.util import StyleAdapter, getLogger
+
+logger = StyleAdapter(getLogger(__name__))
 
 
 MEAS_MAXSTATIONS = 10
@@ -592,23 +594,58 @@ def supports_feature(feature_set: List[SubProtocolInfo], feature: subProtocols)
     return False
 
 
-def deserialize_message_raw(data: bytes) -> Tuple[Optional[int], Optional[SubProtocol]]:
-    return protocol.deserialize_message(data)
-
+def split_host_config(
+    host_config: Dict, limit: int = protocol.PACKET_SIZE_LIMIT
+) -> Tuple[Dict, List[List[BaseMessage]]]:
+    """
+    Splits the routes of a SetHostConfig which does not fit into one packet.
 
-def deserialize_message(data: bytes) -> Tuple[subProtocols, Optional[int], Optional[BaseMessage]]:
+    :param host_config: Fields of the SetHostConfig
+    :param limit: Maximum encoded size of a message
+    :returns: The fields of the SetHostConfig with the routes fitting into it and the remaining
+        routes in batches fitting into one AddHostRoutes each
+    """
+    routes = list(host_config["routes"])
+    first = dict(host_config, routes=[])
+    size = ConfigSubProt.encoded_size(ConfigSubProt(SetHostConfig(**first)))
+    addSize = ConfigSubProt.encoded_size(ConfigSubProt(AddHostRoutes(routes=[])))
+    if size > limit:
+        # Traffic filters alone are too large, serializing reports it
+        return host_config, []
+
+    batches = []  # type: List[List[BaseMessage]]
+    batch = first["routes"]
+    for entry in routes:
+        route = RTLookup.validate(entry)
+        if route is None:
+            raise SerializeError("Invalid route in host config: {}".format(entry))
+        routeSize = RTLookup.encoded_size(route)
+        if size + routeSize > limit and (batch or not batches):
+            batch = []
+            batches.append(batch)
+            size = addSize
+        batch.append(route)
+        size += routeSize
+    return first, batches
+
+
+def deserialize_message_raw(
+    data: bytes, raw_addresses: bool = False
+) -> Tuple[Optional[int], Optional[SubProtocol]]:
+    return protocol.deserialize_message(data, raw_addresses)
+
+
+def deserialize_message(
+    data: bytes, raw_addresses: bool = False
+) -> Tuple[subProtocols, Optional[int], Optional[BaseMessage]]:
     try:
-        seq, msg = protocol.deserialize_message(data)
+        seq, msg = protocol.deserialize_message(data, raw_addresses)
         return msg.get_subprotocol(), seq, msg.get_packet()
     except DeserializeVersionError as e:
-        if e.subprot == subProtocols.DISCOVERY.value:
-            ts_print(f"Version mismatch during deserialization: {e}")
-        else:
-            
-            ts_print(f"Version mismatch during deserialization: {e}")
-        return e.subprot, e.sequence_number, None
+        logger.info("Version mismatch during deserialization: {}", e)
+        return subProtocols(e.subprot), e.sequence_number, None
     except DeserializeError as e:
-        ts_print(f"Could not deserialize: {e}")
+        logger.info("Could not deserialize: {}", e)
         return subProtocols.INVALID, None, None
 
 
@@ -616,5 +653,5 @@ def serialize_message(msg: protocol.SubProtocol, seq: int) -> Tuple[Optional[int
     try:
         return seq, protocol.serialize_message(msg, seq)
     except SerializeError as e:
-        ts_print(f"Could not serialize: {e}")
+        logger.info("Could not serialize: {}", e)
         return None, None
@@ -0,0 +1,341 @@
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left, bisect_right
+from ipaddress import IPv4Address, ip_address
+from typing import Any, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import ppl.packetDefinitions as pd
+from ppl.exceptions import DeserializeError
+from ppl.protocol import BaseMessage, subProtocols
+from ppl.util import StyleAdapter, getLogger, ts_print
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+"""
+Fixed record storage for protocol logs (ProtLogHeader / ProtLogData)
+
+    A log file consists of a file header followed by fixed size records:
+
+    struct {
+        char     magic[8];          // PROTLOG_MAGIC
+        uint16_t version;           // PROTLOG_VERSION
+        uint16_t entrySize;         // ProtLogHeader.entrySize
+        uint32_t recordSize;        // Size of one record (see below)
+        uint8_t  headerData[1380];  // ProtLogHeader.data, as sent by the device
+    }                               // padded with zeros to PROTLOG_DATA_OFFSET
+
+    struct {
+        double   timestamp;         // Host receive time (seconds since epoch)
+        uint32_t device;            // IPv4 address of the sending device
+        uint16_t chunk;             // ProtLogData.index the entry was part of
+        uint16_t slot;              // Position of the entry inside the chunk
+        uint8_t  entry[entrySize];  // Raw log entry
+    }                               // padded with zeros to a multiple of 8
+
+    All values are little endian, so the data section can be mapped directly with
+    numpy.memmap(path, dtype=recordDtype(entrySize), offset=PROTLOG_DATA_OFFSET).
+
+    Next to the log a small index file (<path>.idx) is written. It holds one entry per
+    received ProtLogData chunk:
+
+    struct {
+        double   timestamp;
+        uint32_t device;
+        uint16_t chunk;
+        uint16_t total;
+        uint64_t firstRecord;
+        uint32_t recordCount;
+        uint32_t reserved;
+    }
+
+    which allows slicing multi-GB captures by device and time without reading them.
+"""
+
+logger = StyleAdapter(getLogger(__name__))
+
+PROTLOG_MAGIC = b"PPLPLOG\0"
+PROTLOG_VERSION = 1
+PROTLOG_HEADER_STR = "<8sHHI"
+PROTLOG_HEADER_DATA_SIZE = 1380
+PROTLOG_DATA_OFFSET = 1408
+PROTLOG_RECORD_HDR_STR = "<dIHH"
+PROTLOG_RECORD_HDR_SIZE = struct.calcsize(PROTLOG_RECORD_HDR_STR)
+PROTLOG_INDEX_STR = "<dIHHQII"
+PROTLOG_INDEX_SIZE = struct.calcsize(PROTLOG_INDEX_STR)
+PROTLOG_INDEX_SUFFIX = ".idx"
+
+assert struct.calcsize(PROTLOG_HEADER_STR) + PROTLOG_HEADER_DATA_SIZE <= PROTLOG_DATA_OFFSET
+
+
+class ProtLogChunk(NamedTuple):
+    timestamp: float
+    device: IPv4Address
+    chunk: int
+    total: int
+    firstRecord: int
+    recordCount: int
+
+
+def recordSize(entrySize: int) -> int:
+    return (PROTLOG_RECORD_HDR_SIZE + entrySize + 7) & ~7
+
+
+def recordDtype(entrySize: int) -> Any:
+    """
+    Structured numpy dtype of one record for the given entry size.
+
+    :param      entrySize:  ProtLogHeader.entrySize of the capture
+
+    :returns:   numpy.dtype describing a record (requires numpy)
+    """
+    if numpy is None:
+        raise RuntimeError("numpy is required to create a record dtype")
+    return numpy.dtype(
+        {
+            "names": ["timestamp", "device", "chunk", "slot", "entry"],
+            "formats": ["<f8", "<u4", "<u2", "<u2", ("u1", (entrySize,))],
+            "offsets": [0, 8, 12, 14, PROTLOG_RECORD_HDR_SIZE],
+            "itemsize": recordSize(entrySize),
+        }
+    )
+
+
+def _deviceToInt(device: Union[str, int, IPv4Address, Tuple[str, int]]) -> int:
+    if isinstance(device, tuple):
+        device = device[0]
+    return int(ip_address(device))
+
+
+class ProtLogWriter:
+    def __init__(self, path: str, header: BaseMessage, indexPath: Optional[str] = None):
+        entrySize = header["entrySize"]
+        if entrySize <= 0:
+            raise ValueError(f"Invalid log entry size: {entrySize}")
+        self.path = path
+        self.indexPath = indexPath if indexPath is not None else path + PROTLOG_INDEX_SUFFIX
+        self.entrySize = entrySize
+        self.recordSize = recordSize(entrySize)
+        self.recordCount = 0
+        self._recordPad = bytes(self.recordSize - PROTLOG_RECORD_HDR_SIZE - entrySize)
+        self._recordHdr = struct.Struct(PROTLOG_RECORD_HDR_STR)
+        self._index = struct.Struct(PROTLOG_INDEX_STR)
+
+        fileHeader = bytearray(PROTLOG_DATA_OFFSET)
+        struct.pack_into(
+            PROTLOG_HEADER_STR, fileHeader, 0, PROTLOG_MAGIC, PROTLOG_VERSION, entrySize, self.recordSize
+        )
+        headerData = bytes(header["data"])
+        start = struct.calcsize(PROTLOG_HEADER_STR)
+        fileHeader[start : start + len(headerData)] = headerData
+
+        self.file = open(path, "wb")
+        self.indexFile = open(self.indexPath, "wb")
+        self.file.write(fileHeader)
+
+    def __enter__(self) -> "ProtLogWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.indexFile.close()
+            self.file = None
+            self.indexFile = None
+
+    def flush(self) -> None:
+        self.file.flush()
+        self.indexFile.flush()
+
+    def append(
+        self,
+        device: Union[str, int, IPv4Address, Tuple[str, int]],
+        logData: BaseMessage,
+        timestamp: Optional[float] = None,
+    ) -> int:
+        """
+        Split a ProtLogData chunk into entries and append them as records.
+
+        :param      device:     Address of the sending device
+        :param      logData:    Received ProtLogData packet
+        :param      timestamp:  Receive time, defaults to now
+
+        :returns:   Number of records written
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        deviceInt = _deviceToInt(device)
+        chunk = logData["index"]
+        data = bytes(logData["data"])
+        length = logData["debugLength"]
+        if length == 0 or length > len(data):
+            length = len(data)
+        count = length // self.entrySize
+        if length % self.entrySize:
+            logger.warning(
+                "ProtLog chunk {} from {}: dropping {} trailing bytes",
+                chunk,
+                ip_address(deviceInt),
+                length % self.entrySize,
+            )
+
+        out = bytearray(count * self.recordSize)
+        view = memoryview(data)
+        offset = 0
+        for slot in range(count):
+            self._recordHdr.pack_into(out, offset, timestamp, deviceInt, chunk, slot)
+            start = offset + PROTLOG_RECORD_HDR_SIZE
+            out[start : start + self.entrySize] = view[slot * self.entrySize : (slot + 1) * self.entrySize]
+            offset += self.recordSize
+        self.file.write(out)
+        self.indexFile.write(
+            self._index.pack(timestamp, deviceInt, chunk, logData["total"], self.recordCount, count, 0)
+        )
+        self.recordCount += count
+        return count
+
+    def subscriber(self):
+        """
+        Subscriber to be registered at the UdpServer, writes every received ProtLogData.
+        """
+
+        async def protLogHandler(command, sequence: int, message, address: Tuple[str, int]) -> bool:
+            if command != subProtocols.MEASUREMENT or not isinstance(message, pd.ProtLogData):
+                return False
+            self.append(address, message)
+            return True
+
+        return protLogHandler
+
+
+class ProtLogReader:
+    def __init__(self, path: str, indexPath: Optional[str] = None):
+        self.path = path
+        self.indexPath = indexPath if indexPath is not None else path + PROTLOG_INDEX_SUFFIX
+
+        self.file = open(path, "rb")
+        header = self.file.read(PROTLOG_DATA_OFFSET)
+        if len(header) < PROTLOG_DATA_OFFSET:
+            raise DeserializeError(f"{path} is too short to be a protocol log")
+        magic, version, self.entrySize, self.recordSize = struct.unpack_from(PROTLOG_HEADER_STR, header)
+        if magic != PROTLOG_MAGIC:
+            raise DeserializeError(f"{path} is not a protocol log")
+        if version != PROTLOG_VERSION:
+            raise DeserializeError(f"{path}: log version {version} is not supported (want {PROTLOG_VERSION})")
+        start = struct.calcsize(PROTLOG_HEADER_STR)
+        self.headerData = header[start : start + PROTLOG_HEADER_DATA_SIZE]
+
+        size = os.fstat(self.file.fileno()).st_size
+        self.recordCount = (size - PROTLOG_DATA_OFFSET) // self.recordSize
+        self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+        self.chunks = self._loadIndex()
+        self._chunkTimes = [c.timestamp for c in self.chunks]
+
+    def _loadIndex(self) -> List[ProtLogChunk]:
+        chunks = []
+        try:
+            with open(self.indexPath, "rb") as file:
+                raw = file.read()
+        except FileNotFoundError:
+            ts_print(f"No index found for {self.path}, slicing by device/time is unavailable")
+            return chunks
+        for fields in struct.iter_unpack(PROTLOG_INDEX_STR, raw[: len(raw) - len(raw) % PROTLOG_INDEX_SIZE]):
+            timestamp, device, chunk, total, first, count, _ = fields
+            if first + count > self.recordCount:
+                # Writer was interrupted before the records hit the disk
+                break
+            chunks.append(ProtLogChunk(timestamp, IPv4Address(device), chunk, total, first, count))
+        # Chunks are written in receive order, keep the time lookup valid for unsorted clocks
+        chunks.sort(key=lambda c: c.timestamp)
+        return chunks
+
+    def __enter__(self) -> "ProtLogReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Entries of records() are still referenced, the map is closed once they are gone
+                pass
+            self._mmap = None
+        self.file.close()
+
+    def __len__(self) -> int:
+        return self.recordCount
+
+    def selectChunks(
+        self,
+        device: Optional[Union[str, IPv4Address]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> List[ProtLogChunk]:
+        lo = bisect_left(self._chunkTimes, start) if start is not None else 0
+        hi = bisect_right(self._chunkTimes, end) if end is not None else len(self.chunks)
+        selected = self.chunks[lo:hi]
+        if device is not None:
+            device = ip_address(device)
+            selected = [c for c in selected if c.device == device]
+        return selected
+
+    def memmap(self) -> Any:
+        """
+        Map all records as a numpy structured array without reading them.
+        """
+        if numpy is None:
+            raise RuntimeError("numpy is required to memory map a protocol log")
+        return numpy.memmap(
+            self.path,
+            dtype=recordDtype(self.entrySize),
+            mode="r",
+            offset=PROTLOG_DATA_OFFSET,
+            shape=(self.recordCount,),
+        )
+
+    def records(
+        self,
+        device: Optional[Union[str, IPv4Address]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> Iterator[Tuple[float, IPv4Address, int, int, memoryview]]:
+        """
+        Iterate over (timestamp, device, chunk, slot, entry) of the selected chunks.
+        Entries are zero-copy views into the mapped file, they must not be used after close().
+        """
+        if self._mmap is None:
+            return
+        view = memoryview(self._mmap)
+        try:
+            for c in self.selectChunks(device, start, end):
+                offset = PROTLOG_DATA_OFFSET + c.firstRecord * self.recordSize
+                for _ in range(c.recordCount):
+                    timestamp, _, chunk, slot = struct.unpack_from(PROTLOG_RECORD_HDR_STR, view, offset)
+                    entryStart = offset + PROTLOG_RECORD_HDR_SIZE
+                    yield timestamp, c.device, chunk, slot, view[entryStart : entryStart + self.entrySize]
+                    offset += self.recordSize
+        finally:
+            view.release()
+
+    def slices(
+        self,
+        device: Optional[Union[str, IPv4Address]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+    ) -> List[Any]:
+        """
+        numpy views of the records belonging to the selected chunks.
+        """
+        records = self.memmap()
+        return [records[c.firstRecord : c.firstRecord + c.recordCount] for c in self.selectChunks(device, start, end)]
@@ -1,24 +1,38 @@
 import math
 import numbers
 import struct
+import threading
 from abc import ABC, abstractmethod
 from binascii import hexlify
 from collections.abc import Iterable
 from enum import Enum, unique
 from ipaddress import IPv4Address, ip_address
-from typing import Any, Dict, KeysView, List, Tuple, Type, Union
+from typing import Any, Dict, Iterator, KeysView, List, Optional, Tuple, Type, Union
 
 from .exceptions import DeserializeError, DeserializeVersionError, SerializeError
 from .macaddress import MacAddress
 from .enums import AutoNumber
-from .util import ts_print
+from .util import StyleAdapter, getLogger
 
-# logger = StyleAdapter(getLogger(__name__))
+logger = StyleAdapter(getLogger(__name__))
 
 # Size (in bytes) that a packet is allowed to have
 PACKET_SIZE_LIMIT = 1400
 
 
+class _DecodeContext(threading.local):
+    """
+    Options of the deserialize_message() running in the current thread. Decode workers of
+    other threads (DecodePool) have their own.
+    """
+
+    # MAC and IP members are decoded to plain ints instead of MacAddress / IPv4Address
+    raw_addresses = False
+
+
+_decode_context = _DecodeContext()
+
+
 # Parts adapted from https://github.com/facebook/gnlpy
 
 
@@ -63,6 +77,29 @@ class BaseType(ABC):
     def unpack(cls, data: bytes) -> Tuple[int, Any]:
         pass
 
+    @classmethod
+    def encoded_size(cls, val: Any) -> int:
+        """Number of bytes pack() produces for val."""
+        return len(cls.pack(val))
+
+    @classmethod
+    def pack_into(cls, buf: bytearray, offset: int, val: Any) -> int:
+        """
+        Writes val into buf at offset, buf must have room for encoded_size(val) bytes.
+
+        :returns: Offset behind the written bytes
+        """
+        data = cls.pack(val)
+        end = offset + len(data)
+        buf[offset:end] = data
+        return end
+
+
+def _pack_buffer(packer, val: Any) -> bytes:
+    buf = bytearray(packer.encoded_size(val))
+    packer.pack_into(buf, 0, val)
+    return bytes(buf)
+
 
 class _structType(BaseType):
     _fmt = ""
@@ -70,11 +107,31 @@ class _structType(BaseType):
     _packetObj: struct.Struct
 
 
+# Struct format characters of integers, their range is checked without packing
+_INT_FORMATS = "bBhHiIlLqQ"
+
+
+def _int_bounds(fmt: str) -> Optional[Tuple[int, int]]:
+    """
+    Smallest and largest value of a single integer struct format, None for other formats.
+    """
+    code = fmt.lstrip("@=<>!")
+    if len(code) != 1 or code not in _INT_FORMATS:
+        return None
+    bits = struct.calcsize(fmt) * 8
+    if code.islower():
+        return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    return 0, (1 << bits) - 1
+
+
 def create_struct_fmt_type(fmt: str) -> Type[_structType]:
+    bounds = _int_bounds(fmt)
+
     class StructFmtType(_structType):
         _fmt = fmt
         _size = struct.calcsize(fmt)
         _packetObj = struct.Struct(fmt)
+        _bounds = bounds
 
         @staticmethod
         def default():
@@ -82,11 +139,17 @@ def create_struct_fmt_type(fmt: str) -> Type[_structType]:
 
         @classmethod
         def validate(cls, val: numbers.Number):
+            if bounds is not None and type(val) is int:
+                return val if bounds[0] <= val <= bounds[1] else None
             if not isinstance(val, numbers.Number):
                 raise SerializeError("Invalid type: {} must be a number!".format(val))
+            if bounds is not None:
+                if not isinstance(val, numbers.Integral):
+                    return None
+                return val if bounds[0] <= val <= bounds[1] else None
             try:
-                cls.pack(val)
-            except SerializeError:
+                cls._packetObj.pack(val)
+            except (struct.error, OverflowError):
                 return None
             return val
 
@@ -96,18 +159,35 @@ def create_struct_fmt_type(fmt: str) -> Type[_structType]:
             try:
                 res = cls._packetObj.pack(val)
             except struct.error:
-                ts_print("Couldnt pack value")
-                ts_print((fmt, val))
+                logger.debug("Couldnt pack value {} for format {}", val, fmt)
                 raise SerializeError("Couldnt pack value: {} for format {}".format(val, fmt))
             return res
 
+        @classmethod
+        def encoded_size(cls, val: numbers.Number) -> int:
+            return cls._size
+
+        @classmethod
+        def pack_into(cls, buf: bytearray, offset: int, val: numbers.Number) -> int:
+            assert val is not None, "Did not validate() before packing."
+            try:
+                cls._packetObj.pack_into(buf, offset, val)
+            except struct.error:
+                logger.debug("Couldnt pack value {} for format {}", val, fmt)
+                raise SerializeError("Couldnt pack value: {} for format {}".format(val, fmt))
+            return offset + cls._size
+
+        @classmethod
+        def padded_length(cls, val: int) -> int:
+            """Number of array items a length field of val announces."""
+            return val
+
         @classmethod
         def unpack(cls, data: bytes) -> Tuple[int, Any]:
             try:
                 res = cls._packetObj.unpack(data[0 : cls._size])[0]
             except (struct.error, ValueError):
-                ts_print("Couldnt unpack value")
-                ts_print((fmt, data))
+                logger.debug("Couldnt unpack value {!r} for format {}", data, fmt)
                 raise DeserializeError(
                     "Couldnt unpack value: {!s} for format {}".format(hexlify(data), fmt)
                 )
@@ -124,12 +204,33 @@ def create_tlv_length_packer(fmt: str = ">B", align: int = 4):
         def default():
             raise SerializeError("Must not call default() on length packer.")
 
+        @classmethod
+        def validate(cls, val: int):
+            if fmt_type.validate(math.ceil((val + fmt_type._size) / align)) is None:
+                return None
+            return val
+
         @classmethod
         def pack(cls, val: int) -> bytes:
             assert val is not None, "Did not validate() before packing."
             val = math.ceil((val + fmt_type._size) / align)
             return fmt_type.pack(val)
 
+        @classmethod
+        def pack_into(cls, buf: bytearray, offset: int, val: int) -> int:
+            assert val is not None, "Did not validate() before packing."
+            return fmt_type.pack_into(buf, offset, math.ceil((val + fmt_type._size) / align))
+
+        @classmethod
+        def padded_length(cls, val: int) -> int:
+            # Data is padded up to the alignment, the length field counts itself
+            aligned = math.ceil((val + fmt_type._size) / align)
+            if aligned <= 1:
+                raise SerializeError(
+                    "TLV length {} is not allowed. Header + data require length of 2.".format(aligned)
+                )
+            return aligned * align - fmt_type._size
+
         @classmethod
         def unpack(cls, data: bytes) -> Tuple[int, Any]:
             lenlen, result = fmt_type.unpack(data)
@@ -148,12 +249,22 @@ def create_enum_type(fmt: str, enumeration: Type[Enum]):
     try:
         enumeration(0)
     except ValueError as e:
-        ts_print(e)
+        logger.debug("{}", e)
         raise SerializeError("Enum {} does not have a zero value.".format(type(enumeration)))
 
+    packetObj = struct.Struct(fmt)
+    # Members whose value fits into fmt, everything else is rejected by validate()
+    packable = set()
+    for member in enumeration:
+        try:
+            packetObj.pack(member.value)
+        except (struct.error, ValueError):
+            continue
+        packable.add(member)
+
     class StructEnumType(BaseType):
         _size = struct.calcsize(fmt)
-        _packetObj = struct.Struct(fmt)
+        _packetObj = packetObj
 
         @staticmethod
         def default():
@@ -161,7 +272,7 @@ def create_enum_type(fmt: str, enumeration: Type[Enum]):
 
         @classmethod
         def validate(cls, val: Any):
-            if isinstance(val, int):
+            if isinstance(val, int) and not isinstance(val, enumeration):
                 try:
                     val = enumeration(val)
                 except ValueError:
@@ -169,13 +280,11 @@ def create_enum_type(fmt: str, enumeration: Type[Enum]):
             if isinstance(val, str):
                 try:
                     val = enumeration[val]
-                except ValueError:
+                except (KeyError, ValueError):
                     return None
-            try:
-                cls.pack(val)
-            except SerializeError:
-                return None
-            return val
+            if isinstance(val, enumeration) and val in packable:
+                return val
+            return None
 
         @classmethod
         def pack(cls, val: Enum) -> bytes:
@@ -185,18 +294,32 @@ def create_enum_type(fmt: str, enumeration: Type[Enum]):
             try:
                 res = cls._packetObj.pack(val.value)
             except ValueError:
-                ts_print("Couldnt pack value")
-                ts_print((fmt, val))
+                logger.debug("Couldnt pack value {} for format {}", val, fmt)
                 raise SerializeError("Couldnt pack value: {} for format {}".format(val, fmt))
             return res
 
+        @classmethod
+        def encoded_size(cls, val: Enum) -> int:
+            return cls._size
+
+        @classmethod
+        def pack_into(cls, buf: bytearray, offset: int, val: Enum) -> int:
+            assert val is not None, "Did not validate() before packing."
+            if not isinstance(val, enumeration):
+                raise SerializeError("Invalid type: {} must be a number!".format(val))
+            try:
+                cls._packetObj.pack_into(buf, offset, val.value)
+            except (struct.error, ValueError):
+                logger.debug("Couldnt pack value {} for format {}", val, fmt)
+                raise SerializeError("Couldnt pack value: {} for format {}".format(val, fmt))
+            return offset + cls._size
+
         @classmethod
         def unpack(cls, data: bytes) -> Tuple[int, Any]:
             try:
                 res = enumeration(cls._packetObj.unpack(data[0 : cls._size])[0])
             except (struct.error, ValueError):
-                ts_print("Couldnt unpack value")
-                ts_print((fmt, data))
+                logger.debug("Couldnt unpack value {!r} for format {}", data, fmt)
                 raise DeserializeError(
                     "Couldnt unpack value: {!s} for format {}".format(hexlify(data), fmt)
                 )
@@ -207,7 +330,8 @@ def create_enum_type(fmt: str, enumeration: Type[Enum]):
 
 class MACAddressType(BaseType):
     __slots__ = ()
-    _packetObj = struct.Struct(">Q")
+    # Upper 16 and lower 32 bits, writes the 6 bytes without a temporary
+    _splitPacketObj = struct.Struct(">HI")
 
     @staticmethod
     def default():
@@ -215,6 +339,8 @@ class MACAddressType(BaseType):
 
     @classmethod
     def validate(cls, val: Any):
+        if type(val) is MacAddress:
+            return val
         try:
             return MacAddress(val)
         except ValueError:
@@ -222,23 +348,32 @@ class MACAddressType(BaseType):
 
     @classmethod
     def pack(cls, val: MacAddress) -> bytes:
-        if not isinstance(val, MacAddress):
-            val = cls.validate(val)
-            assert val is not None, "Did not validate() before packing."
+        return _pack_buffer(cls, val)
+
+    @classmethod
+    def encoded_size(cls, val: MacAddress) -> int:
+        return 6
+
+    @classmethod
+    def pack_into(cls, buf: bytearray, offset: int, val: MacAddress) -> int:
+        # Plain ints are members of messages decoded with raw_addresses
+        if type(val) is not int:
+            if not isinstance(val, MacAddress):
+                val = cls.validate(val)
+                assert val is not None, "Did not validate() before packing."
+            val = int(val)
         try:
-            res = cls._packetObj.pack(int(val))[2::]
+            cls._splitPacketObj.pack_into(buf, offset, val >> 32, val & 0xFFFFFFFF)
         except struct.error:
             raise SerializeError("Couldnt pack macaddress: {}".format(val))
-
-        return res
+        return offset + 6
 
     @classmethod
     def unpack(cls, data: bytes) -> Tuple[int, Any]:
-        try:
-            res = MacAddress(cls._packetObj.unpack(b"\x00\x00" + data[0:6])[0])
-        except struct.error:
+        if len(data) < 6:
             raise DeserializeError("Couldnt unpack macaddress: {!s}".format(hexlify(data)))
-        return 6, res
+        value = int.from_bytes(data[0:6], "big")
+        return 6, value if _decode_context.raw_addresses else MacAddress.fromInt(value)
 
 
 class IPAddressType(BaseType):
@@ -251,29 +386,44 @@ class IPAddressType(BaseType):
 
     @classmethod
     def validate(cls, val: Any):
+        if isinstance(val, IPv4Address):
+            return val
         try:
-            return ip_address(val)
+            val = ip_address(val)
         except ValueError:
             return None
+        # IPv6 addresses don't fit
+        return val if isinstance(val, IPv4Address) else None
 
     @classmethod
     def pack(cls, val: IPv4Address) -> bytes:
-        val = cls.validate(val)
-        assert val is not None, "Did not validate() before packing."
+        return _pack_buffer(cls, val)
+
+    @classmethod
+    def encoded_size(cls, val: IPv4Address) -> int:
+        return 4
+
+    @classmethod
+    def pack_into(cls, buf: bytearray, offset: int, val: IPv4Address) -> int:
+        # Plain ints are members of messages decoded with raw_addresses
+        if type(val) is not int:
+            if not isinstance(val, IPv4Address):
+                val = cls.validate(val)
+                assert val is not None, "Did not validate() before packing."
+            val = int(val)
         try:
-            res = cls._packetObj.pack(int(val))
+            cls._packetObj.pack_into(buf, offset, val)
         except struct.error:
             raise SerializeError("Couldnt pack ipaddress: {}".format(val))
-
-        return res
+        return offset + 4
 
     @classmethod
     def unpack(cls, data: bytes) -> Tuple[int, Any]:
         try:
-            res = ip_address(cls._packetObj.unpack(data[0:4])[0])
+            value = cls._packetObj.unpack_from(data)[0]
         except struct.error:
             raise DeserializeError("Couldnt unpack ipaddress: {!s}".format(hexlify(data)))
-        return 4, res
+        return 4, value if _decode_context.raw_addresses else IPv4Address(value)
 
 
 class IPAddressLeType(IPAddressType):
@@ -304,9 +454,20 @@ class SizeStringType(BaseType):
 
     @classmethod
     def pack(cls, val: str) -> bytes:
-        assert cls.validate(val) is not None, "Did not validate() before packing."
-        byte_data = bytes(val, encoding="latin-1")
-        return cls._lengthpacker.pack(len(byte_data)) + byte_data
+        return _pack_buffer(cls, val)
+
+    @classmethod
+    def encoded_size(cls, val: str) -> int:
+        # latin-1 has one byte per character
+        return cls._lengthpacker._size + len(val)
+
+    @classmethod
+    def pack_into(cls, buf: bytearray, offset: int, val: str) -> int:
+        byte_data = val.encode("latin-1")
+        offset = cls._lengthpacker.pack_into(buf, offset, len(byte_data))
+        end = offset + len(byte_data)
+        buf[offset:end] = byte_data
+        return end
 
     @classmethod
     def unpack(cls, data: bytes) -> Tuple[int, Any]:
@@ -324,6 +485,8 @@ class SizeStringType(BaseType):
 
 
 def create_array_type(inner_packer, length_packer=create_struct_fmt_type(">H")):
+    item_size = inner_packer._size if issubclass(inner_packer, _structType) else None
+
     class ArrayType(BaseType):
         __slots__ = ()
         _lengthpacker = length_packer
@@ -346,14 +509,31 @@ def create_array_type(inner_packer, length_packer=create_struct_fmt_type(">H")):
 
         @classmethod
         def pack(cls, val: List[Any]) -> bytes:
-            assert cls.validate(val) is not None, "Did not validate() before packing."
             assert cls._lengthpacker is not None
-            res = cls._lengthpacker.pack(len(val))
-            _, decoded_len = cls._lengthpacker.unpack(res)
-            pad_by = decoded_len - len(val)
-            for x in val + [inner_packer.default()] * pad_by:
-                res = res + inner_packer.pack(x)
-            return res
+            return _pack_buffer(cls, val)
+
+        @classmethod
+        def encoded_size(cls, val: List[Any]) -> int:
+            size = cls._lengthpacker.encoded_size(len(val))
+            pad_by = cls._lengthpacker.padded_length(len(val)) - len(val)
+            if pad_by:
+                size += pad_by * inner_packer.encoded_size(inner_packer.default())
+            if item_size is not None:
+                return size + len(val) * item_size
+            return size + sum(inner_packer.encoded_size(x) for x in val)
+
+        @classmethod
+        def pack_into(cls, buf: bytearray, offset: int, val: List[Any]) -> int:
+            offset = cls._lengthpacker.pack_into(buf, offset, len(val))
+            pack_into = inner_packer.pack_into
+            for x in val:
+                offset = pack_into(buf, offset, x)
+            pad_by = cls._lengthpacker.padded_length(len(val)) - len(val)
+            if pad_by:
+                default = inner_packer.default()
+                for _ in range(pad_by):
+                    offset = pack_into(buf, offset, default)
+            return offset
 
         @classmethod
         def unpack(cls, data: bytes) -> Tuple[int, Any]:
@@ -400,23 +580,35 @@ def create_fixed_array_type(inner_packer, size: int):
 
             @classmethod
             def pack(cls, val: List[Any]) -> bytes:
-                assert cls.validate(val) is not None, "Did not validate() before packing."
                 try:
                     return fixed_packet.pack(*val)
                 except struct.error:
-                    ts_print("Couldnt pack value")
-                    ts_print((full_fmt, val))
+                    logger.debug("Couldnt pack value {} for format {}", val, full_fmt)
+                    raise SerializeError(
+                        "Couldnt pack value: {} for format {}".format(val, full_fmt)
+                    )
+
+            @classmethod
+            def encoded_size(cls, val: List[Any]) -> int:
+                return fixed_size
+
+            @classmethod
+            def pack_into(cls, buf: bytearray, offset: int, val: List[Any]) -> int:
+                try:
+                    fixed_packet.pack_into(buf, offset, *val)
+                except struct.error:
+                    logger.debug("Couldnt pack value {} for format {}", val, full_fmt)
                     raise SerializeError(
                         "Couldnt pack value: {} for format {}".format(val, full_fmt)
                     )
+                return offset + fixed_size
 
             @classmethod
             def unpack(cls, data: bytes) -> Tuple[int, Any]:
                 try:
                     return fixed_size, list(fixed_packet.unpack(data[0:fixed_size]))
                 except (struct.error, ValueError):
-                    ts_print("Couldnt unpack value")
-                    ts_print((full_fmt, data))
+                    logger.debug("Couldnt unpack value {!r} for format {}", data, full_fmt)
                     raise DeserializeError(
                         "Couldnt unpack value: {!s} for format {}".format(hexlify(data), full_fmt)
                     )
@@ -444,8 +636,17 @@ def create_fixed_array_type(inner_packer, size: int):
 
         @classmethod
         def pack(cls, val: List[Any]) -> bytes:
-            assert cls.validate(val) is not None, "Did not validate() before packing."
-            return b"".join(inner_packer.pack(x) for x in val)
+            return _pack_buffer(cls, val)
+
+        @classmethod
+        def encoded_size(cls, val: List[Any]) -> int:
+            return sum(inner_packer.encoded_size(x) for x in val)
+
+        @classmethod
+        def pack_into(cls, buf: bytearray, offset: int, val: List[Any]) -> int:
+            for x in val:
+                offset = inner_packer.pack_into(buf, offset, x)
+            return offset
 
         @classmethod
         def unpack(cls, data: bytes) -> Tuple[int, Any]:
@@ -486,11 +687,13 @@ DoubleLeType = create_struct_fmt_type("<d")
 
 
 class BaseMessage(ABC):
+    __slots__ = ()
     name = ""
     attrs = {}  # type: Dict[int, Any]
     name_to_key = {}  # type: Dict[str, int]
     key_to_name = {}  # type: Dict[int, str]
     key_to_packer = {}  # type: Dict[int, BaseType]
+    wire_fields = []  # type: List[Tuple[int, str, BaseType]]
 
     @abstractmethod
     def __init__(self, **kwargs):
@@ -546,40 +749,55 @@ class BaseMessage(ABC):
 
 
 def create_packet_type(packet_name: str, *fields: Tuple[str, Any]) -> Type[BaseMessage]:
+    name_to_key = {}
+    key_to_name = {}
+    key_to_packer = {}
+    # Every member is stored in its own slot, the instances don't have a __dict__
+    key_to_slot = {}  # type: Dict[Union[str, int], str]
+    for i, (name, packer) in enumerate(fields):
+        k = i + 1
+        name_to_key[name] = k
+        key_to_name[k] = name
+        key_to_packer[k] = packer
+        key_to_slot[k] = key_to_slot[name] = "_f_" + name
+    # (key, slot, packer) of the members in wire order
+    wire_fields = [(k, key_to_slot[k], key_to_packer[k]) for k in sorted(key_to_packer)]
+    # (key, slot) of the members in the order of getDict(), repr() and iteration (by name)
+    named_fields = [(name_to_key[name], key_to_slot[name]) for name in sorted(name_to_key)]
+
     class BaseMessageClass(BaseMessage):
-        __slots__ = "attrs"
-        name_to_key = {}
-        key_to_name = {}
-        key_to_packer = {}
-        for i, (name, packer) in enumerate(fields):
-            k = i + 1
-            name_to_key[name] = k
-            key_to_name[k] = name
-            key_to_packer[k] = packer
+        __slots__ = tuple(slot for _, slot, _ in wire_fields)
 
         name = packet_name
 
         def __init__(self, **kwargs):
-            self.attrs = {}
-            for name in sorted(self.name_to_key.keys()):
-                if name in kwargs:
-                    if kwargs[name] is None:
-                        kwargs[name] = self.key_to_packer[self.name_to_key[name]].default()
-                    self.set(name, kwargs[name])
-                    del kwargs[name]
-                else:
-                    self.set(name, self.key_to_packer[self.name_to_key[name]].default())
+            for k, slot, packer in wire_fields:
+                value = kwargs.pop(key_to_name[k], None)
+                if value is None:
+                    object.__setattr__(self, slot, packer.default())
+                    continue
+                typed_value = packer.validate(value)
+                if typed_value is None:
+                    raise SerializeError(
+                        "Value is invalid: {} for key {}".format(value, key_to_name[k])
+                    )
+                object.__setattr__(self, slot, typed_value)
             if kwargs:
                 raise SerializeError("Passed superfluous creation parameters: {}".format(kwargs))
 
+        @property
+        def attrs(self) -> Dict[int, Any]:
+            """Copy of the members by key, changes don't affect the message."""
+            return {k: getattr(self, slot) for k, slot in named_fields}
+
         def __contains__(self, key: Union[str, int]):
             if isinstance(key, str):
                 return key in self.name_to_key
-            return key in self.attrs
+            return key in self.key_to_name
 
         def __eq__(self, other):
             if isinstance(other, self.__class__):
-                return self.attrs == other.attrs
+                return all(getattr(self, slot) == getattr(other, slot) for _, slot, _ in wire_fields)
             else:
                 return False
 
@@ -595,7 +813,7 @@ def create_packet_type(packet_name: str, *fields: Tuple[str, Any]) -> Type[BaseM
                 raise SerializeError(
                     "Value is invalid: {} for key {}".format(value, self.key_to_name[key])
                 )
-            self.attrs[key] = typed_value
+            object.__setattr__(self, key_to_slot[key], typed_value)
 
         # Operator overloading
         def __getitem__(self, key, default=_unset):
@@ -603,16 +821,14 @@ def create_packet_type(packet_name: str, *fields: Tuple[str, Any]) -> Type[BaseM
 
         def get(self, key: Union[str, int], default=_unset):
             try:
-                if not isinstance(key, int):
-                    key = self.name_to_key[key]
-                return self.attrs[key]
+                return getattr(self, key_to_slot[key])
             except KeyError:
                 if default is not _unset:
                     return default
                 raise
 
         def __repr__(self):
-            attrs = ["%s=%s" % (self.key_to_name[k], repr(v)) for k, v in self.attrs.items()]
+            attrs = ["%s=%s" % (key_to_name[k], repr(getattr(self, slot))) for k, slot in named_fields]
             return "BaseMessage: %s(%s)" % (packet_name, ", ".join(attrs))
 
         def getDict(self):
@@ -623,14 +839,14 @@ def create_packet_type(packet_name: str, *fields: Tuple[str, Any]) -> Type[BaseM
                     return [toDict(iv) for iv in v]
                 return v
 
-            return {self.key_to_name[k]: toDict(v) for k, v in self.attrs.items()}
+            return {key_to_name[k]: toDict(getattr(self, slot)) for k, slot in named_fields}
 
         def __iter__(self):
-            for k, v in self.attrs.items():
-                yield self.key_to_name[k]
+            for k, _ in named_fields:
+                yield key_to_name[k]
 
         def items(self):
-            return [(x, self.get(x)) for x in self]
+            return [(key_to_name[k], getattr(self, slot)) for k, slot in named_fields]
 
         @classmethod
         def getFields(cls) -> KeysView[str]:
@@ -638,10 +854,7 @@ def create_packet_type(packet_name: str, *fields: Tuple[str, Any]) -> Type[BaseM
 
         @classmethod
         def default(cls):
-            res = cls()
-            for k in sorted(cls.name_to_key.keys()):
-                res[k] = cls.key_to_packer[cls.name_to_key[k]].default()
-            return res
+            return cls()
 
         @classmethod
         def validate(cls, val: Any):
@@ -653,60 +866,149 @@ def create_packet_type(packet_name: str, *fields: Tuple[str, Any]) -> Type[BaseM
 
         @staticmethod
         def pack(packet_content: Type[BaseMessage]) -> bytes:
-            packed = bytes()
-            for k in sorted(packet_content.key_to_packer.keys()):
-                if k not in packet_content.attrs:
+            return _pack_buffer(packet_content, packet_content)
+
+        @staticmethod
+        def encoded_size(packet_content: Type[BaseMessage]) -> int:
+            size = 0
+            for k, slot, packer in packet_content.wire_fields:
+                try:
+                    size += packer.encoded_size(getattr(packet_content, slot))
+                except AttributeError:
+                    raise SerializeError("Error: Missing Member {}.".format(packet_content.key_to_name[k]))
+                except (struct.error, KeyError):
+                    logger.debug("Error in {} Member packing! {}", packet_name, packet_content.key_to_name[k])
                     raise SerializeError(
-                        "Error: Missing Member {}.".format(packet_content.key_to_name[k])
+                        "Error in {} Member packing! {}".format(
+                            packet_name, packet_content.key_to_name[k]
+                        )
                     )
+            return size
+
+        @staticmethod
+        def pack_into(buf: bytearray, offset: int, packet_content: Type[BaseMessage]) -> int:
+            for k, slot, packer in packet_content.wire_fields:
                 try:
-                    x = packet_content.key_to_packer[k].pack(packet_content.attrs[k])
+                    offset = packer.pack_into(buf, offset, getattr(packet_content, slot))
+                except AttributeError:
+                    raise SerializeError("Error: Missing Member {}.".format(packet_content.key_to_name[k]))
                 except (struct.error, KeyError):
-                    ts_print(f"Error in {packet_name} Member packing! {packet_content.key_to_name[k] }")
+                    logger.debug("Error in {} Member packing! {}", packet_name, packet_content.key_to_name[k])
                     raise SerializeError(
                         "Error in {} Member packing! {}".format(
                             packet_name, packet_content.key_to_name[k]
                         )
                     )
-                packed += x
-            return packed
+            return offset
 
         @staticmethod
         def unpack(data: bytes) -> Tuple[int, BaseMessage]:
-            packet_content = BaseMessageClass()
+            # Unpacked members are typed already, they are stored without validating them again
+            packet_content = object.__new__(BaseMessageClass)
             totalLen = 0
-            for k in sorted(packet_content.key_to_packer.keys()):
+            for k, slot, packer in wire_fields:
                 try:
-                    l, v = packet_content.key_to_packer[k].unpack(data)
+                    l, v = packer.unpack(data)
                 except (struct.error, DeserializeError):
-                    ts_print(f"Error in {packet_name} Member unpacking! {packet_content.key_to_name[k]}")
+                    logger.debug("Error in {} Member unpacking! {}", packet_name, key_to_name[k])
                     raise DeserializeError(
-                        "Error in {} Member unpacking! {}".format(
-                            packet_name, packet_content.key_to_name[k]
-                        )
+                        "Error in {} Member unpacking! {}".format(packet_name, key_to_name[k])
                     )
-                packet_content.set(k, v)
+                object.__setattr__(packet_content, slot, v)
                 data = data[l:]
                 totalLen += l
             return totalLen, packet_content
 
+    BaseMessageClass.name_to_key = name_to_key
+    BaseMessageClass.key_to_name = key_to_name
+    BaseMessageClass.key_to_packer = key_to_packer
+    BaseMessageClass.wire_fields = wire_fields
     return BaseMessageClass
 
 
+class EncodedMessage:
+    """
+    Body of a message which was encoded once, it can be sent in place of the message any number
+    of times. Messages with the same fields (e.g. ValidateMACConfig and SetMACConfig) can share
+    the body.
+    """
+
+    __slots__ = ("name", "body")
+
+    def __init__(self, name: str, body: bytes):
+        self.name = name
+        self.body = body
+
+    @classmethod
+    def encode(cls, message: BaseMessage, name: Optional[str] = None) -> "EncodedMessage":
+        return cls(name or message.name, message.pack(message))
+
+    def __eq__(self, other):
+        if isinstance(other, EncodedMessage):
+            return self.name == other.name and self.body == other.body
+        return False
+
+    def __repr__(self):
+        return "EncodedMessage: %s(%d bytes)" % (self.name, len(self.body))
+
+
+# Leading bytes of every TLV: length, component, valueId
+TLV_HDR_STR = ">BBH"
+TLV_HDR_SIZE = struct.calcsize(TLV_HDR_STR)
+TLV_ALIGN = 4
+_tlv_hdr = struct.Struct(TLV_HDR_STR)
+
+
+def tlv_spans(data: bytes, offset: int, count: int) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Walk over count consecutive TLVs once, without copying any data.
+
+    :param      data:    Buffer containing the TLVs
+    :param      offset:  Offset of the first TLV in data
+    :param      count:   Number of TLVs to read
+
+    :returns:   Iterator of (component, valueId, dataStart, end) offsets into data.
+                The data range includes the alignment padding.
+    """
+    hdr = _tlv_hdr
+    size = len(data)
+    for _ in range(count):
+        try:
+            length, component, valueId = hdr.unpack_from(data, offset)
+        except struct.error:
+            raise DeserializeError("Truncated TLV header at offset {}".format(offset))
+        if length <= 1:
+            raise DeserializeError(
+                "TLV length {} is not allowed. Header + data require length of 2.".format(length)
+            )
+        end = offset + length * TLV_ALIGN
+        if end > size:
+            raise DeserializeError(
+                "TLV at offset {} exceeds buffer: {} vs {} bytes".format(offset, end, size)
+            )
+        yield component, valueId, offset + TLV_HDR_SIZE, end
+        offset = end
+
+
 def create_tlv_packet_type(packet_name: str) -> Type[BaseMessage]:
     ParentType = create_packet_type(
         packet_name,
         ("component", U8Type),
         ("valueId", U16Type),
-        ("data", create_array_type(U8Type, length_packer=create_tlv_length_packer())),
+        (
+            "data",
+            create_array_type(U8Type, length_packer=create_tlv_length_packer(align=TLV_ALIGN)),
+        ),
     )
     comp_pack = ParentType.key_to_packer[ParentType.name_to_key["component"]]
     val_pack = ParentType.key_to_packer[ParentType.name_to_key["valueId"]]
     data_pack = ParentType.key_to_packer[ParentType.name_to_key["data"]]
 
     class TlvMessageClass(ParentType):
+        __slots__ = ()
+
         @staticmethod
-        def pack(packet_content: BaseMessage) -> bytes:
+        def _full_data(packet_content: BaseMessage) -> List[int]:
             component = packet_content["component"]
             valueId = packet_content["valueId"]
             data = packet_content["data"]
@@ -714,20 +1016,29 @@ def create_tlv_packet_type(packet_name: str) -> Type[BaseMessage]:
             full_data = list(comp_pack.pack(component) + val_pack.pack(valueId)) + data
             if data_pack.validate(full_data) is None:
                 raise SerializeError("Error in {} validation!".format(packet_name))
-            return data_pack.pack(full_data)
+            return full_data
+
+        @staticmethod
+        def pack(packet_content: BaseMessage) -> bytes:
+            return data_pack.pack(TlvMessageClass._full_data(packet_content))
+
+        @staticmethod
+        def encoded_size(packet_content: BaseMessage) -> int:
+            return data_pack.encoded_size(TlvMessageClass._full_data(packet_content))
+
+        @staticmethod
+        def pack_into(buf: bytearray, offset: int, packet_content: BaseMessage) -> int:
+            return data_pack.pack_into(buf, offset, TlvMessageClass._full_data(packet_content))
 
         @staticmethod
         def unpack(data: bytes) -> Tuple[int, Type[BaseMessage]]:
-            cLen, component = comp_pack.unpack(data[1:])
-            vLen, valueId = val_pack.unpack(data[1 + cLen :])
-            length, array = data_pack.unpack(data)
-
-            packet_content = TlvMessageClass(
-                component=component,
-                valueId=valueId,
-                data=array[cLen + vLen :],
-            )
-            return length, packet_content
+            for component, valueId, start, end in tlv_spans(data, 0, 1):
+                packet_content = TlvMessageClass(
+                    component=component,
+                    valueId=valueId,
+                    data=list(data[start:end]),
+                )
+                return end, packet_content
 
     return TlvMessageClass
 
@@ -755,6 +1066,17 @@ class SubProtocol(ABC):
     def pack(msg) -> bytes:
         pass
 
+    @staticmethod
+    def encoded_size(msg) -> int:
+        return len(msg.pack(msg))
+
+    @staticmethod
+    def pack_into(buf: bytearray, offset: int, msg) -> int:
+        data = msg.pack(msg)
+        end = offset + len(data)
+        buf[offset:end] = data
+        return end
+
     @staticmethod
     @abstractmethod
     def unpack(data: bytes):
@@ -803,9 +1125,23 @@ def create_subprotocol(
 
         @staticmethod
         def pack(msg: Type[SubProtocol]) -> bytes:
-            return struct.pack(str(">B"), msg.cmd) + key_to_packet_content_type[msg.cmd].pack(
-                msg.packet_content
-            )
+            return _pack_buffer(SubProtocolClass, msg)
+
+        @staticmethod
+        def encoded_size(msg: Type[SubProtocol]) -> int:
+            if type(msg.packet_content) is EncodedMessage:
+                return 1 + len(msg.packet_content.body)
+            return 1 + key_to_packet_content_type[msg.cmd].encoded_size(msg.packet_content)
+
+        @staticmethod
+        def pack_into(buf: bytearray, offset: int, msg: Type[SubProtocol]) -> int:
+            buf[offset] = msg.cmd
+            if type(msg.packet_content) is EncodedMessage:
+                body = msg.packet_content.body
+                end = offset + 1 + len(body)
+                buf[offset + 1 : end] = body
+                return end
+            return key_to_packet_content_type[msg.cmd].pack_into(buf, offset + 1, msg.packet_content)
 
         @staticmethod
         def unpack(data: bytes) -> SubProtocol:
@@ -837,6 +1173,7 @@ __cmd_unpack_map = {}  # type: Dict[Enum, Type[SubProtocol]]
 
 HDR_STR = ">HBBH"
 HDR_SIZE = struct.calcsize(HDR_STR)
+_hdr = struct.Struct(HDR_STR)
 
 
 def get_protocol_versions() -> Dict[Enum, int]:
@@ -854,36 +1191,40 @@ def protocol_class(msg_prot: Type[SubProtocol]):
 
 def serialize_message(msg_prot: SubProtocol, sequence_number: int) -> bytes:
     subprot = msg_prot.subprot
-    msg_bytes = msg_prot.pack(msg_prot)
+    # Size check before anything is packed, header and body go into one buffer
+    size = msg_prot.encoded_size(msg_prot)
 
-    if len(msg_bytes) > PACKET_SIZE_LIMIT:
+    if size > PACKET_SIZE_LIMIT:
         raise SerializeError(
             "Packets of length {} are not supported! Max is {}.".format(
-                len(msg_bytes), PACKET_SIZE_LIMIT
+                size, PACKET_SIZE_LIMIT
             )
         )
+    buf = bytearray(HDR_SIZE + size)
     try:
-        hdr_bytes = (
-            struct.pack(
-                HDR_STR, len(msg_bytes) + HDR_SIZE, sequence_number, subprot.value, msg_prot.version
-            )
-            + msg_bytes
-        )
-        return hdr_bytes
+        _hdr.pack_into(buf, 0, HDR_SIZE + size, sequence_number, subprot.value, msg_prot.version)
     except struct.error:
         raise SerializeError(
             "Could not serialize header packet {}".format(
-                (len(msg_bytes) + HDR_SIZE, sequence_number, subprot.value)
+                (size + HDR_SIZE, sequence_number, subprot.value)
             )
         )
+    end = msg_prot.pack_into(buf, HDR_SIZE, msg_prot)
+    if end != len(buf):
+        raise SerializeError("Packed {} bytes, expected {}".format(end - HDR_SIZE, size))
+    return bytes(buf)
 
 
-def deserialize_message(data) -> Tuple[int, SubProtocol]:
+def deserialize_message(data, raw_addresses: bool = False) -> Tuple[int, SubProtocol]:
+    """
+    :param raw_addresses: Decode MAC and IP addresses to ints, saves creating the address objects
+        when they are only stored or compared. Such messages can be serialized again as they are.
+    """
     if len(data) < HDR_SIZE:
         raise DeserializeError("Too small packet: {}".format(len(data)))
     (length, sequence_number, subprot, prot_ver) = struct.unpack(HDR_STR, data[:HDR_SIZE])
     if subprot not in __cmd_unpack_map:
-        raise DeserializeError("Unregistered subprotocol: %d" % subprot)
+        raise DeserializeError("Unregistered subprotocol: %d" % subprot, subprot, sequence_number)
     if prot_ver != __cmd_unpack_map[subprot].version:
         raise DeserializeVersionError(
             "Subprotcol {} version doesn't match: have {} want {}".format(
@@ -892,8 +1233,19 @@ def deserialize_message(data) -> Tuple[int, SubProtocol]:
             subprot,
             prot_ver,
             sequence_number,
+            __cmd_unpack_map[subprot].version,
         )
     if length != len(data):
-        raise DeserializeError("Packet has superfluous bytes: {}".format(data[length:]))
-    msg = __cmd_unpack_map[subprot].unpack(data[HDR_SIZE:length])
+        raise DeserializeError(
+            "Packet has superfluous bytes: {}".format(data[length:]), subprot, sequence_number
+        )
+    previous = _decode_context.raw_addresses
+    _decode_context.raw_addresses = raw_addresses
+    try:
+        msg = __cmd_unpack_map[subprot].unpack(data[HDR_SIZE:length])
+    except DeserializeError as e:
+        # Keep the header, a pending query can still be matched with it
+        raise DeserializeError(str(e), subprot, sequence_number) from e
+    finally:
+        _decode_context.raw_addresses = previous
     return sequence_number, msg
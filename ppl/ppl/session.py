@@ -0,0 +1,134 @@
+import asyncio
+from typing import Any, Callable, Dict
+
+import ppl.packetDefinitions as pd
+from ppl.client import PplClient
+from ppl.constants import SERVERPORT
+from ppl.udpServer import UdpServer
+from r3erci.session import CommandHandlerType, SessionError, requestAddress
+
+"""
+PPL commands of the session daemon (see r3erci.session for the protocol)
+
+    configure   address, args: input_file, force_unpair, skip_test, skip_clear
+    test        address, args: input_file, force_unpair
+    clear       address, args: force_unpair
+    validate    args: input_file
+    nodestate   address
+
+    force_unpair, skip_test and skip_clear are booleans and default to false.
+
+    Results are the output the ppl command line prints ({"response": [...], "timestamp": [...],
+    "message": [...]}), nodestate returns the GetNodeState response.
+"""
+
+
+def _args(request: Dict[str, Any], *required: str) -> Dict[str, Any]:
+    args = request.get("args") or {}
+    for name in required:
+        if name not in args:
+            raise SessionError(f"Command {request.get('command')} needs argument {name}")
+    return args
+
+
+def _flag(args: Dict[str, Any], name: str) -> bool:
+    value = args.get(name, False)
+    # A string like "false" would be true
+    if not isinstance(value, bool):
+        raise SessionError(f"Argument {name} must be true or false, got {value!r}")
+    return value
+
+
+class DeviceSessions:
+    """
+    One client per device, created on first use and kept. A PplClient executes one
+    transaction at a time and keeps its output per run, so requests to the same device
+    wait for each other on the lock of the device.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self.factory = factory
+        self.clients = {}  # type: Dict[str, Any]
+        self.locks = {}  # type: Dict[str, asyncio.Lock]
+
+    def get(self, address: str):
+        client = self.clients.get(address)
+        if client is None:
+            client = self.clients[address] = self.factory()
+            self.locks[address] = asyncio.Lock()
+        return client, self.locks[address]
+
+
+class PplService:
+    """
+    PPL commands of the session daemon, all devices share one socket.
+    """
+
+    def __init__(self, udpServer: UdpServer, timeout: float = 3):
+        self.udpServer = udpServer
+        self.devices = DeviceSessions(lambda: PplClient(timeout=timeout, udpServer=self.udpServer))
+
+    @classmethod
+    async def create(
+        cls, ownaddress: str = "0.0.0.0", ownport: int = SERVERPORT, timeout: float = 3
+    ) -> "PplService":
+        udpServer = await UdpServer.create(ownaddress, ownport, batched=True)
+        return cls(udpServer, timeout)
+
+    def handlers(self) -> Dict[str, CommandHandlerType]:
+        return {
+            "configure": self.configure,
+            "test": self.test,
+            "clear": self.clear,
+            "validate": self.validate,
+            "nodestate": self.nodeState,
+        }
+
+    async def configure(self, request: Dict[str, Any]) -> dict:
+        address = requestAddress(request)
+        args = _args(request, "input_file")
+        client, lock = self.devices.get(address)
+        async with lock:
+            client.output = {'response': [], 'timestamp': [], 'message': []}
+            await client.runCmdConfigure(
+                address,
+                _flag(args, "force_unpair"),
+                _flag(args, "skip_test"),
+                _flag(args, "skip_clear"),
+                args["input_file"],
+            )
+            return client.output
+
+    async def test(self, request: Dict[str, Any]) -> dict:
+        address = requestAddress(request)
+        args = _args(request, "input_file")
+        client, lock = self.devices.get(address)
+        async with lock:
+            client.output = {'response': [], 'timestamp': [], 'message': []}
+            valid = await client.runCmdTest(address, args["input_file"], _flag(args, "force_unpair"))
+            return {**client.output, "valid": valid}
+
+    async def clear(self, request: Dict[str, Any]) -> dict:
+        address = requestAddress(request)
+        args = _args(request)
+        client, lock = self.devices.get(address)
+        async with lock:
+            client.output = {'response': [], 'timestamp': [], 'message': []}
+            await client.runCmdClear(address, _flag(args, "force_unpair"))
+            return client.output
+
+    async def validate(self, request: Dict[str, Any]) -> dict:
+        args = _args(request, "input_file")
+        client = PplClient(udpServer=self.udpServer)
+        client.runCmdValidateJson(args["input_file"])
+        return client.output
+
+    async def nodeState(self, request: Dict[str, Any]) -> dict:
+        address = requestAddress(request)
+        client, lock = self.devices.get(address)
+        async with lock:
+            message, _ = await client.send_command(address, pd.DiscovSubProt(pd.GetNodeState()), logSucc=False)
+            return message.getDict()
+
+    def close(self) -> None:
+        self.udpServer.close()
@@ -0,0 +1,437 @@
+import asyncio
+import socket
+from ipaddress import IPv4Address, ip_address
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import ppl.packetDefinitions as pd
+from ppl.constants import CLIENTPORT
+from ppl.enums import ifaceType, nodeState
+from ppl.protocol import BaseMessage, subProtocols
+from ppl.util import ts_print
+from r3erci.simulator import FleetStats, NetworkConditions, raiseFileLimit
+
+# First address handed out to virtual bridges, bridge n gets BRIDGE_BASE_ADDRESS + n
+BRIDGE_BASE_ADDRESS = IPv4Address("127.2.0.1")
+
+PYRTMF_VERSION = "simulated"
+
+SUBPROTOCOLS = {
+    subProtocols.DISCOVERY: pd.DiscovSubProt,
+    subProtocols.PAIRING: pd.PairSubProt,
+    subProtocols.CONFIGURATION: pd.ConfigSubProt,
+    subProtocols.MEASUREMENT: pd.MeasSubProt,
+    subProtocols.DEVICE_CONTROL: pd.DevControlSubProt,
+    subProtocols.UPDATE: pd.UpdaterSubProt,
+}
+
+
+class BridgeError(Exception):
+    pass
+
+
+class ConfigTransaction:
+    __slots__ = ("storage", "slots", "selected", "finalized", "globalHost", "pending")
+
+    def __init__(self, storage, slots: List[int]):
+        self.storage = storage
+        self.slots = set(slots)
+        self.selected = None  # type: Optional[int]
+        self.finalized = set()
+        self.globalHost = None  # type: Optional[BaseMessage]
+        self.pending = {}  # type: Dict[int, Dict[str, BaseMessage]]
+
+
+class VirtualBridge:
+    """
+    Behaviour of a single R3 Bridge E as seen through the ppl protocol.
+
+    Answers every request with the same sequence number. Requests are acknowledged by
+    echoing them, errors are answered with a GenericError of the same subprotocol.
+    """
+
+    __slots__ = (
+        "address",
+        "fleet",
+        "transport",
+        "state",
+        "peer",
+        "configs",
+        "globalHost",
+        "uid",
+        "transaction",
+        "measConfig",
+        "measHandle",
+        "measPacketNumber",
+        "updateHandle",
+        "updateProgress",
+    )
+
+    def __init__(self, address: IPv4Address, fleet: "BridgeSimulator"):
+        self.address = address
+        self.fleet = fleet
+        self.transport = None  # type: Optional[asyncio.DatagramTransport]
+        self.state = nodeState.IDLE
+        self.peer = None  # type: Optional[Tuple[str, int]]
+        self.configs = {}  # type: Dict[int, Dict[str, BaseMessage]]
+        self.globalHost = None  # type: Optional[BaseMessage]
+        self.uid = 0
+        self.transaction = None  # type: Optional[ConfigTransaction]
+        self.measConfig = None  # type: Optional[BaseMessage]
+        self.measHandle = None  # type: Optional[asyncio.TimerHandle]
+        self.measPacketNumber = 0
+        self.updateHandle = None  # type: Optional[asyncio.TimerHandle]
+        self.updateProgress = 0
+
+    # Transmission
+
+    def send(self, subprot: subProtocols, message: BaseMessage, seq: int, dst: Tuple[str, int]) -> None:
+        _, data = pd.serialize_message(SUBPROTOCOLS[subprot](message), seq)
+        if data is None:
+            return
+        self.fleet.transmit(self.transport, data, dst)
+
+    def reply(self, subprot: subProtocols, message: BaseMessage, seq: int, dst: Tuple[str, int]) -> None:
+        self.fleet.stats.answered += 1
+        self.send(subprot, message, seq, dst)
+
+    # Request handling
+
+    def handle(self, subprot: subProtocols, seq: int, message: BaseMessage, sender: Tuple[str, int]) -> None:
+        try:
+            if subprot == subProtocols.DISCOVERY:
+                response = self.handleDiscovery(message)
+            elif subprot == subProtocols.PAIRING:
+                response = self.handlePairing(message, sender)
+            else:
+                if self.peer is None or self.peer[0] != sender[0]:
+                    raise BridgeError("Node is not paired with you")
+                # Measurement data and progress updates go to the port of the last request
+                self.peer = sender
+                if subprot == subProtocols.CONFIGURATION:
+                    response = self.handleConfiguration(message)
+                elif subprot == subProtocols.MEASUREMENT:
+                    response = self.handleMeasurement(message)
+                elif subprot == subProtocols.DEVICE_CONTROL:
+                    response = self.handleDeviceControl(message)
+                else:
+                    response = self.handleUpdate(message)
+        except BridgeError as e:
+            response = pd.GenericError(ErrorMsg=str(e))
+        if response is not None:
+            self.reply(subprot, response, seq, sender)
+
+    def nodeStateMessage(self) -> BaseMessage:
+        return pd.NodeState(
+            state=self.state,
+            serverIP=ip_address(self.peer[0]) if self.peer else ip_address(0),
+            hasStaticConfig=1 if self.configs else 0,
+            ifaces=[
+                pd.IFaceInfo(type=ifaceType.ETHERNET, name="eth0", MAC=int(self.address), ip=self.address),
+                pd.IFaceInfo(type=ifaceType.R3MAC, name="er0", MAC=int(self.address) | (1 << 40), ip=0),
+            ],
+            versions=[pd.KeyValuePair(name="pyrtmf", value=PYRTMF_VERSION)],
+            features=[
+                pd.SubProtocolInfo(protocol=prot, version=version)
+                for prot, version in pd.get_features().items()
+            ],
+        )
+
+    def handleDiscovery(self, message: BaseMessage) -> Optional[BaseMessage]:
+        if isinstance(message, pd.GetNodeState):
+            return self.nodeStateMessage()
+        if isinstance(message, pd.GetPyrtmfState):
+            return pd.PyrtmfState(state=self.state.value, version=PYRTMF_VERSION)
+        return None
+
+    def handlePairing(self, message: BaseMessage, sender: Tuple[str, int]) -> Optional[BaseMessage]:
+        if isinstance(message, pd.PairNode):
+            if self.peer is not None and self.peer[0] != sender[0]:
+                raise BridgeError(f"Node is already paired with {self.peer[0]}")
+            if self.peer is None and not self.state.isIdle():
+                raise BridgeError(f"Node cannot be paired in state {self.state}")
+            self.peer = sender
+            if self.state.isIdle():
+                self.state = nodeState.PAIRED
+            return pd.PairSuccess()
+        if isinstance(message, pd.UnpairNode):
+            # Unpairing always succeeds, it is used to force unpair a node paired elsewhere
+            self.stopMeasurement()
+            self.stopUpdate()
+            self.peer = None
+            self.transaction = None
+            self.state = nodeState.IDLE
+            return message
+        return None
+
+    def handleConfiguration(self, message: BaseMessage) -> Optional[BaseMessage]:
+        if isinstance(message, pd.ValidateMACConfig):
+            return message
+        if isinstance(message, pd.ClearConfigSet):
+            self.configs = {}
+            self.globalHost = None
+            self.uid = 0
+            return message
+        if isinstance(message, pd.ReadConfigSetUID):
+            return pd.ReadConfigSetUID(UID=self.uid)
+        if isinstance(message, pd.StartConfigSetTransaction):
+            self.transaction = ConfigTransaction(message["storage"], message["slots"])
+            return message
+
+        transaction = self.transaction
+        if transaction is None:
+            raise BridgeError("No config transaction active")
+
+        if isinstance(message, pd.SetGlobalHostConfig):
+            transaction.globalHost = message
+        elif isinstance(message, pd.SelectConfigSlot):
+            if message["slotid"] not in transaction.slots:
+                raise BridgeError(f"Slot {message['slotid']} is not part of the transaction")
+            transaction.selected = message["slotid"]
+            transaction.pending[transaction.selected] = {}
+        elif isinstance(message, (pd.SetMACConfig, pd.SetHostConfig, pd.ZeusSecurityConfig)):
+            if transaction.selected is None:
+                raise BridgeError("No config slot selected")
+            transaction.pending[transaction.selected][message.name] = message
+        elif isinstance(message, pd.AddHostRoutes):
+            if transaction.selected is None:
+                raise BridgeError("No config slot selected")
+            hostConfig = transaction.pending[transaction.selected].get(pd.SetHostConfig.name)
+            if hostConfig is None:
+                raise BridgeError("AddHostRoutes requires a SetHostConfig first")
+            hostConfig["routes"] = hostConfig["routes"] + message["routes"]
+        elif isinstance(message, pd.FinalizeConfigSlot):
+            if transaction.selected is None:
+                raise BridgeError("No config slot selected")
+            if pd.SetMACConfig.name not in transaction.pending[transaction.selected]:
+                raise BridgeError(f"Slot {transaction.selected} has no MAC config")
+            transaction.finalized.add(transaction.selected)
+            transaction.selected = None
+        elif isinstance(message, (pd.ApplyConfigSet, pd.CommitConfigSet)):
+            self.configs = {slot: transaction.pending[slot] for slot in transaction.finalized}
+            self.globalHost = transaction.globalHost
+            self.uid = message["UID"]
+            self.transaction = None
+        else:
+            return None
+        return message
+
+    def handleMeasurement(self, message: BaseMessage) -> Optional[BaseMessage]:
+        if isinstance(message, (pd.MeasValidateConfig, pd.MeasSetConfig)):
+            if isinstance(message, pd.MeasSetConfig):
+                self.measConfig = message
+            return message
+        if isinstance(message, pd.MeasurementStart):
+            if self.state == nodeState.RUNNING:
+                raise BridgeError("Measurement is already running")
+            self.state = nodeState.RUNNING
+            self.measPacketNumber = 0
+            self.scheduleMeasurement()
+            return message
+        if isinstance(message, pd.MeasurementStop):
+            if self.state != nodeState.RUNNING:
+                raise BridgeError("No measurement running")
+            self.stopMeasurement()
+            self.state = nodeState.PAIRED
+            return pd.MeasurementStop(links=self.linkStatus())
+        return None
+
+    def handleDeviceControl(self, message: BaseMessage) -> Optional[BaseMessage]:
+        if isinstance(message, pd.DeviceDiagnostics):
+            return pd.DeviceDiagnostics(
+                diagnostics=[
+                    pd.DiagnosticTLV(component=1, valueId=1, data=list(self.state.value.to_bytes(4, "big"))),
+                    pd.DiagnosticTLV(component=1, valueId=2, data=list(self.uid.to_bytes(8, "big"))),
+                ]
+            )
+        if isinstance(message, pd.DeviceBridgeStart):
+            self.state = nodeState.BRIDGED
+            return message
+        if isinstance(message, pd.DeviceBridgeStop):
+            if self.state == nodeState.BRIDGED:
+                self.state = nodeState.PAIRED
+            return message
+        return None
+
+    def handleUpdate(self, message: BaseMessage) -> Optional[BaseMessage]:
+        if isinstance(message, pd.UpdateQuery):
+            return pd.UpdateResponse(
+                updates=[
+                    pd.UpdateInfo(
+                        versions=[pd.KeyValuePair(name="pyrtmf", value=PYRTMF_VERSION + "+1")],
+                        meta=[],
+                    )
+                ]
+            )
+        if isinstance(message, pd.UpdateStart):
+            if self.updateHandle is not None:
+                raise BridgeError("Update is already running")
+            self.updateProgress = 0
+            self.scheduleUpdate()
+            return message
+        return None
+
+    # Streams
+
+    def linkStatus(self) -> List[BaseMessage]:
+        if self.measConfig is None:
+            return []
+        return [
+            pd.SingleLinksStatus(
+                streamID=link["streamID"],
+                packetNumber=self.measPacketNumber,
+                rcvdOK=self.measPacketNumber,
+                lastSeqNum=self.measPacketNumber,
+            )
+            for link in self.measConfig["links"]
+        ]
+
+    def scheduleMeasurement(self) -> None:
+        self.measHandle = self.fleet.loop.call_later(self.fleet.measInterval, self.measurementTick)
+
+    def measurementTick(self) -> None:
+        self.measPacketNumber += 1
+        self.send(
+            subProtocols.MEASUREMENT,
+            pd.DemoStatus(
+                __packetNumber=self.measPacketNumber,
+                totalTransmissions=self.measPacketNumber,
+                destination=self.address,
+            ),
+            0,
+            self.peer,
+        )
+        if self.measConfig is not None:
+            self.send(subProtocols.MEASUREMENT, pd.MeasLinkStatus(links=self.linkStatus()), 0, self.peer)
+        self.scheduleMeasurement()
+
+    def stopMeasurement(self) -> None:
+        if self.measHandle is not None:
+            self.measHandle.cancel()
+            self.measHandle = None
+
+    def scheduleUpdate(self) -> None:
+        self.updateHandle = self.fleet.loop.call_later(self.fleet.updateInterval, self.updateTick)
+
+    def updateTick(self) -> None:
+        total = self.fleet.updateSteps
+        self.updateProgress += 1
+        self.send(
+            subProtocols.UPDATE,
+            pd.UpdateDownloadProgress(progress=self.updateProgress, total=total),
+            0,
+            self.peer,
+        )
+        if self.updateProgress < total:
+            self.scheduleUpdate()
+            return
+        self.updateHandle = None
+        self.send(subProtocols.UPDATE, pd.UpdateDownloadFinish(), 0, self.peer)
+        self.send(subProtocols.UPDATE, pd.UpdateSuccess(), 0, self.peer)
+
+    def stopUpdate(self) -> None:
+        if self.updateHandle is not None:
+            self.updateHandle.cancel()
+            self.updateHandle = None
+
+
+class VirtualBridgeProtocol(asyncio.DatagramProtocol):
+    def __init__(self, bridge: VirtualBridge):
+        self.bridge = bridge
+
+    def connection_made(self, transport):
+        self.bridge.transport = transport
+
+    def datagram_received(self, data, sender):
+        stats = self.bridge.fleet.stats
+        stats.received += 1
+        subprot, seq, message = pd.deserialize_message(data)
+        if message is None or seq is None:
+            stats.invalid += 1
+            return
+        self.bridge.handle(subprot, seq, message, sender)
+
+
+class BridgeSimulator:
+    """
+    Emulates many bridges in one event loop, each with its own UDP socket on its own
+    loopback address (by default 127.2.0.1 + bridge id) and port CLIENTPORT.
+    """
+
+    def __init__(
+        self,
+        addresses: Iterable[IPv4Address],
+        port: int = CLIENTPORT,
+        conditions: Optional[NetworkConditions] = None,
+        measInterval: float = 0.1,
+        updateInterval: float = 0.1,
+        updateSteps: int = 10,
+    ):
+        self.addresses = [ip_address(a) for a in addresses]
+        self.port = port
+        self.conditions = conditions if conditions is not None and not conditions.ideal else None
+        self.measInterval = measInterval
+        self.updateInterval = updateInterval
+        self.updateSteps = updateSteps
+        self.bridges = {}  # type: Dict[IPv4Address, VirtualBridge]
+        self.transports = []  # type: List[asyncio.DatagramTransport]
+        self.stats = FleetStats()
+        self.loop = None  # type: Optional[asyncio.AbstractEventLoop]
+
+    @classmethod
+    def fromCount(
+        cls, count: int, first: int = 0, base: IPv4Address = BRIDGE_BASE_ADDRESS, **kwargs
+    ) -> "BridgeSimulator":
+        return cls((base + i for i in range(first, first + count)), **kwargs)
+
+    def transmit(self, transport: asyncio.DatagramTransport, data: bytes, dst: Tuple[str, int]) -> None:
+        if self.conditions is None:
+            transport.sendto(data, dst)
+            return
+        delay = self.conditions.delay()
+        if delay is None:
+            self.stats.dropped += 1
+        elif delay > 0:
+            self.loop.call_later(delay, transport.sendto, data, dst)
+        else:
+            transport.sendto(data, dst)
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        raiseFileLimit(len(self.addresses) + 256)
+        for address in self.addresses:
+            bridge = VirtualBridge(address, self)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.bind((str(address), self.port))
+            except OSError:
+                sock.close()
+                raise
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: VirtualBridgeProtocol(bridge), sock=sock
+            )
+            self.bridges[address] = bridge
+            self.transports.append(transport)
+
+    def close(self) -> None:
+        for bridge in self.bridges.values():
+            bridge.stopMeasurement()
+            bridge.stopUpdate()
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+
+    async def serve(self, statsInterval: Optional[float] = None) -> None:
+        await self.start()
+        ts_print(
+            f"Simulating {len(self.bridges)} bridges on {self.addresses[0]}..{self.addresses[-1]}:{self.port}"
+        )
+        try:
+            while True:
+                await asyncio.sleep(statsInterval if statsInterval else 3600)
+                if statsInterval:
+                    ts_print(f"Bridges {self.addresses[0]}: {self.stats}")
+        finally:
+            self.close()
+
+    def __getitem__(self, address) -> VirtualBridge:
+        return self.bridges[ip_address(address)]
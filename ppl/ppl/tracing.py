@@ -0,0 +1,19 @@
+# The tracer is shared with r3erci, so rollouts using both protocols end up in one set of histograms
+from r3erci.tracing import (  # noqa: F401
+    PHASE_DESERIALIZE,
+    PHASE_DISPATCH,
+    PHASE_DISPATCH_LOCK,
+    PHASE_HANDLER,
+    PHASE_QUERY_LOCK,
+    PHASE_RECEIVE,
+    PHASE_SEND,
+    PHASE_SERIALIZE,
+    PHASES,
+    HdrHistogram,
+    Tracer,
+    addStatsArguments,
+    enableTracing,
+    runMainWithStats,
+    tracer,
+    writeStats,
+)
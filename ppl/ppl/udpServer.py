@@ -1,22 +1,37 @@
 import asyncio
 import inspect
 import socket
-import traceback
+from collections import deque
 import copy
 import ppl.packetDefinitions as pd
 from contextlib import contextmanager
 from ipaddress import IPv4Address
-from typing import Any, Callable, Coroutine, Iterator, List, Optional, Tuple
+from typing import Any, Callable, Coroutine, Deque, Dict, Iterator, List, Optional, Tuple
 
 from .constants import CLIENTPORT, SERVERPORT
-from ppl.util import ts_print
+from ppl.exceptions import DeserializeError, SerializeError
+from ppl.macaddress import MacAddress, MacAddressValueError
+from ppl.tracing import PHASE_DESERIALIZE, PHASE_DISPATCH, PHASE_DISPATCH_LOCK, tracer
+from ppl.util import StyleAdapter, getLogger
 from . import protocol
 from .protocol import subProtocols
 from ppl.enums import getReliabilityEnum, getOptimizationEnum, getSecurityModeEnum, getFilterActionEnum
 
+logger = StyleAdapter(getLogger(__name__))
+
+# Receive buffer requested from the kernel, bursts of responses from many devices overflow the default
+RCVBUF_SIZE = 4 * 1024 * 1024
+# Upper bound of datagrams drained per reader callback in batched mode
+RECV_BATCH_SIZE = 64
+RECV_DATAGRAM_SIZE = 65535
+# Upper bound of received packets waiting for coroutine subscribers, further packets are dropped
+SUBSCRIBER_QUEUE_SIZE = 1024
+
 CRType = Coroutine[Any, Any, bool]
 ProtSubscriberType = Callable[[int, protocol.BaseMessage, Tuple[str, int]], CRType]
 SubscriberType = Callable[[subProtocols, int, protocol.BaseMessage, Tuple[str, int]], CRType]
+RawTapType = Callable[[bytes, Tuple[str, int]], bool]
+PacketType = Tuple[subProtocols, int, protocol.BaseMessage, Tuple[str, int]]
 
 class UdpServerProtocol(asyncio.BaseProtocol):
     def __init__(self, handler):
@@ -28,9 +43,26 @@ class UdpServerProtocol(asyncio.BaseProtocol):
 
     def datagram_received(self, data, sender):
         try:
-            asyncio.ensure_future(self.handler(data, sender))
-        except Exception as e:
-            ts_print(e)
+            self.handler(data, sender)
+        except Exception:
+            logger.exception("Could not handle packet from {}", sender)
+
+
+class ResponseWaiter:
+    __slots__ = ("subProtocol", "sequence", "sentSequence", "future")
+
+    def __init__(
+        self,
+        subProtocol: Optional[subProtocols],
+        sequence: Optional[int],
+        future: asyncio.Future,
+        sentSequence: Optional[int] = None,
+    ):
+        self.subProtocol = subProtocol
+        self.sequence = sequence
+        # Sequence the response of a failed deserialization has to carry, see UdpServer.failPending()
+        self.sentSequence = sentSequence if sentSequence is not None else sequence
+        self.future = future
 
 
 class UdpServer:
@@ -39,7 +71,15 @@ class UdpServer:
     
     packet_sequence = 0
 
-    def __init__(self, ownaddress: str = "0.0.0.0", ownport: int = SERVERPORT):
+    def __init__(
+        self, ownaddress: str = "0.0.0.0", ownport: int = SERVERPORT, batched: bool = False, bind: bool = True
+    ):
+        """
+        :param batched: Drain the socket in batches from a reader callback and coalesce sends
+                        into one callback per loop iteration instead of one asyncio protocol
+                        callback and task per datagram
+        :param bind: Open the socket right away, use create() from within a running event loop
+        """
         try:
             IPv4Address(ownaddress)
         except ValueError:
@@ -48,32 +88,87 @@ class UdpServer:
             ownport = int(ownport)
         except ValueError:
             raise ValueError(f"{ownport} is not an integer")
-        self.dispatchLock = asyncio.Lock()
-        self.openSocket(ownaddress, ownport)
+        self.ownaddress = ownaddress
+        self.ownport = ownport
+        self.initDispatch()
+        self.batched = batched
+        self.loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self.transport = None  # type: Optional[asyncio.DatagramTransport]
+        self.sendQueue = deque()  # type: Deque[Tuple[bytes, Tuple[str, int]]]
+        self.sendScheduled = False
+        if bind:
+            self.openSocket(ownaddress, ownport)
     
     def getNextSeq(self) -> int:
         self.packet_sequence = (self.packet_sequence + 1) % 0x100
         return self.packet_sequence
 
-    def openSocket(self, ownaddress: str, ownport: int, timeout: float = 0.5) -> None:
+    @classmethod
+    async def create(
+        cls, ownaddress: str = "0.0.0.0", ownport: int = SERVERPORT, batched: bool = False
+    ) -> "UdpServer":
+        """
+        Creates the server from within a running event loop, the socket is listening on return.
+        """
+        self = cls(ownaddress, ownport, batched=batched, bind=False)
+        await self.openSocketAsync(self.ownaddress, self.ownport)
+        return self
+
+    def bindSocket(self, ownaddress: str, ownport: int, timeout: float = 0.5) -> None:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         except Exception:
             pass
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
+        except OSError:
+            pass
         self.sock.settimeout(timeout)
         self.sock.bind((ownaddress, ownport))
 
-        loop = asyncio.get_event_loop()
-        listen = loop.create_datagram_endpoint(
-            lambda: UdpServerProtocol(self.receiveHandler),
+    def listen(self, loop: asyncio.AbstractEventLoop) -> Optional[Coroutine]:
+        """
+        Registers the socket with the loop. Returns the endpoint coroutine to await
+        unless the socket is drained by a reader callback.
+        """
+        self.loop = loop
+        if self.batched:
+            self.sock.setblocking(False)
+            loop.add_reader(self.sock.fileno(), self._drainSocket)
+            return None
+        return loop.create_datagram_endpoint(
+            lambda: UdpServerProtocol(self.handleDatagram),
             sock=self.sock,
         )
+
+    def openSocket(self, ownaddress: str, ownport: int, timeout: float = 0.5) -> None:
+        self.bindSocket(ownaddress, ownport, timeout)
+        loop = asyncio.get_event_loop()
+        listen = self.listen(loop)
+        if listen is None:
+            return
         if loop.is_running():
             loop.create_task(listen)
         else:
-            transport, protocol = loop.run_until_complete(listen)
+            self.transport, protocol = loop.run_until_complete(listen)
+
+    async def openSocketAsync(self, ownaddress: str, ownport: int, timeout: float = 0.5) -> None:
+        self.bindSocket(ownaddress, ownport, timeout)
+        listen = self.listen(asyncio.get_running_loop())
+        if listen is not None:
+            self.transport, protocol = await listen
+
+    def close(self) -> None:
+        if self.batched:
+            self.loop.remove_reader(self.sock.fileno())
+            if self.sendScheduled:
+                self.loop.remove_writer(self.sock.fileno())
+        if self.transport is not None:
+            self.transport.close()
+        else:
+            self.sock.close()
 
     def createPacket(self, protocolMessage: protocol.SubProtocol,
         seq: Optional[int] = None,) -> Tuple[int | None, bytes | None]:
@@ -81,44 +176,179 @@ class UdpServer:
             seq = self.getNextSeq()
         seq, rawData = pd.serialize_message(protocolMessage, seq=seq)
         if not rawData:
-            ts_print("Could not serialize invalid packet: {}", protocolMessage)
+            logger.info("Could not serialize invalid packet: {}", protocolMessage)
             return None
         return rawData
 
     def sendPacket(self, data: bytes, address: IPv4Address, port = CLIENTPORT) -> None:
         """use createPacket() to generate the data input for this method"""
-        self.sock.sendto(data, (str(address), port))
-        pass
+        if not self.batched:
+            self.sock.sendto(data, (str(address), port))
+            return
+        self.sendQueue.append((data, (str(address), port)))
+        if not self.sendScheduled:
+            self.sendScheduled = True
+            self.loop.call_soon(self._flushSends)
+
+    def _flushSends(self) -> None:
+        sendto = self.sock.sendto
+        sendQueue = self.sendQueue
+        while sendQueue:
+            data, target = sendQueue[0]
+            try:
+                sendto(data, target)
+            except (BlockingIOError, InterruptedError):
+                # Socket buffer full, continue once it is writable again
+                self.loop.add_writer(self.sock.fileno(), self._resumeSends)
+                return
+            except OSError as e:
+                logger.warning("Sending to {}:{} failed: {}", target[0], target[1], e)
+            sendQueue.popleft()
+        self.sendScheduled = False
+
+    def _resumeSends(self) -> None:
+        self.loop.remove_writer(self.sock.fileno())
+        self._flushSends()
+
+    def _drainSocket(self) -> None:
+        batch = []
+        recvfrom = self.sock.recvfrom
+        try:
+            for _ in range(RECV_BATCH_SIZE):
+                batch.append(recvfrom(RECV_DATAGRAM_SIZE))
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            logger.warning("Receiving failed: {}", e)
+        handleDatagram = self.handleDatagram
+        for data, address in batch:
+            try:
+                handleDatagram(data, address)
+            except Exception:
+                logger.exception("Could not handle packet from {}", address)
+
+    def initDispatch(self) -> None:
+        self.dispatchLock = asyncio.Lock()
+        self.waiters = {}  # type: Dict[str, List[ResponseWaiter]]
+        self.subscriberQueue = deque()  # type: Deque[Tuple[PacketType, bool]]
+        self.subscriberTask = None  # type: Optional[asyncio.Future]
+        self.droppedPackets = 0
+        self.rawTaps = []  # type: List[RawTapType]
 
     async def receiveHandler(self, data: bytes, address: Tuple[str, int]) -> None:
+        self.handleDatagram(data, address)
+
+    def handleDatagram(self, data: bytes, address: Tuple[str, int]) -> None:
+        # Raw taps only see datagrams of devices without a pending query
+        if self.rawTaps and address[0] not in self.waiters:
+            for tap in self.rawTaps:
+                if tap(data, address):
+                    return
         # Check length, identifier and strip padding
-        subProtocol, sequence, message = pd.deserialize_message(data)
-        if message is None or sequence is None:
-            ts_print(f"Packet from {address} could not be deserialized. Prot {subProtocol} Seq {sequence}")
-        else:
-            await self.dispatchPacket(subProtocol, sequence, message, address)
+        if tracer.enabled:
+            start = tracer.now()
+        try:
+            sequence, packet = pd.deserialize_message_raw(data)
+        except DeserializeError as e:
+            logger.info("Packet from {} could not be deserialized. Prot {} Seq {}: {}", address, e.subprot, e.sequence_number, e)
+            self.failPending(e, address)
+            return
+        message = packet.get_packet()
+        if tracer.enabled:
+            tracer.since(PHASE_DESERIALIZE, message.name, address[0], start)
+        self.routePacket(packet.get_subprotocol(), sequence, message, address)
+
+    def failPending(self, error: DeserializeError, address: Tuple[str, int]) -> bool:
+        """
+        Fails the first query of address waiting for the packet which could not be deserialized,
+        instead of letting it run into its timeout. Matched by the subprotocol and sequence of
+        the packet header, packets without a readable header are only logged.
+        """
+        waiters = self.waiters.get(address[0])
+        if not waiters or error.sequence_number is None:
+            return False
+        for waiter in waiters:
+            if waiter.sentSequence is None or waiter.sentSequence != error.sequence_number:
+                continue
+            if waiter.subProtocol is not None and waiter.subProtocol.value != error.subprot:
+                continue
+            if not waiter.future.done():
+                waiter.future.set_exception(error)
+                return True
+        return False
+
+    def routePacket(
+        self, subProtocol: subProtocols, sequence: int, message: protocol.BaseMessage, address: Tuple[str, int]
+    ) -> None:
+        """
+        Resolves the first query waiting for this packet directly and queues the packet for
+        the coroutine subscribers, which run one after another in a single task.
+        """
+        processed = False
+        waiters = self.waiters.get(address[0])
+        if waiters:
+            for waiter in waiters:
+                if waiter.subProtocol is not None and waiter.subProtocol != subProtocol:
+                    continue
+                if waiter.sequence is not None and waiter.sequence != sequence:
+                    continue
+                if not waiter.future.done():
+                    waiter.future.set_result((subProtocol, sequence, message, address))
+                    processed = True
+                    break
+
+        if self.subscribers:
+            if len(self.subscriberQueue) >= SUBSCRIBER_QUEUE_SIZE:
+                self.droppedPackets += 1
+                logger.debug("Subscribers fall behind, dropped {} from {}", message.name, address[0])
+                return
+            self.subscriberQueue.append(((subProtocol, sequence, message, address), processed))
+            if self.subscriberTask is None:
+                self.subscriberTask = asyncio.ensure_future(self._runSubscribers())
+        elif not processed:
+            logger.debug(
+                "Received an unprocessed packet. Type {}, sequence {} from {}:{}",
+                message.name, sequence, address[0], address[1],
+            )
+
+    async def _runSubscribers(self) -> None:
+        try:
+            while self.subscriberQueue:
+                packet, processed = self.subscriberQueue.popleft()
+                await self.dispatchPacket(*packet, processed=processed)
+        finally:
+            self.subscriberTask = None
 
     async def dispatchPacket(
-        self, subProtocol: subProtocols, sequence: int, message: bytes, address: Tuple[str, int]
+        self,
+        subProtocol: subProtocols,
+        sequence: int,
+        message: protocol.BaseMessage,
+        address: Tuple[str, int],
+        processed: bool = False,
     ) -> None:
+        if tracer.enabled:
+            start = tracer.now()
         async with self.dispatchLock:
-            processed = False
+            if tracer.enabled:
+                start = tracer.since(PHASE_DISPATCH_LOCK, message.name, address[0], start)
             for proc in self.subscribers:
                 try:
                     if await proc(subProtocol, sequence, message, address):
                         processed = True
-                except Exception as e:
-                    proc_name = getattr(proc, "__qualname__", str(type(proc)))
-                    pack_name = getattr(message, "name", type(message))
-                    ts_print(
-                        f"An error occured during processing of Packet-Type {pack_name} in subscriber {proc_name}"
+                except Exception:
+                    logger.exception(
+                        "An error occured during processing of Packet-Type {} in subscriber {}",
+                        getattr(message, "name", type(message)),
+                        getattr(proc, "__qualname__", str(type(proc))),
                     )
-                    ts_print(e)
-                    ts_print(traceback.format_exc())
+            if tracer.enabled:
+                tracer.since(PHASE_DISPATCH, message.name, address[0], start)
             if not processed:
-                # ts_print(f"Received an unprocessed packet. Type {message.name}, sequence {sequence} from {address[0]}:{address[1]}")
-                # ts_print("Content was: {}".format(message))
-                return
+                logger.debug(
+                    "Received an unprocessed packet. Type {}, sequence {} from {}:{}",
+                    message.name, sequence, address[0], address[1],
+                )
 
     def _check_subscriber(self, subscriber) -> None:
         if not callable(subscriber):
@@ -128,8 +358,7 @@ class UdpServer:
         # Check for the parameters required
         required = ["command", "sequence", "message", "address"]
         if set(required) > set(subscriber.__code__.co_varnames):
-            ts_print(subscriber)
-            ts_print(subscriber.__code__.co_varnames)
+            logger.debug("{} has parameters {}", subscriber, subscriber.__code__.co_varnames)
             raise AttributeError("Subscriber does not posess required parameters.")
 
     def subscribe(self, subscriber: SubscriberType) -> None:
@@ -141,6 +370,45 @@ class UdpServer:
             raise ValueError("Not a valid subscriber!")
         self.subscribers.remove(subscriber)
 
+    def addRawTap(self, tap: RawTapType) -> None:
+        """
+        :param tap: Called with every raw datagram before it is decoded, returns True if it
+                    took the datagram, which is then neither decoded nor dispatched
+        """
+        self.rawTaps.append(tap)
+
+    def removeRawTap(self, tap: RawTapType) -> None:
+        if tap not in self.rawTaps:
+            raise ValueError("Not a valid tap!")
+        self.rawTaps.remove(tap)
+
+    @contextmanager
+    def expectResponse(
+        self,
+        filterAddr: str,
+        filterSP: Optional[subProtocols] = None,
+        filterSeq: Optional[int] = None,
+        sentSeq: Optional[int] = None,
+    ) -> Iterator[asyncio.Future]:
+        """
+        Yields a future resolved with (subProtocol, sequence, message, address) of the first
+        matching packet received while the context is active. A matching packet which can't be
+        deserialized fails the future with the DeserializeError (see failPending()).
+
+        :param sentSeq: Sequence of the request, defaults to filterSeq. Only needed to fail the
+            future early if responses are not filtered by their sequence.
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiter = ResponseWaiter(filterSP, filterSeq, future, sentSeq)
+        waiters = self.waiters.setdefault(filterAddr, [])
+        waiters.append(waiter)
+        try:
+            yield future
+        finally:
+            waiters.remove(waiter)
+            if not waiters and self.waiters.get(filterAddr) is waiters:
+                del self.waiters[filterAddr]
+
     @contextmanager
     def subscriberFilterContext(
         self,
@@ -159,16 +427,17 @@ class UdpServer:
                 return False
             return await subscriber(sequence, message, address)
 
-        # ts_print("Subscribing filter SP {} seq {} addr {}", filterSP, filterSeq, filterAddr)
+        logger.debug("Subscribing filter SP {} seq {} addr {}", filterSP, filterSeq, filterAddr)
         self.subscribe(filtered_message)
         try:
             yield
         finally:
-            # ts_print("Unsubscribing filter SP {} seq {} addr {}", filterSP, filterSeq, filterAddr)
+            logger.debug("Unsubscribing filter SP {} seq {} addr {}", filterSP, filterSeq, filterAddr)
             self.unsubscribe(filtered_message)
             
     
-    def createPacketDataMacConfig(self, json_data, isOutput = False):
+    @staticmethod
+    def createPacketDataMacConfig(json_data, isOutput = False):
         # Initialize packet fields with default values
         packet_data = {
         'latency': 1,
@@ -288,7 +557,8 @@ class UdpServer:
             data.append(currPacket)
         return data
     
-    def createPacketDataSetGlobalHostConfig(self, deviceConfig, isOutput = False):
+    @staticmethod
+    def createPacketDataSetGlobalHostConfig(deviceConfig, isOutput = False):
         packet = {}
         if not isOutput:
             packet['dhcp_client'] = True if deviceConfig['useDhcp'] else False
@@ -303,7 +573,8 @@ class UdpServer:
                 packet.pop('comment')
         return packet
     
-    def createPacketDataSetHostConfig(self, json_data, isOutput = False):
+    @staticmethod
+    def createPacketDataSetHostConfig(json_data, isOutput = False):
         data = []
 
         set_host_config_data = {
@@ -329,9 +600,18 @@ class UdpServer:
                     modFilter = {'action': getFilterActionEnum(filter['action']), 'entries': modEntries}             
                     curr_data['traffic_filters'].append(pd.TrafficFilter(**modFilter))
             if 'routes' in llc_config:
+                addresses = []
                 for route in llc_config['routes']:
                     macAddress, extAddress = route
-                    modRoute = {'macaddress': route[macAddress], 'llcaddress': route[extAddress]}
+                    addresses.append(route[macAddress])
+                    addresses.append(route[extAddress])
+                # Parsed in one go, routes mostly share their llc addresses
+                try:
+                    addresses = MacAddress.parseMany(addresses)
+                except MacAddressValueError as e:
+                    raise SerializeError("Invalid route address: {}".format(e))
+                for i in range(0, len(addresses), 2):
+                    modRoute = {'macaddress': addresses[i], 'llcaddress': addresses[i + 1]}
                     curr_data['routes'].append(pd.RTLookup(**modRoute))
             data.append(curr_data)
         return data
\ No newline at end of file
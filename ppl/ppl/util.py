@@ -1,5 +1,18 @@
 from datetime import datetime
 
+# Structured logging and event loop selection are shared with r3erci, see r3erci.util
+from r3erci.util import (  # noqa: F401
+    JsonLineFormatter,
+    StyleAdapter,
+    addLoggingArguments,
+    addLoopArguments,
+    getLogger,
+    runMain,
+    setupLogging,
+    setupLoggingFromArgs,
+    stopLogging,
+)
+
 logActive = False
 
 def ts_print(msg=""):
@@ -10,4 +23,4 @@ def ts_print(msg=""):
 
 def enableLog(enable):
     global logActive
-    logActive = enable
\ No newline at end of file
+    logActive = enable
@@ -1,4 +1,3 @@
-import asyncio
 from typing import Dict
 
 from r3erci.client import ErciClient
@@ -7,7 +6,8 @@ from r3erci.constants import (
     PORT,
 )
 from r3erci.exceptions import ErciException
-from r3erci.util import ts_print
+from r3erci.tracing import addStatsArguments, runMainWithStats
+from r3erci.util import addLoggingArguments, addLoopArguments, setupLoggingFromArgs, ts_print
 
 
 async def execute(args: Dict) -> None:
@@ -28,7 +28,7 @@ async def execute(args: Dict) -> None:
     configmode_flag: int = args.configmode_flag if "configmode_flag" in args else None
 
     try:
-        client = ErciClient(
+        client = await ErciClient.create(
             ownaddress=ownaddress,
             ownport=ownport,
             timeout=timeout,
@@ -133,6 +133,10 @@ def main():
         help="The port to be used",
     )
 
+    addLoggingArguments(parser)
+    addLoopArguments(parser)
+    addStatsArguments(parser)
+
     subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
     subparsers.required = True
 
@@ -198,8 +202,8 @@ def main():
     subparsers.add_parser("csi", help="Sends command GET_CSI")
 
     args = parser.parse_args()
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(execute(args))
+    setupLoggingFromArgs(args)
+    runMainWithStats(execute(args), args)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,11 @@
 import asyncio
-import socket
-from ipaddress import ip_address
 from typing import List
 
 from r3erci.client import ErciClient
 from r3erci.constants import ErciCmd
 from r3erci.exceptions import ErciException
-from r3erci.util import ts_print
+from r3erci.tracing import addStatsArguments, runMainWithStats
+from r3erci.util import addLoggingArguments, addLoopArguments, readIpList, setupLoggingFromArgs, ts_print
 
 command_lut = {
     "start": ErciCmd.START,
@@ -18,7 +17,7 @@ command_lut = {
 
 
 async def exec(address: str, command: ErciCmd) -> None:
-    client = ErciClient()
+    client = await ErciClient.create()
     try:
         await client.send_command(address, command)
     except ValueError as e:
@@ -43,26 +42,18 @@ def main():
     parser.add_argument("command", choices=command_lut.keys())
     parser.add_argument("iplist", type=argparse.FileType("r", encoding="UTF-8"))
 
+    addLoggingArguments(parser)
+    addLoopArguments(parser)
+    addStatsArguments(parser)
+
     args = parser.parse_args()
+    setupLoggingFromArgs(args)
 
-    ips: List[str] = []
-    for ip_line in args.iplist.read().splitlines():
-        if not ip_line or ip_line[0] == "#":
-            continue
-        try:
-            ip_address(ip_line)
-        except ValueError:
-            try:
-                ip_address(socket.gethostbyname(ip_line))
-            except (socket.gaierror, ValueError) as e:
-                print(f"Skipping invalid IP/FQDN: {ip_line}: {e}")
-                continue
-        ips.append(ip_line)
+    ips = readIpList(args.iplist)
 
     cmd = command_lut[args.command]
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(async_main(ips, cmd))
+    runMainWithStats(async_main(ips, cmd), args, byDevice=True)
     args.iplist.close()
 
 
@@ -0,0 +1,87 @@
+from typing import List
+
+from r3erci.constants import PORT
+from r3erci.exporter import METRICS_PORT, DiagnosticsExporter
+from r3erci.util import addLoopArguments, readIpList, runMain
+
+
+async def async_main(args, ips: List[str]) -> None:
+    exporter = await DiagnosticsExporter.create(
+        ips,
+        interval=args.interval,
+        timeout=args.timeout,
+        queryDescription=args.diagdesc,
+        standalone=args.standalone,
+        ownaddress=args.ownaddress,
+        ownport=args.ownport,
+    )
+    await exporter.serve(args.listen, args.port)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Periodically polls the state of a list of EREBs and exports it as OpenMetrics."
+    )
+    parser.add_argument("iplist", type=argparse.FileType("r", encoding="UTF-8"))
+    parser.add_argument(
+        "-i", "--interval", type=float, default=10.0, help="Seconds between two poll cycles"
+    )
+    parser.add_argument(
+        "-t", "--timeout", type=float, default=2.0, help="Time to wait for a response"
+    )
+    parser.add_argument(
+        "-d",
+        "--diagdesc",
+        action="store_true",
+        default=False,
+        help="Additionally query the diagnostic description in every cycle",
+    )
+    parser.add_argument(
+        "-s",
+        "--standalone",
+        action="store_true",
+        default=False,
+        help="Simulates the EREBs",
+    )
+    parser.add_argument(
+        "-l",
+        "--listen",
+        type=str,
+        default="127.0.0.1",
+        help="The address to serve /metrics on",
+    )
+    parser.add_argument(
+        "-m", "--port", type=int, default=METRICS_PORT, help="The port to serve /metrics on"
+    )
+    parser.add_argument(
+        "-o",
+        "--ownaddress",
+        type=str,
+        default="0.0.0.0",
+        help="The interface to be used",
+    )
+    parser.add_argument(
+        "-p",
+        "--ownport",
+        type=str,
+        default=PORT,
+        help="The port to be used",
+    )
+
+    addLoopArguments(parser)
+
+    args = parser.parse_args()
+
+    ips = readIpList(args.iplist)
+    args.iplist.close()
+
+    try:
+        runMain(async_main(args, ips), args.loop)
+    except (KeyboardInterrupt, SystemExit):
+        print()
+
+
+if __name__ == "__main__":
+    main()
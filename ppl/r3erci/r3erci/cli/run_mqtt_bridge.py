@@ -0,0 +1,68 @@
+from r3erci.constants import PORT
+from r3erci.mqttBridge import BridgeError, MqttBridge, loadConfig
+from r3erci.session import ErciService
+from r3erci.util import addLoggingArguments, addLoopArguments, runMain, setupLoggingFromArgs, ts_print
+
+
+async def bridge(args) -> None:
+    config = loadConfig(args.config)
+    service = await ErciService.create(
+        ownaddress=args.ownaddress,
+        ownport=args.ownport,
+        timeout=args.timeout,
+        standalone=args.standalone,
+    )
+    broker = config["broker"]
+    ts_print(f"Bridging {len(config['routes'])} routes of {broker['host']}:{broker.get('port', 1883)}")
+    try:
+        await MqttBridge(service, config).run()
+    finally:
+        service.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Sends the ERCI commands mapped to MQTT messages and publishes the results as ACKs."
+    )
+    parser.add_argument("config", type=str, help="Path to the bridge config (JSON)")
+    parser.add_argument(
+        "-s",
+        "--standalone",
+        action="store_true",
+        default=False,
+        help="Simulates the EREBs",
+    )
+    parser.add_argument(
+        "-t", "--timeout", type=float, default=3.0, help="Time to wait for a response"
+    )
+    parser.add_argument(
+        "-o",
+        "--ownaddress",
+        type=str,
+        default="0.0.0.0",
+        help="The interface to be used",
+    )
+    parser.add_argument(
+        "-p",
+        "--ownport",
+        type=str,
+        default=PORT,
+        help="The port to be used",
+    )
+    addLoggingArguments(parser)
+    addLoopArguments(parser)
+    args = parser.parse_args()
+
+    setupLoggingFromArgs(args)
+    try:
+        runMain(bridge(args), args.loop)
+    except BridgeError as e:
+        raise SystemExit(f"Error: {e}")
+    except KeyboardInterrupt:
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,13 @@ from datetime import datetime
 from r3erci.client import ErciClient
 from r3erci.constants import ErciCmd, ErciState
 from r3erci.exceptions import ErciException, ResponseError, TimeoutError
-from r3erci.util import ts_print, color_string_fail, colors
+from r3erci.util import addLoopArguments, runMain, ts_print, color_string_fail, colors
 
 
 class ErciSequencer:
-    def __init__(self, address):
+    def __init__(self, address, client: ErciClient):
         self.address = address
-        self.client = ErciClient()
+        self.client = client
 
     async def run(self):
         # wait for device to be online
@@ -212,7 +212,7 @@ class ErciSequencer:
 
 
 async def async_main(address: str) -> None:
-    sequencer = ErciSequencer(address)
+    sequencer = ErciSequencer(address, await ErciClient.create())
     await sequencer.run()
 
 
@@ -223,11 +223,11 @@ def main():
         description="Testing sequencer simulating the PLC part of ERCI. Use with erci_ereb.py."
     )
     parser.add_argument("address", help="The IP/FQDN of the EREB")
+    addLoopArguments(parser)
 
     args = parser.parse_args()
-    loop = asyncio.get_event_loop()
     try:
-        loop.run_until_complete(async_main(args.address))
+        runMain(async_main(args.address), args.loop)
     except (KeyboardInterrupt, SystemExit):
         print()
         pass
@@ -0,0 +1,127 @@
+import json
+import sys
+
+from r3erci.constants import PORT
+from r3erci.session import ErciService, SessionServer, defaultSocketPath, request
+from r3erci.util import addLoggingArguments, addLoopArguments, runMain, setupLoggingFromArgs, ts_print
+
+
+async def serve(args) -> None:
+    service = await ErciService.create(
+        ownaddress=args.ownaddress,
+        ownport=args.ownport,
+        timeout=args.timeout,
+        standalone=args.standalone,
+    )
+    server = SessionServer(args.socket)
+    server.register(service.handlers())
+    await server.start()
+    ts_print(f"Session daemon listening on {server.path}")
+    try:
+        await server.serve()
+    finally:
+        service.close()
+
+
+def parseValue(value: str):
+    # Numbers, true/false and null as in JSON, anything else (e.g. file names) as string
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def splitCallArguments(args) -> None:
+    # Commands without address, e.g. "call validate input_file=..."
+    if args.address is not None and "=" in args.address:
+        args.args.insert(0, args.address)
+        args.address = None
+
+
+def call(args) -> int:
+    splitCallArguments(args)
+    params = {}
+    for param in args.args:
+        key, sep, value = param.partition("=")
+        if not sep:
+            print(f"Expected KEY=VALUE, got {param}", file=sys.stderr)
+            return 2
+        params[key] = parseValue(value)
+    try:
+        response = request(args.session_command, args.address, path=args.socket, timeout=args.timeout, **params)
+    except OSError as e:
+        print(f"Session daemon not reachable on {args.socket}: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(response, indent=2 if args.pretty else None))
+    return 0 if response.get("ok") else 1
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Long-lived ERCI session daemon keeping the socket open, and a thin client for it."
+    )
+    parser.add_argument(
+        "--socket", type=str, default=defaultSocketPath(), help="Unix socket of the session daemon"
+    )
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    subparsers.required = True
+
+    subparser_serve = subparsers.add_parser("serve", help="Runs the session daemon")
+    subparser_serve.add_argument(
+        "-s",
+        "--standalone",
+        action="store_true",
+        default=False,
+        help="Simulates the EREBs",
+    )
+    subparser_serve.add_argument(
+        "-t", "--timeout", type=float, default=3.0, help="Time to wait for a response"
+    )
+    subparser_serve.add_argument(
+        "-o",
+        "--ownaddress",
+        type=str,
+        default="0.0.0.0",
+        help="The interface to be used",
+    )
+    subparser_serve.add_argument(
+        "-p",
+        "--ownport",
+        type=str,
+        default=PORT,
+        help="The port to be used",
+    )
+    addLoggingArguments(subparser_serve)
+    addLoopArguments(subparser_serve)
+
+    subparser_call = subparsers.add_parser(
+        "call", help="Sends one command to the session daemon and prints the JSON response"
+    )
+    subparser_call.add_argument("session_command", help="e.g. ring, state or ping")
+    subparser_call.add_argument("address", nargs="?", default=None, help="The IP of the EREB")
+    subparser_call.add_argument(
+        "args", nargs="*", metavar="KEY=VALUE", help="Command arguments, e.g. ring_id=2 antenna_id=1"
+    )
+    subparser_call.add_argument(
+        "-t", "--timeout", type=float, default=30.0, help="Time to wait for the daemon"
+    )
+    subparser_call.add_argument(
+        "--pretty", action="store_true", default=False, help="Indent the JSON response"
+    )
+
+    args = parser.parse_args()
+    if args.command == "call":
+        sys.exit(call(args))
+
+    setupLoggingFromArgs(args)
+    try:
+        runMain(serve(args), args.loop)
+    except KeyboardInterrupt:
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,7 @@ from r3erci.constants import (
     GetPacketLength,
 )
 from r3erci.constants import PacketLengthType as PLT
+from r3erci.simulator import MAX_DATAGRAM_SIZE
 from r3erci.util import color_string_fail, colors
 
 
@@ -41,7 +42,7 @@ class SimulateEreb:
 
         try:
             while True:
-                data, addr = self.sock.recvfrom(100)
+                data, addr = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
                 print("")
                 print(f"Request from {addr[0]}:{addr[1]}: {data}")
 
@@ -0,0 +1,92 @@
+from ipaddress import IPv4Address
+
+from r3erci.constants import PORT
+from r3erci.simulator import FLEET_BASE_ADDRESS, NetworkConditions, fleetAddress, serveFleet
+from r3erci.util import addLoopArguments
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Simulates a fleet of EREBs on consecutive loopback addresses for load tests."
+        f" Clients on the same host need to use another own port than {PORT}."
+    )
+    parser.add_argument("count", type=int, help="Number of EREBs to simulate")
+    parser.add_argument(
+        "-b",
+        "--base",
+        type=IPv4Address,
+        default=FLEET_BASE_ADDRESS,
+        help="Address of the first EREB, device n is reachable at base + n",
+    )
+    parser.add_argument("-p", "--port", type=int, default=PORT, help="The port to be used")
+    parser.add_argument(
+        "-j", "--processes", type=int, default=1, help="Number of processes to spread the EREBs over"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Response delay in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Additional random response delay in seconds"
+    )
+    parser.add_argument(
+        "--loss", type=float, default=0.0, help="Probability that a response is dropped"
+    )
+    parser.add_argument(
+        "--reorder",
+        type=float,
+        default=0.0,
+        help="Probability that a response is held back by --reorder-delay",
+    )
+    parser.add_argument(
+        "--reorder-delay", type=float, default=0.01, help="Delay of held back responses in seconds"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the impairments for reproducible runs (process n uses SEED + its first EREB)",
+    )
+    parser.add_argument(
+        "--stats", type=float, default=None, help="Print counters every STATS seconds"
+    )
+    parser.add_argument(
+        "--iplist",
+        type=argparse.FileType("w", encoding="UTF-8"),
+        default=None,
+        help="Write the simulated addresses to this file (usable with r3erci-batch)",
+    )
+    addLoopArguments(parser)
+
+    args = parser.parse_args()
+
+    if args.iplist is not None:
+        for i in range(args.count):
+            args.iplist.write(f"{fleetAddress(i, args.base)}\n")
+        args.iplist.close()
+
+    conditions = NetworkConditions(
+        latency=args.latency,
+        jitter=args.jitter,
+        loss=args.loss,
+        reorder=args.reorder,
+        reorderDelay=args.reorder_delay,
+        seed=args.seed,
+    )
+    try:
+        serveFleet(
+            args.count,
+            processes=args.processes,
+            base=args.base,
+            port=args.port,
+            conditions=conditions,
+            statsInterval=args.stats,
+            loop=args.loop,
+        )
+    except KeyboardInterrupt:
+        print("")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import socket
+import sys
+from typing import List
+
+from r3erci.client import ErciClient
+from r3erci.constants import PORT
+from r3erci.switchover import RingSwitchover, StepReport, SwitchoverReport
+from r3erci.util import (
+    addLoggingArguments,
+    addLoopArguments,
+    color_string_fail,
+    color_string_success,
+    readIpList,
+    runMain,
+    setupLoggingFromArgs,
+    ts_print,
+)
+
+
+def _ms(seconds) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.3f}ms"
+
+
+def printStep(step: StepReport, rollback: bool = False) -> None:
+    ts_print(
+        f"{'Rollback ' if rollback else ''}{step.command}: {len(step.succeeded)}/{len(step.members)} ok,"
+        f" dispatch spread {_ms(step.dispatchSpread)}, response skew {_ms(step.skew)}"
+    )
+    for member in step.members:
+        if member.error is not None:
+            outcome = color_string_fail(str(member.error))
+        elif member.success:
+            outcome = color_string_success("SUCCESS")
+        else:
+            outcome = color_string_fail(f"FAILED - {member.result.get('status_msg', '')}")
+        print(f"    {member.address:<16} latency {_ms(member.latency):>10}  offset {_ms(step.offset(member)):>10}  {outcome}")
+
+
+def printReport(report: SwitchoverReport) -> None:
+    for step in report.steps:
+        printStep(step)
+    if report.aborted is not None:
+        ts_print(color_string_fail(f"Aborted before changing anything: {report.aborted}"))
+    for step in report.rollback:
+        printStep(step, rollback=True)
+    if report.success:
+        ts_print(color_string_success("Switchover done"))
+    elif report.aborted is None:
+        ts_print(color_string_fail("Switchover failed" + (", rolled back" if report.rollback else "")))
+
+
+async def async_main(args, ips: List[str]) -> bool:
+    client = await ErciClient.create(
+        ownaddress=args.ownaddress,
+        ownport=args.ownport,
+        timeout=args.timeout,
+        standalone=args.standalone,
+        disablePrints=True,
+        batched=True,
+    )
+    switchover = RingSwitchover(client, ips, rollback=not args.no_rollback)
+    if args.command == "ring":
+        report = await switchover.switchRing(args.ring_id, args.antenna_id)
+    else:
+        report = await switchover.selectConfig(args.config_id, args.ring_id, args.antenna_id, start=not args.no_start)
+    printReport(report)
+    return report.success
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Switches the ring or config of a group of EREBs (defined in IP_LIST) at once."
+    )
+    parser.add_argument("iplist", type=argparse.FileType("r", encoding="UTF-8"))
+    parser.add_argument(
+        "-t", "--timeout", type=float, default=3.0, help="Time to wait for the responses of a step"
+    )
+    parser.add_argument(
+        "--no-rollback",
+        action="store_true",
+        default=False,
+        help="Leave the members as they are if a step fails",
+    )
+    parser.add_argument(
+        "-s",
+        "--standalone",
+        action="store_true",
+        default=False,
+        help="Simulates the EREBs",
+    )
+    parser.add_argument(
+        "-o",
+        "--ownaddress",
+        type=str,
+        default="0.0.0.0",
+        help="The interface to be used",
+    )
+    parser.add_argument(
+        "-p",
+        "--ownport",
+        type=str,
+        default=PORT,
+        help="The port to be used",
+    )
+    addLoggingArguments(parser)
+    addLoopArguments(parser)
+
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    subparsers.required = True
+
+    subparser_ring = subparsers.add_parser("ring", help="Switches all running members to another ring")
+    subparser_ring.add_argument("ring_id", type=int, help="id of the ring")
+    subparser_ring.add_argument("antenna_id", type=int, help="id of the antenna")
+
+    subparser_config = subparsers.add_parser(
+        "config", help="Selects a config on all members and starts them together"
+    )
+    subparser_config.add_argument("config_id", type=int, help="id of the config")
+    subparser_config.add_argument("ring_id", type=int, help="id of the ring")
+    subparser_config.add_argument("antenna_id", type=int, help="id of the antenna")
+    subparser_config.add_argument(
+        "--no-start", action="store_true", default=False, help="Only select the config"
+    )
+
+    args = parser.parse_args()
+    setupLoggingFromArgs(args)
+
+    ips = []
+    for ip in readIpList(args.iplist):
+        ips.append(socket.gethostbyname(ip))
+    args.iplist.close()
+
+    try:
+        success = runMain(async_main(args, ips), args.loop)
+    except ValueError as e:
+        ts_print(f"Raised error: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print()
+        sys.exit(1)
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
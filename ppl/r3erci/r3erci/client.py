@@ -1,6 +1,7 @@
 import asyncio
+from heapq import heapify, heappop, heappush
 from ipaddress import IPv4Address, ip_address
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from struct import unpack
 
 from r3erci.constants import (
@@ -24,10 +25,21 @@ from r3erci.constants import (
     GetPacketLength,
 )
 from r3erci.constants import PacketLengthType as PLT
-from r3erci.exceptions import ResourceLocked, ResponseError, TimeoutError
+from r3erci.exceptions import CommandDropped, ResponseError, TimeoutError
 from r3erci.standaloneServer import StandaloneServer
+from r3erci.tracing import (
+    PHASE_DESERIALIZE,
+    PHASE_HANDLER,
+    PHASE_QUERY_LOCK,
+    PHASE_RECEIVE,
+    PHASE_SEND,
+    PHASE_SERIALIZE,
+    tracer,
+)
 from r3erci.udpServer import UdpServer
 from r3erci.util import (
+    StyleAdapter,
+    getLogger,
     ts_print,
     color_string,
     color_string_fail,
@@ -35,6 +47,108 @@ from r3erci.util import (
     colors,
 )
 
+logger = StyleAdapter(getLogger(__name__))
+
+# Commands to the same device wait in this order, safety first
+PRIORITY_SAFETY = 0
+PRIORITY_CONTROL = 1
+PRIORITY_QUERY = 2
+
+COMMAND_PRIORITIES = {
+    ErciCmd.STOP: PRIORITY_SAFETY,
+    ErciCmd.SWITCH_RING: PRIORITY_SAFETY,
+    ErciCmd.SWITCH_ANTENNA: PRIORITY_SAFETY,
+    ErciCmd.SELECT_CONFIG: PRIORITY_CONTROL,
+    ErciCmd.START: PRIORITY_CONTROL,
+    ErciCmd.SET_CONFIGMODE: PRIORITY_CONTROL,
+    ErciCmd.REBOOT: PRIORITY_CONTROL,
+    ErciCmd.STATE_QUERY: PRIORITY_QUERY,
+    ErciCmd.DIAGNOSTIC_DESCRIPTION_QUERY: PRIORITY_QUERY,
+    ErciCmd.PASSPORT_QUERY: PRIORITY_QUERY,
+    ErciCmd.GET_CSI_QUERY: PRIORITY_QUERY,
+}
+
+# Upper bound of commands waiting for one device
+MAX_QUEUED_COMMANDS = 16
+
+
+class CommandQueue:
+    """
+    Commands of one device: one is executed at a time, the others wait ordered by priority
+    and then by arrival. A command waiting longer than its deadline or pushed out of a full
+    queue by a command of higher priority fails with CommandDropped.
+    """
+
+    __slots__ = ("seqno", "busy", "waiting", "counter", "maxQueued", "dropped")
+
+    def __init__(self, maxQueued: int = MAX_QUEUED_COMMANDS):
+        self.seqno = 0
+        self.busy = False
+        self.waiting = []  # type: List[Tuple[int, int, asyncio.Future]]
+        self.counter = 0
+        self.maxQueued = maxQueued
+        self.dropped = 0
+
+    def nextSeqno(self) -> int:
+        self.seqno = self.seqno + 1
+        if self.seqno > 255:
+            self.seqno = 0
+        return self.seqno
+
+    async def acquire(self, priority: int, deadline: Optional[float] = None) -> None:
+        """
+        :param deadline: Seconds the command may wait, None to wait as long as it takes
+        """
+        if not self.busy and not self.waiting:
+            self.busy = True
+            return
+
+        if len(self.waiting) >= self.maxQueued:
+            worst = max(self.waiting)
+            if worst[0] <= priority:
+                self.dropped += 1
+                raise CommandDropped(f"{self.maxQueued} commands are already waiting for the device.")
+            self._remove(worst)
+            self.dropped += 1
+            worst[2].set_exception(CommandDropped("Pushed out of the full queue by a command of higher priority."))
+
+        loop = asyncio.get_running_loop()
+        entry = (priority, self.counter, loop.create_future())
+        self.counter += 1
+        heappush(self.waiting, entry)
+        timer = loop.call_later(deadline, self._expire, entry, deadline) if deadline is not None else None
+        try:
+            await entry[2]
+        except asyncio.CancelledError:
+            future = entry[2]
+            if entry in self.waiting:
+                self._remove(entry)
+            elif future.done() and not future.cancelled() and future.exception() is None:
+                # Cancelled right after it was our turn, pass it on
+                self.release()
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def release(self) -> None:
+        while self.waiting:
+            _, _, future = heappop(self.waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.busy = False
+
+    def _remove(self, entry: Tuple[int, int, asyncio.Future]) -> None:
+        self.waiting.remove(entry)
+        heapify(self.waiting)
+
+    def _expire(self, entry: Tuple[int, int, asyncio.Future], deadline: float) -> None:
+        if entry in self.waiting:
+            self._remove(entry)
+            self.dropped += 1
+            entry[2].set_exception(CommandDropped(f"Waited more than {deadline} seconds for the device."))
+
 
 class ErciQuery:
     def __init__(self, udpServer, timeout):
@@ -43,42 +157,42 @@ class ErciQuery:
         self.response = None
 
     @staticmethod
-    def _wait_for(event: asyncio.Event, timeout: float):
-        return asyncio.wait_for(event.wait(), timeout)
+    def _wait_for(future: asyncio.Future, timeout: float):
+        return asyncio.wait_for(future, timeout)
 
     async def execute(
         self, data: bytes, address: IPv4Address, responseCmd=None, seq=None
     ) -> Tuple[bytes, Tuple[str, int]]:
-        # logger.debug("Executing {}: {}", self.address, repr(self.query))
-        queryEvent = asyncio.Event()
-
-        async def responseHandler(
-            command: ErciCmd, sequence: int, message: bytes, address: Tuple[str, int]
-        ) -> bool:
-            # logger.debug("GotResp: {}:  {}", address[0], repr(message))
-            self.response = message
-            self.rx_address = address
-            queryEvent.set()
-            return True
-
-        with self.udpServer.subscriberFilterContext(
-            responseHandler,
+        logger.debug("Executing {}: {!r}", address, data)
+
+        with self.udpServer.expectResponse(
+            str(address),
             filterCmd=responseCmd if responseCmd else None,
             filterSeq=seq if seq else None,
-            filterAddr=str(address),
-        ):
-            self.udpServer.sendPacket(data, address, PORT)
+        ) as response:
+            if tracer.enabled:
+                command = ErciCmd(data[ErciPosHeader.COMMAND])
+                start = tracer.now()
+                self.udpServer.sendPacket(data, address, PORT)
+                sent = tracer.since(PHASE_SEND, command, address, start)
+            else:
+                self.udpServer.sendPacket(data, address, PORT)
             try:
-                await self._wait_for(queryEvent, self.timeout)
-                queryEvent.clear()
+                _, _, self.response, self.rx_address = await self._wait_for(response, self.timeout)
             except asyncio.TimeoutError:
                 raise TimeoutError(f"{address}: No response in {self.timeout} seconds.")
+            if tracer.enabled:
+                tracer.since(PHASE_RECEIVE, command, address, sent)
+        logger.debug("GotResp: {}:  {!r}", self.rx_address[0], self.response)
         assert self.response is not None
         return self.response, self.rx_address
 
 
 class ErciClient:
-    seqno = 0
+    """
+    Sends ERCI commands to any number of devices. Commands to different devices run in
+    parallel, commands to the same device are queued by priority (see CommandQueue).
+    """
 
     def __init__(
         self,
@@ -87,16 +201,51 @@ class ErciClient:
         timeout: int = 3,
         standalone: bool = False,
         disablePrints: bool = False,
+        udpServer: Optional[UdpServer] = None,
+        batched: bool = False,
+        maxQueued: int = MAX_QUEUED_COMMANDS,
     ):
         self.timeout = timeout
         self.disablePrints = disablePrints
-        self.queryLock = asyncio.Lock()
-        if standalone:
+        self.maxQueued = maxQueued
+        self.queues = {}  # type: Dict[IPv4Address, CommandQueue]
+        if udpServer is not None:
+            # Several clients (e.g. one per device) can share one socket
+            self.udpServer = udpServer
+        elif standalone:
             self.udpServer = StandaloneServer()
         else:
-            self.udpServer = UdpServer(ownaddress, ownport)
+            self.udpServer = UdpServer(ownaddress, ownport, batched=batched)
 
-    def _handle_response(self, rxdata: bytes, addr: Tuple[str, int]):
+    @classmethod
+    async def create(
+        cls,
+        ownaddress: str = "0.0.0.0",
+        ownport: int = PORT,
+        timeout: int = 3,
+        standalone: bool = False,
+        disablePrints: bool = False,
+        udpServer: Optional[UdpServer] = None,
+        batched: bool = False,
+        maxQueued: int = MAX_QUEUED_COMMANDS,
+    ) -> "ErciClient":
+        """
+        Creates the client from within a running event loop, see UdpServer.create().
+        """
+        if udpServer is None:
+            if standalone:
+                udpServer = await StandaloneServer.create()
+            else:
+                udpServer = await UdpServer.create(ownaddress, ownport, batched=batched)
+        return cls(timeout=timeout, disablePrints=disablePrints, udpServer=udpServer, maxQueued=maxQueued)
+
+    def commandQueue(self, address: IPv4Address) -> CommandQueue:
+        queue = self.queues.get(address)
+        if queue is None:
+            queue = self.queues[address] = CommandQueue(self.maxQueued)
+        return queue
+
+    def _handle_response(self, rxdata: bytes, addr: Tuple[str, int], seqno: int):
         le, plt = GetPacketLength(None)
         if len(rxdata) < le:
             raise ResponseError(
@@ -115,9 +264,9 @@ class ErciClient:
 
         rx_seqno = rxdata[ErciPosHeader.SEQUENCE]
 
-        if rx_seqno != self.seqno:
+        if rx_seqno != seqno:
             raise ResponseError(
-                f"Response from {addr[0]}: {color_string_fail(f'Mismatching sequence number: {self.seqno} -> {rx_seqno}!')}"
+                f"Response from {addr[0]}: {color_string_fail(f'Mismatching sequence number: {seqno} -> {rx_seqno}!')}"
             )
 
         try:
@@ -172,12 +321,15 @@ class ErciClient:
 
             r = {
                 "type": msg_type,
+                "code": rxdata[ErciPosCmdRes.CODE],
                 "success": None,
                 "status_msg": None,
             }
 
+            if r["code"] in ErciResultCode._value2member_map_:
+                r["code"] = ErciResultCode(r["code"])
             r["status_msg"] = rxdata[ErciPosCmdRes.MSG_START :].decode()
-            if rxdata[ErciPosCmdRes.CODE] != ErciResultCode.SUCCESS:
+            if r["code"] != ErciResultCode.SUCCESS:
                 self._print(
                     f"Response from {addr[0]}: COMMAND_RESULT {color_string_fail('FAILED')} - \"{r['status_msg']}\""
                 )
@@ -303,12 +455,17 @@ class ErciClient:
             )
 
     async def _send_command_and_handle_response(
-        self, txdata: bytes, address: IPv4Address
+        self, txdata: bytes, address: IPv4Address, seqno: int
     ) -> dict:
         response, rx_address = await ErciQuery(self.udpServer, self.timeout).execute(
-            txdata, address, seq=self.seqno
+            txdata, address, seq=seqno
         )
-        result = self._handle_response(response, rx_address)
+        if tracer.enabled:
+            start = tracer.now()
+            result = self._handle_response(response, rx_address, seqno)
+            tracer.since(PHASE_DESERIALIZE, ErciCmd(txdata[ErciPosHeader.COMMAND]), address, start)
+        else:
+            result = self._handle_response(response, rx_address, seqno)
         return result
 
     def _create_msg(
@@ -320,15 +477,13 @@ class ErciClient:
         configmode_flag: Optional[int],
         mac_address: Optional[bytearray],
         serial_number: Optional[bytearray],
+        seqno: int,
     ):
         data = bytearray()
         data.append(RESERVED_VALUE)
         data.append(PROTOCOL_VERSION)
         data.append(int(msg_type))
-        self.seqno = self.seqno + 1
-        if self.seqno > 255:
-            self.seqno = 0
-        data.append(self.seqno)
+        data.append(seqno)
 
         if config_id is not None:
             data.append(config_id)
@@ -347,19 +502,13 @@ class ErciClient:
 
         return data
 
-    async def send_command(
-        self,
-        address: str,
-        command: ErciCmd,
-        config_id: int = None,
-        ring_id: int = None,
-        antenna_id: int = None,
-        configmode_flag: int = None,
-        mac_address: str = None,
-        serial_number: str = None,
-    ) -> dict:
-        ip = ip_address(address)
-
+    @staticmethod
+    def _check_ids(
+        config_id: Optional[int],
+        ring_id: Optional[int],
+        antenna_id: Optional[int],
+        configmode_flag: Optional[int] = None,
+    ) -> None:
         if config_id is not None:
             assert ring_id is not None
             assert antenna_id is not None
@@ -377,6 +526,36 @@ class ErciClient:
             if (configmode_flag != 0) and (configmode_flag != 1):
                 raise ValueError("Argument configmode_flag needs to be 0 or 1!")
 
+    async def send_command(
+        self,
+        address: str,
+        command: ErciCmd,
+        config_id: int = None,
+        ring_id: int = None,
+        antenna_id: int = None,
+        configmode_flag: int = None,
+        mac_address: str = None,
+        serial_number: str = None,
+        priority: Optional[int] = None,
+        deadline: Optional[float] = None,
+    ) -> dict:
+        """
+        Sends the command once it is its turn on the device and returns the parsed response.
+
+        :param priority: Position in the queue of the device (lower first), by default from
+                         COMMAND_PRIORITIES
+        :param deadline: Seconds the command may wait for the device before it is dropped
+                         (CommandDropped), by default the timeout for queries and unlimited
+                         for the other commands
+        """
+        ip = ip_address(address)
+        if priority is None:
+            priority = COMMAND_PRIORITIES.get(command, PRIORITY_CONTROL)
+        if deadline is None and priority >= PRIORITY_QUERY:
+            deadline = self.timeout
+
+        self._check_ids(config_id, ring_id, antenna_id, configmode_flag)
+
         if mac_address is not None:
             assert serial_number is not None
 
@@ -419,9 +598,6 @@ class ErciClient:
                     f"Argument serial_number must be length {SERIAL_NUMBER_LENGTH} but is {len(serial_number)}!"
                 )
 
-        if self.queryLock.locked():
-            raise ResourceLocked("Another ERCI query is currently active.")
-
         params = " with "
         if configmode_flag is not None:
             params += f"configmode_flag={configmode_flag}"
@@ -435,7 +611,14 @@ class ErciClient:
 
         self._print(f"Sending command {str(command)}{params} to {address}:{PORT}...")
 
-        async with self.queryLock:
+        if tracer.enabled:
+            start = tracer.now()
+        queue = self.commandQueue(ip)
+        await queue.acquire(priority, deadline)
+        try:
+            if tracer.enabled:
+                locked = tracer.since(PHASE_QUERY_LOCK, command, ip, start)
+            seqno = queue.nextSeqno()
             data = self._create_msg(
                 command,
                 config_id,
@@ -444,8 +627,16 @@ class ErciClient:
                 configmode_flag,
                 mac_address,
                 serial_number,
+                seqno,
             )
-            return await self._send_command_and_handle_response(data, ip)
+            if tracer.enabled:
+                tracer.since(PHASE_SERIALIZE, command, ip, locked)
+            result = await self._send_command_and_handle_response(data, ip, seqno)
+            if tracer.enabled:
+                tracer.since(PHASE_HANDLER, command, ip, start)
+            return result
+        finally:
+            queue.release()
 
     def _print(self, msg):
         if self.disablePrints == False:
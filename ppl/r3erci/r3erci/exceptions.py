@@ -3,6 +3,11 @@ class ErciException(Exception):
 
 
 class ResourceLocked(ErciException):
+    # Not raised anymore, commands wait in the queue of their device instead
+    pass
+
+
+class CommandDropped(ErciException):
     pass
 
 
@@ -0,0 +1,307 @@
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from r3erci.client import ErciClient
+from r3erci.constants import PORT, ErciCmd, ErciState
+from r3erci.exceptions import ErciException, TimeoutError
+from r3erci.standaloneServer import StandaloneServer
+from r3erci.udpServer import UdpServer
+from r3erci.util import StyleAdapter, getLogger, ts_print
+
+logger = StyleAdapter(getLogger(__name__))
+
+METRICS_PORT = 9464
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Time (in seconds) a scraper gets to send its request
+HTTP_REQUEST_TIMEOUT = 5.0
+# Upper bound of the request line and of each header line
+MAX_REQUEST_LINE = 8 * 1024
+
+# Upper bounds (in seconds) of the poll latency histogram buckets
+POLL_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class LatencyHistogram:
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Iterable[float] = POLL_LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name: str, **labels) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_labels(**labels, le=le)} {cumulative}")
+        lines.append(f"{name}_count{_labels(**labels) if labels else ''} {self.count}")
+        lines.append(f"{name}_sum{_labels(**labels) if labels else ''} {self.sum}")
+        return lines
+
+
+class DeviceSample:
+    __slots__ = (
+        "timestamp",
+        "latency",
+        "state",
+        "config_id",
+        "ring_id",
+        "antenna_id",
+        "description",
+    )
+
+    def __init__(self, timestamp: float, latency: float, response: dict):
+        self.timestamp = timestamp
+        self.latency = latency
+        self.state = response["state"]
+        self.config_id = response["config_id"]
+        self.ring_id = response["ring_id"]
+        self.antenna_id = response["antenna_id"]
+        self.description = None  # type: Optional[str]
+
+
+class DeviceStats:
+    __slots__ = ("polls", "timeouts", "errors", "up", "sample")
+
+    def __init__(self):
+        self.polls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.up = False
+        self.sample = None  # type: Optional[DeviceSample]
+
+
+class DiagnosticsExporter:
+    """
+    Polls STATE_QUERY (and optionally DIAGNOSTIC_DESCRIPTION_QUERY) of a set of EREBs
+    concurrently over one socket and serves the cached results in OpenMetrics format.
+    Scrapes never trigger device queries.
+    """
+
+    def __init__(
+        self,
+        addresses: Iterable[str],
+        interval: float = 10.0,
+        timeout: float = 2.0,
+        queryDescription: bool = False,
+        udpServer: Optional[UdpServer] = None,
+        standalone: bool = False,
+        ownaddress: str = "0.0.0.0",
+        ownport: int = PORT,
+    ):
+        self.interval = interval
+        self.queryDescription = queryDescription
+        if udpServer is not None:
+            self.udpServer = udpServer
+        elif standalone:
+            self.udpServer = StandaloneServer()
+        else:
+            # Poll cycles receive bursts of responses, drain them in batches
+            self.udpServer = UdpServer(ownaddress, ownport, batched=True)
+
+        self.clients = {}  # type: Dict[str, ErciClient]
+        self.stats = {}  # type: Dict[str, DeviceStats]
+        for address in addresses:
+            self.clients[address] = ErciClient(
+                timeout=timeout, disablePrints=True, udpServer=self.udpServer
+            )
+            self.stats[address] = DeviceStats()
+
+        self.pollLatency = LatencyHistogram()
+        self.cycleDuration = 0.0
+        self.cycles = 0
+        self.httpServer = None  # type: Optional[asyncio.AbstractServer]
+
+    @classmethod
+    async def create(
+        cls,
+        addresses: Iterable[str],
+        interval: float = 10.0,
+        timeout: float = 2.0,
+        queryDescription: bool = False,
+        standalone: bool = False,
+        ownaddress: str = "0.0.0.0",
+        ownport: int = PORT,
+    ) -> "DiagnosticsExporter":
+        """
+        Creates the exporter from within a running event loop, see UdpServer.create().
+        """
+        if standalone:
+            udpServer = await StandaloneServer.create()
+        else:
+            udpServer = await UdpServer.create(ownaddress, ownport, batched=True)
+        return cls(addresses, interval, timeout, queryDescription, udpServer=udpServer)
+
+    async def pollDevice(self, address: str) -> None:
+        client = self.clients[address]
+        stats = self.stats[address]
+        stats.polls += 1
+        start = time.perf_counter()
+        try:
+            response = await client.send_command(address, ErciCmd.STATE_QUERY)
+            latency = time.perf_counter() - start
+            self.pollLatency.observe(latency)
+            sample = DeviceSample(time.time(), latency, response)
+            if self.queryDescription:
+                response = await client.send_command(address, ErciCmd.DIAGNOSTIC_DESCRIPTION_QUERY)
+                sample.description = response["diagnostic_description"].rstrip("\0")
+            stats.sample = sample
+            stats.up = True
+        except TimeoutError:
+            self.pollLatency.observe(time.perf_counter() - start)
+            stats.timeouts += 1
+            stats.up = False
+        except (ErciException, ValueError) as e:
+            logger.warning("Polling {} failed: {}", address, e)
+            stats.errors += 1
+            stats.up = False
+
+    async def pollOnce(self) -> None:
+        start = time.perf_counter()
+        await asyncio.gather(*(self.pollDevice(address) for address in self.clients))
+        self.cycleDuration = time.perf_counter() - start
+        self.cycles += 1
+
+    async def run(self) -> None:
+        while True:
+            start = time.monotonic()
+            await self.pollOnce()
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def renderMetrics(self) -> str:
+        lines = []
+
+        def family(name: str, mtype: str, help: str) -> None:
+            lines.append(f"# TYPE {name} {mtype}")
+            lines.append(f"# HELP {name} {help}")
+
+        family("r3erci_device_up", "gauge", "Whether the last poll of the device succeeded.")
+        for address, stats in self.stats.items():
+            lines.append(f"r3erci_device_up{_labels(device=address)} {int(stats.up)}")
+
+        samples = [(a, s.sample) for a, s in self.stats.items() if s.sample is not None]
+
+        family("r3erci_device_state", "stateset", "ERCI state of the device.")
+        for address, sample in samples:
+            for state in ErciState:
+                value = int(sample.state == state)
+                lines.append(
+                    f"r3erci_device_state{_labels(device=address, r3erci_device_state=str(state))} {value}"
+                )
+
+        for field in ("config_id", "ring_id", "antenna_id"):
+            family(f"r3erci_device_{field}", "gauge", f"Last reported {field} of the device.")
+            for address, sample in samples:
+                lines.append(f"r3erci_device_{field}{_labels(device=address)} {getattr(sample, field)}")
+
+        family(
+            "r3erci_device_last_poll_timestamp_seconds",
+            "gauge",
+            "Time of the last successful poll of the device.",
+        )
+        for address, sample in samples:
+            lines.append(
+                f"r3erci_device_last_poll_timestamp_seconds{_labels(device=address)} {sample.timestamp}"
+            )
+
+        if self.queryDescription:
+            family("r3erci_device_diagnostic", "info", "Diagnostic description of the device.")
+            for address, sample in samples:
+                if sample.description is not None:
+                    lines.append(
+                        f"r3erci_device_diagnostic_info{_labels(device=address, description=sample.description)} 1"
+                    )
+
+        family("r3erci_exporter_polls", "counter", "Polls started per device.")
+        for address, stats in self.stats.items():
+            lines.append(f"r3erci_exporter_polls_total{_labels(device=address)} {stats.polls}")
+
+        family("r3erci_exporter_poll_timeouts", "counter", "Polls without response per device.")
+        for address, stats in self.stats.items():
+            lines.append(f"r3erci_exporter_poll_timeouts_total{_labels(device=address)} {stats.timeouts}")
+
+        family("r3erci_exporter_poll_errors", "counter", "Polls with invalid responses per device.")
+        for address, stats in self.stats.items():
+            lines.append(f"r3erci_exporter_poll_errors_total{_labels(device=address)} {stats.errors}")
+
+        family("r3erci_exporter_poll_latency_seconds", "histogram", "STATE_QUERY round trip time.")
+        lines.extend(self.pollLatency.render("r3erci_exporter_poll_latency_seconds"))
+
+        family("r3erci_exporter_cycle_duration_seconds", "gauge", "Duration of the last poll cycle.")
+        lines.append(f"r3erci_exporter_cycle_duration_seconds {self.cycleDuration}")
+
+        family("r3erci_exporter_cycles", "counter", "Completed poll cycles.")
+        lines.append(f"r3erci_exporter_cycles_total {self.cycles}")
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    async def _readRequest(reader: asyncio.StreamReader) -> bytes:
+        request = await reader.readline()
+        # Drain the request headers
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        return request
+
+    async def _handleHttp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                request = await asyncio.wait_for(self._readRequest(reader), HTTP_REQUEST_TIMEOUT)
+            except (asyncio.TimeoutError, ValueError):
+                # Too slow or a line longer than MAX_REQUEST_LINE
+                return
+            parts = request.decode("latin-1").split()
+            if not parts:
+                # Connected and closed without a request, e.g. a TCP health check
+                return
+            if len(parts) >= 2 and parts[0] in ("GET", "HEAD") and parts[1].split("?")[0] == "/metrics":
+                body = self.renderMetrics().encode()
+                status = "200 OK"
+                contentType = CONTENT_TYPE
+            else:
+                body = b"Not Found\n"
+                status = "404 Not Found"
+                contentType = "text/plain; charset=utf-8"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {contentType}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            )
+            if parts[0] != "HEAD":
+                writer.write(body)
+            await writer.drain()
+        except (ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def startHttp(self, host: str = "127.0.0.1", port: int = METRICS_PORT) -> Tuple[str, int]:
+        self.httpServer = await asyncio.start_server(self._handleHttp, host, port, limit=MAX_REQUEST_LINE)
+        return self.httpServer.sockets[0].getsockname()[:2]
+
+    async def serve(self, host: str = "127.0.0.1", port: int = METRICS_PORT) -> None:
+        bound = await self.startHttp(host, port)
+        ts_print(f"Serving metrics of {len(self.clients)} devices on http://{bound[0]}:{bound[1]}/metrics")
+        try:
+            await self.run()
+        finally:
+            self.httpServer.close()
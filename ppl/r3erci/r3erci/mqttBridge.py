@@ -0,0 +1,402 @@
+import asyncio
+import json
+import signal
+import threading
+import time
+from ipaddress import ip_address
+from typing import Any, Dict, List, Optional, Tuple
+
+from jsonschema import validate
+from jsonschema.exceptions import ValidationError
+
+from r3erci.exceptions import ErciException
+from r3erci.session import ERCI_ARGUMENTS, ERCI_COMMANDS, ErciService, plainResult
+from r3erci.util import StyleAdapter, getLogger
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:  # optional, see the mqtt extra
+    mqtt = None
+
+"""
+MQTT to ERCI bridge
+
+    Subscribes to the topics of the config file and sends the mapped ERCI command to the
+    devices of the topic, in-process over one shared socket. Every device is acknowledged
+    on the ack topic:
+
+    {"topic": "/echoringfeedback", "payload": "echoOn", "address": "192.168.100.32", "command": "ring",
+     "ok": true, "code": "SUCCESS", "result": {...}, "latency_ms": 1.7}
+    {..., "ok": false, "code": null, "error": "TimeoutError", "message": "...", "latency_ms": 3001.2}
+
+    ok tells whether the device answered, code is the result code of its answer (null for
+    queries without one, e.g. state).
+
+    {
+      "broker": {"host": "10.0.3.5", "port": 1337},
+      "ack_topic": "/ack",
+      "routes": [
+        {
+          "topic": "/echoringfeedback",
+          "devices": ["192.168.100.32", "192.168.100.33"],
+          "payloads": {
+            "echoOn": {"command": "ring", "args": {"ring_id": 2, "antenna_id": 1}},
+            "echoOff": {"command": "ring", "args": {"ring_id": 1, "antenna_id": 1}}
+          }
+        },
+        {"topic": "erci/command"}
+      ]
+    }
+
+    Routes without payloads take JSON requests as sent to the session daemon
+    ({"id", "command", "address", "args"}), the address defaults to the devices of the route.
+    Topics may contain the wildcards + and #. The broker is spoken to with MQTT 5 unless
+    "protocol": 3 selects MQTT 3.1.1.
+"""
+
+logger = StyleAdapter(getLogger(__name__))
+
+DEFAULT_ACK_TOPIC = "/ack"
+
+# Messages being executed, further messages are dropped
+MAX_PENDING_MESSAGES = 1024
+
+# Reconnect delay in seconds, doubled on every failed attempt
+RECONNECT_DELAY_MIN = 1.0
+RECONNECT_DELAY_MAX = 30.0
+
+ACTION_SCHEMA = {
+    "type": "object",
+    "required": ["command"],
+    "properties": {
+        "command": {"enum": sorted(ERCI_COMMANDS)},
+        "args": {
+            "type": "object",
+            "propertyNames": {"enum": sorted(ERCI_ARGUMENTS)},
+            "additionalProperties": {"type": ["integer", "string"]},
+        },
+    },
+    "additionalProperties": False,
+}
+
+CONFIG_SCHEMA = {
+    "type": "object",
+    "required": ["broker", "routes"],
+    "properties": {
+        "broker": {
+            "type": "object",
+            "required": ["host"],
+            "properties": {
+                "host": {"type": "string"},
+                "port": {"type": "integer"},
+                "keepalive": {"type": "integer", "minimum": 1},
+                "client_id": {"type": "string"},
+                "username": {"type": "string"},
+                "password": {"type": "string"},
+                "protocol": {"enum": [3, 5]},
+            },
+            "additionalProperties": False,
+        },
+        "ack_topic": {"type": "string", "minLength": 1},
+        "qos": {"enum": [0, 1, 2]},
+        "routes": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["topic"],
+                "properties": {
+                    "topic": {"type": "string", "minLength": 1},
+                    "devices": {"type": "array", "items": {"type": "string"}},
+                    "payloads": {"type": "object", "additionalProperties": ACTION_SCHEMA},
+                    "ack_topic": {"type": "string", "minLength": 1},
+                },
+                "additionalProperties": False,
+            },
+        },
+    },
+    "additionalProperties": False,
+}
+
+# address, command, args, request id
+BridgeRequestType = Tuple[str, str, Dict[str, Any], Any]
+
+
+class BridgeError(ErciException):
+    pass
+
+
+def loadConfig(path: str) -> Dict[str, Any]:
+    try:
+        with open(path) as f:
+            config = json.load(f)
+        validate(config, CONFIG_SCHEMA)
+        for route in config["routes"]:
+            route["devices"] = [str(ip_address(address)) for address in route.get("devices", ())]
+            if "payloads" in route and not route["devices"]:
+                raise BridgeError(f"Route {route['topic']} maps payloads but has no devices")
+    except ValidationError as e:
+        raise BridgeError(f"Invalid config {path}: {e.message}")
+    except (OSError, ValueError) as e:
+        raise BridgeError(f"Invalid config {path}: {e}")
+    return config
+
+
+def resultCode(result: Dict[str, Any]) -> Optional[str]:
+    code = result.get("code", result.get("status"))
+    return None if code is None else plainResult(code)
+
+
+class Route:
+    __slots__ = ("topic", "devices", "payloads", "ackTopic")
+
+    def __init__(self, config: Dict[str, Any], ackTopic: str):
+        self.topic = config["topic"]
+        self.devices = tuple(config.get("devices", ()))
+        self.payloads = config.get("payloads")  # type: Optional[Dict[str, Dict[str, Any]]]
+        self.ackTopic = config.get("ack_topic", ackTopic)
+
+    @property
+    def wildcard(self) -> bool:
+        return "+" in self.topic or "#" in self.topic
+
+    def requests(self, payload: bytes) -> List[BridgeRequestType]:
+        if self.payloads is not None:
+            text = payload.decode(errors="replace")
+            action = self.payloads.get(text)
+            if action is None:
+                raise BridgeError(f"Unexpected payload {text!r}, expected {', '.join(self.payloads)}")
+            return [(address, action["command"], action.get("args", {}), None) for address in self.devices]
+
+        request = json.loads(payload)
+        if not isinstance(request, dict):
+            raise BridgeError("Request must be a JSON object")
+        command = request.get("command")
+        if command not in ERCI_COMMANDS:
+            raise BridgeError(f"Unknown command {command!r}")
+        args = request.get("args") or {}
+        address = request.get("address")
+        devices = (str(ip_address(address)),) if address is not None else self.devices
+        if not devices:
+            raise BridgeError("Request needs an address")
+        return [(device, command, args, request.get("id")) for device in devices]
+
+
+class MqttBridge:
+    """
+    Executes the ERCI commands mapped to MQTT messages, see the module description. The paho
+    client runs on the asyncio loop (its socket is watched by the loop instead of a network
+    thread), so commands of many messages and devices are in flight at once. Only the TCP
+    connect is done in an executor, the socket callbacks it triggers are handed to the loop. Commands to the
+    same device are queued by priority and then in the order of their messages (see ErciClient).
+    """
+
+    def __init__(self, service: ErciService, config: Dict[str, Any], maxPending: int = MAX_PENDING_MESSAGES):
+        if mqtt is None:
+            raise BridgeError("The MQTT bridge requires the paho-mqtt package (pip install paho-mqtt)")
+        self.service = service
+        self.broker = config["broker"]
+        self.qos = config.get("qos", 0)
+        self.routes = [Route(route, config.get("ack_topic", DEFAULT_ACK_TOPIC)) for route in config["routes"]]
+        self.exactRoutes = {}  # type: Dict[str, List[Route]]
+        for route in self.routes:
+            if not route.wildcard:
+                self.exactRoutes.setdefault(route.topic, []).append(route)
+        self.wildcardRoutes = [route for route in self.routes if route.wildcard]
+        self.maxPending = maxPending
+        self.pending = set()
+        self.messages = 0
+        self.commands = 0
+        self.failures = 0
+        self.droppedMessages = 0
+        self.client = None
+        self.loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self.loopThread = None  # type: Optional[int]
+        self.miscTask = None  # type: Optional[asyncio.Task]
+        self.disconnected = None  # type: Optional[asyncio.Event]
+        self.stopped = None  # type: Optional[asyncio.Event]
+
+    def _createClient(self):
+        protocol = mqtt.MQTTv311 if self.broker.get("protocol", 5) == 3 else mqtt.MQTTv5
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            client = mqtt.Client(
+                mqtt.CallbackAPIVersion.VERSION2, client_id=self.broker.get("client_id", ""), protocol=protocol
+            )
+        else:
+            client = mqtt.Client(client_id=self.broker.get("client_id", ""), protocol=protocol)
+        if "username" in self.broker:
+            client.username_pw_set(self.broker["username"], self.broker.get("password"))
+        client.on_connect = self.onConnect
+        client.on_disconnect = self.onDisconnect
+        client.on_message = self.onMessage
+        client.on_socket_open = self.onSocketOpen
+        client.on_socket_close = self.onSocketClose
+        client.on_socket_register_write = self.onSocketRegisterWrite
+        client.on_socket_unregister_write = self.onSocketUnregisterWrite
+        return client
+
+    async def run(self) -> None:
+        """
+        Connects to the broker and serves the routes until stop() or SIGTERM, reconnects if
+        the connection is lost.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.loopThread = threading.get_ident()
+        self.client = self._createClient()
+        self.stopped = asyncio.Event()
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, self.stop)
+        except (NotImplementedError, RuntimeError):
+            pass
+        host, port = self.broker["host"], self.broker.get("port", 1883)
+        delay = RECONNECT_DELAY_MIN
+        try:
+            while not self.stopped.is_set():
+                self.disconnected = asyncio.Event()
+                try:
+                    # Blocks until the TCP connection is established, the MQTT handshake runs on the loop
+                    await self.loop.run_in_executor(
+                        None, self.client.connect, host, port, self.broker.get("keepalive", 60)
+                    )
+                except OSError as e:
+                    logger.warning("Connecting to {}:{} failed: {}, retrying in {}s", host, port, e, delay)
+                    await self._pause(delay)
+                    delay = min(delay * 2, RECONNECT_DELAY_MAX)
+                    continue
+                delay = RECONNECT_DELAY_MIN
+                await self.disconnected.wait()
+                if not self.stopped.is_set():
+                    logger.warning("Connection to {}:{} lost, reconnecting", host, port)
+                    await self._pause(RECONNECT_DELAY_MIN)
+        finally:
+            self.loop.remove_signal_handler(signal.SIGTERM)
+            for task in self.pending:
+                task.cancel()
+
+    async def _pause(self, delay: float) -> None:
+        try:
+            await asyncio.wait_for(self.stopped.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def stop(self) -> None:
+        if self.stopped is not None:
+            self.stopped.set()
+        if self.client is not None and self.client.is_connected():
+            self.client.disconnect()
+        if self.disconnected is not None:
+            self.disconnected.set()
+
+    def matchRoutes(self, topic: str) -> List[Route]:
+        routes = self.exactRoutes.get(topic, [])
+        if self.wildcardRoutes:
+            routes = routes + [route for route in self.wildcardRoutes if mqtt.topic_matches_sub(route.topic, topic)]
+        return routes
+
+    def onConnect(self, client, userdata, flags, reasonCode, *properties) -> None:
+        if reasonCode != 0:
+            logger.error("Broker refused the connection: {}", reasonCode)
+            return
+        topics = {route.topic for route in self.routes}
+        client.subscribe([(topic, self.qos) for topic in sorted(topics)])
+        logger.info("Connected to {}, subscribed to {}", self.broker["host"], ", ".join(sorted(topics)))
+
+    def onDisconnect(self, client, userdata, *args) -> None:
+        if self.disconnected is not None:
+            self.disconnected.set()
+
+    def onMessage(self, client, userdata, message) -> None:
+        self.messages += 1
+        if len(self.pending) >= self.maxPending:
+            self.droppedMessages += 1
+            logger.warning("Too many pending messages, dropped message on {}", message.topic)
+            return
+        task = self.loop.create_task(self.handleMessage(message.topic, message.payload))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    def _onLoop(self, callback, *args) -> None:
+        # The socket callbacks of connect() are called from the executor thread
+        if threading.get_ident() == self.loopThread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def onSocketOpen(self, client, userdata, sock) -> None:
+        self._onLoop(self._watchSocket, client, sock)
+
+    def _watchSocket(self, client, sock) -> None:
+        self.loop.add_reader(sock, client.loop_read)
+        self.miscTask = self.loop.create_task(self._miscLoop())
+
+    def onSocketClose(self, client, userdata, sock) -> None:
+        self._onLoop(self._unwatchSocket, sock)
+
+    def _unwatchSocket(self, sock) -> None:
+        self.loop.remove_reader(sock)
+        if self.miscTask is not None:
+            self.miscTask.cancel()
+            self.miscTask = None
+
+    def onSocketRegisterWrite(self, client, userdata, sock) -> None:
+        self._onLoop(self.loop.add_writer, sock, client.loop_write)
+
+    def onSocketUnregisterWrite(self, client, userdata, sock) -> None:
+        self._onLoop(self.loop.remove_writer, sock)
+
+    async def _miscLoop(self) -> None:
+        # Keepalive pings and retries, the network thread of paho would do this otherwise
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    async def handleMessage(self, topic: str, payload: bytes) -> None:
+        jobs = []
+        for route in self.matchRoutes(topic):
+            try:
+                requests = route.requests(payload)
+            except (BridgeError, ValueError) as e:
+                self.failures += 1
+                self.publishAck(
+                    route.ackTopic,
+                    {
+                        "topic": topic,
+                        "payload": payload.decode(errors="replace"),
+                        "address": None,
+                        "command": None,
+                        "ok": False,
+                        "code": None,
+                        "error": type(e).__name__,
+                        "message": str(e),
+                        "latency_ms": 0.0,
+                    },
+                )
+                continue
+            jobs.extend(self.execute(route, topic, payload, *request) for request in requests)
+        if jobs:
+            await asyncio.gather(*jobs)
+
+    async def execute(
+        self, route: Route, topic: str, payload: bytes, address: str, command: str, args: Dict[str, Any], requestId: Any
+    ) -> None:
+        start = time.perf_counter()
+        ack = {"topic": topic, "payload": payload.decode(errors="replace"), "address": address, "command": command}
+        if requestId is not None:
+            ack["id"] = requestId
+        self.commands += 1
+        try:
+            result = await self.service.sendCommand(address, ERCI_COMMANDS[command], args)
+            ack.update(ok=True, code=resultCode(result), result=plainResult(result))
+        except (ErciException, ValueError, AssertionError, OSError) as e:
+            self.failures += 1
+            ack.update(ok=False, code=None, error=type(e).__name__, message=str(e))
+        except Exception as e:
+            self.failures += 1
+            logger.exception("Command {} to {} failed", command, address)
+            ack.update(ok=False, code=None, error=type(e).__name__, message=str(e))
+        ack["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        self.publishAck(route.ackTopic, ack)
+
+    def publishAck(self, topic: str, ack: Dict[str, Any]) -> None:
+        info = self.client.publish(topic, json.dumps(ack), qos=self.qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.warning("ACK for {} on {} not sent: {}", ack["address"], topic, mqtt.error_string(info.rc))
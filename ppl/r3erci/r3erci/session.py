@@ -0,0 +1,380 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import tempfile
+import time
+from enum import Enum
+from ipaddress import ip_address
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from r3erci.client import ErciClient
+from r3erci.constants import PORT, ErciCmd
+from r3erci.exceptions import ErciException
+from r3erci.standaloneServer import StandaloneServer
+from r3erci.udpServer import UdpServer
+from r3erci.util import StyleAdapter, getLogger
+
+"""
+Long-lived session daemon
+
+    The daemon keeps the UDP socket and its clients open and accepts commands from thin
+    clients over a Unix socket, one JSON object per line:
+
+    -> {"id": 1, "command": "ring", "address": "192.168.100.32", "args": {"ring_id": 2, "antenna_id": 1}}
+    <- {"id": 1, "ok": true, "result": {...}, "latency_ms": 1.7}
+    <- {"id": 1, "ok": false, "error": "TimeoutError", "message": "...", "latency_ms": 3001.2}
+
+    A connection may send further requests before the previous ones are answered, responses
+    carry the id of their request. Requests to the same device are executed one after another
+    (for ERCI by the CommandQueue of the device in the shared ErciClient).
+    The command "ping" lists the available commands.
+"""
+
+logger = StyleAdapter(getLogger(__name__))
+
+# Upper bound of one request line
+MAX_REQUEST_SIZE = 64 * 1024
+
+CommandHandlerType = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class SessionError(ErciException):
+    pass
+
+
+def defaultSocketPath(name: str = "r3erci") -> str:
+    runtimeDir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(runtimeDir, f"{name}-{os.getuid()}.sock")
+
+
+def plainResult(value: Any) -> Any:
+    """
+    Converts a command result for JSON, enums by name (IntEnums would be numbers otherwise),
+    bytes as hex and anything else unknown as string.
+    """
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, dict):
+        return {str(k): plainResult(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plainResult(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+
+def encodeLine(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message).encode() + b"\n"
+
+
+class SessionServer:
+    """
+    Serves the registered command handlers on a Unix socket, see the module description
+    for the protocol. Handlers get the request and return a JSON serializable result.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else defaultSocketPath()
+        self.handlers = {}  # type: Dict[str, CommandHandlerType]
+        self.server = None  # type: Optional[asyncio.AbstractServer]
+        self.started = time.time()
+        self.requests = 0
+        self.failures = 0
+        # Errors reported to the client without logging a traceback
+        self.expectedErrors = (ErciException, ValueError, TypeError, AssertionError, OSError)  # type: Tuple[type, ...]
+
+    def register(self, handlers: Dict[str, CommandHandlerType], errors: Tuple[type, ...] = ()) -> None:
+        """
+        :param handlers: Handler per command name
+        :param errors: Exceptions of the handlers which are part of normal operation
+        """
+        for command in handlers:
+            if command in self.handlers:
+                raise ValueError(f"Command {command} is already registered")
+        self.handlers.update(handlers)
+        self.expectedErrors += tuple(errors)
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            # Left over by a daemon which was killed, refuse to replace a running one
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise SessionError(f"Another session daemon is listening on {self.path}")
+            finally:
+                probe.close()
+        self.server = await asyncio.start_unix_server(
+            self.handleConnection, path=self.path, limit=MAX_REQUEST_SIZE
+        )
+        os.chmod(self.path, 0o600)
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    async def serve(self) -> None:
+        if self.server is None:
+            await self.start()
+        logger.info("Session daemon listening on {}", self.path)
+        # Stop cleanly on SIGTERM (e.g. from systemd) so the socket file is removed
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+        try:
+            await stop.wait()
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+            self.close()
+
+    async def handleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        pending = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(encodeLine({"id": None, "ok": False, "error": "SessionError", "message": "Request too long"}))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.ensure_future(self.answer(line, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for task in pending:
+                task.cancel()
+            writer.close()
+
+    async def answer(self, line: bytes, writer: asyncio.StreamWriter) -> None:
+        response = await self.execute(line)
+        if not writer.is_closing():
+            writer.write(encodeLine(response))
+            await writer.drain()
+
+    async def execute(self, line: bytes) -> Dict[str, Any]:
+        start = time.perf_counter()
+        requestId = None
+        self.requests += 1
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                raise SessionError(f"Invalid JSON: {e}")
+            if not isinstance(request, dict):
+                raise SessionError("Request must be a JSON object")
+            requestId = request.get("id")
+            command = request.get("command")
+            if command == "ping":
+                result = {"uptime": round(time.time() - self.started, 3), "commands": sorted(self.handlers)}
+            elif command in self.handlers:
+                result = await self.handlers[command](request)
+            else:
+                raise SessionError(f"Unknown command {command!r}")
+            response = {"id": requestId, "ok": True, "result": plainResult(result)}
+        except self.expectedErrors as e:
+            self.failures += 1
+            response = {"id": requestId, "ok": False, "error": type(e).__name__, "message": str(e)}
+        except Exception as e:
+            self.failures += 1
+            logger.exception("Request {} failed", requestId)
+            response = {"id": requestId, "ok": False, "error": type(e).__name__, "message": str(e)}
+        response["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return response
+
+
+# Request commands and the ERCI command they send
+ERCI_COMMANDS = {
+    "config": ErciCmd.SELECT_CONFIG,
+    "ring": ErciCmd.SWITCH_RING,
+    "start": ErciCmd.START,
+    "stop": ErciCmd.STOP,
+    "state": ErciCmd.STATE_QUERY,
+    "diagdesc": ErciCmd.DIAGNOSTIC_DESCRIPTION_QUERY,
+    "antenna": ErciCmd.SWITCH_ANTENNA,
+    "configmode": ErciCmd.SET_CONFIGMODE,
+    "passportquery": ErciCmd.PASSPORT_QUERY,
+    "reboot": ErciCmd.REBOOT,
+    "csi": ErciCmd.GET_CSI_QUERY,
+}
+
+ERCI_ARGUMENTS = frozenset(
+    ("config_id", "ring_id", "antenna_id", "configmode_flag", "mac_address", "serial_number")
+)
+
+# Arguments the commands can't be sent without
+ERCI_REQUIRED_ARGUMENTS = {
+    ErciCmd.SELECT_CONFIG: ("config_id", "ring_id", "antenna_id"),
+    ErciCmd.SWITCH_RING: ("ring_id", "antenna_id"),
+    ErciCmd.SWITCH_ANTENNA: ("antenna_id",),
+    ErciCmd.SET_CONFIGMODE: ("configmode_flag",),
+    ErciCmd.PASSPORT_QUERY: ("mac_address", "serial_number"),
+}
+
+
+def requestAddress(request: Dict[str, Any]) -> str:
+    address = request.get("address")
+    if not isinstance(address, str):
+        raise SessionError("Request needs an address")
+    return str(ip_address(address))
+
+
+class ErciService:
+    """
+    ERCI commands of the session daemon. All devices share one ErciClient and its socket,
+    the client queues the commands of each device (see CommandQueue), so no locking is needed
+    here.
+    """
+
+    def __init__(self, udpServer: UdpServer, timeout: float = 3):
+        self.udpServer = udpServer
+        self.client = ErciClient(timeout=timeout, disablePrints=True, udpServer=udpServer)
+
+    @classmethod
+    async def create(
+        cls,
+        ownaddress: str = "0.0.0.0",
+        ownport: int = PORT,
+        timeout: float = 3,
+        standalone: bool = False,
+    ) -> "ErciService":
+        if standalone:
+            udpServer = await StandaloneServer.create()
+        else:
+            udpServer = await UdpServer.create(ownaddress, ownport, batched=True)
+        return cls(udpServer, timeout)
+
+    def handlers(self) -> Dict[str, CommandHandlerType]:
+        return {name: self._handler(command) for name, command in ERCI_COMMANDS.items()}
+
+    def _handler(self, command: ErciCmd) -> CommandHandlerType:
+        async def handle(request: Dict[str, Any]) -> Any:
+            return await self.sendCommand(requestAddress(request), command, request.get("args") or {})
+
+        return handle
+
+    async def sendCommand(self, address: str, command: ErciCmd, args: Dict[str, Any]) -> dict:
+        unknown = set(args) - ERCI_ARGUMENTS
+        if unknown:
+            raise SessionError(f"Unknown arguments {', '.join(sorted(unknown))}")
+        missing = [name for name in ERCI_REQUIRED_ARGUMENTS.get(command, ()) if args.get(name) is None]
+        if missing:
+            raise SessionError(f"Missing arguments for {command.name}: {', '.join(missing)}")
+        return await self.client.send_command(address, command, **args)
+
+    def close(self) -> None:
+        self.udpServer.close()
+
+
+class SessionClient:
+    """
+    Thin asyncio client of the session daemon.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else defaultSocketPath()
+        self.reader = None  # type: Optional[asyncio.StreamReader]
+        self.writer = None  # type: Optional[asyncio.StreamWriter]
+        self.nextId = 0
+        self.responses = {}  # type: Dict[int, asyncio.Future]
+        self.readTask = None  # type: Optional[asyncio.Future]
+
+    async def connect(self) -> "SessionClient":
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path, limit=MAX_REQUEST_SIZE)
+        self.readTask = asyncio.ensure_future(self._readResponses())
+        return self
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.readTask is not None:
+            self.readTask.cancel()
+            self.readTask = None
+
+    async def __aenter__(self) -> "SessionClient":
+        return await self.connect()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def _readResponses(self) -> None:
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.responses.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self.responses.values():
+                if not future.done():
+                    future.set_exception(SessionError("Connection to the session daemon closed"))
+            self.responses.clear()
+
+    async def call(self, command: str, address: Optional[str] = None, **args) -> Dict[str, Any]:
+        """
+        :returns: The response, check its "ok" member
+        """
+        self.nextId += 1
+        request = {"id": self.nextId, "command": command}  # type: Dict[str, Any]
+        if address is not None:
+            request["address"] = address
+        if args:
+            request["args"] = args
+        future = asyncio.get_running_loop().create_future()
+        self.responses[self.nextId] = future
+        self.writer.write(encodeLine(request))
+        await self.writer.drain()
+        return await future
+
+
+def request(
+    command: str,
+    address: Optional[str] = None,
+    path: Optional[str] = None,
+    timeout: Optional[float] = 30.0,
+    **args,
+) -> Dict[str, Any]:
+    """
+    Blocking single request to the session daemon, e.g. from callbacks of other libraries.
+
+    :returns: The response, check its "ok" member
+    """
+    message = {"id": 0, "command": command}  # type: Dict[str, Any]
+    if address is not None:
+        message["address"] = address
+    if args:
+        message["args"] = args
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path if path is not None else defaultSocketPath())
+        sock.sendall(encodeLine(message))
+        with sock.makefile("rb") as lines:
+            line = lines.readline(MAX_REQUEST_SIZE)
+    if not line:
+        raise SessionError("Session daemon closed the connection")
+    return json.loads(line)
@@ -0,0 +1,465 @@
+import asyncio
+import random
+import socket
+from ipaddress import IPv4Address, ip_address
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from r3erci.constants import (
+    PORT,
+    PROTOCOL_VERSION,
+    RESERVED_VALUE,
+    MAC_ADDRESS_LENGTH,
+    SERIAL_NUMBER_LENGTH,
+    ErciCmd,
+    ErciInvalid,
+    ErciPosHeader,
+    ErciPosPassportQuery,
+    ErciPosSelectConfig,
+    ErciPosSetConfigMode,
+    ErciPosSwitchAntenna,
+    ErciPosSwitchRing,
+    ErciResultCode,
+    ErciState,
+    GetPacketLength,
+)
+from r3erci.constants import PacketLengthType as PLT
+from r3erci.util import runMain, ts_print
+
+# Large enough for every ERCI frame (GET_CSI_RESPONSE is the largest with 805B)
+MAX_DATAGRAM_SIZE = 2048
+
+# First address handed out to virtual EREBs, device n gets FLEET_BASE_ADDRESS + n
+FLEET_BASE_ADDRESS = IPv4Address("127.1.0.1")
+
+_validCommands = frozenset(int(c) for c in ErciCmd)
+
+
+def createHeader(command: ErciCmd, sequence: int) -> bytearray:
+    return bytearray((RESERVED_VALUE, PROTOCOL_VERSION, int(command), sequence))
+
+
+def createCommandResult(sequence: int, code: ErciResultCode, status_msg: str) -> bytes:
+    data = createHeader(ErciCmd.COMMAND_RESULT, sequence)
+    data.append(code)
+    data += status_msg.encode()
+    data.append(0)
+    return bytes(data)
+
+
+class VirtualEreb:
+    """
+    State machine of a single EREB as seen through ERCI.
+    Follows the same transitions as r3erci.cli.run_simulate_ereb.SimulateEreb.
+    """
+
+    __slots__ = ("state", "config_id", "ring_id", "antenna_id", "configmode_flag")
+
+    def __init__(self):
+        self.state = ErciState.READY
+        self.config_id = ErciInvalid.CONFIG
+        self.ring_id = ErciInvalid.RING
+        self.antenna_id = ErciInvalid.ANTENNA
+        self.configmode_flag = 0
+
+    def _wrongState(self, seq: int) -> bytes:
+        return createCommandResult(
+            seq, ErciResultCode.WRONG_STATE, f"Not allowed in state {str(self.state)}"
+        )
+
+    def handle(self, data: bytes) -> Optional[bytes]:
+        """
+        Process one request frame.
+
+        :returns:   The response frame, None if the EREB would not answer
+        """
+        le, _ = GetPacketLength(None)
+        if len(data) < le:
+            return None
+        if data[ErciPosHeader.RESERVED] != RESERVED_VALUE:
+            return None
+        if data[ErciPosHeader.PROTOCOL_VERSION] != PROTOCOL_VERSION:
+            return None
+
+        cmd = data[ErciPosHeader.COMMAND]
+        seq = data[ErciPosHeader.SEQUENCE]
+        if cmd not in _validCommands or cmd == ErciCmd.INVALID:
+            return None
+
+        le, plt = GetPacketLength(ErciCmd(cmd))
+        if plt == PLT.MINIMUM:
+            if len(data) < le:
+                return None
+        elif plt == PLT.EXACT:
+            if len(data) != le:
+                return None
+        elif plt == PLT.MAXIMUM:
+            if len(data) > le:
+                return None
+        else:
+            return None
+
+        if cmd == ErciCmd.STATE_QUERY:
+            return bytes(
+                (
+                    RESERVED_VALUE,
+                    PROTOCOL_VERSION,
+                    ErciCmd.STATE_RESPONSE,
+                    seq,
+                    self.state,
+                    self.config_id,
+                    self.ring_id,
+                    self.antenna_id,
+                )
+            )
+
+        elif cmd == ErciCmd.SELECT_CONFIG:
+            if self.state != ErciState.READY and self.state != ErciState.CONFIGURED:
+                return self._wrongState(seq)
+            self.state = ErciState.CONFIGURED
+            self.config_id = data[ErciPosSelectConfig.CONFIG_ID]
+            self.ring_id = data[ErciPosSelectConfig.RING_ID]
+            self.antenna_id = data[ErciPosSelectConfig.ANTENNA_ID]
+            return createCommandResult(
+                seq,
+                ErciResultCode.SUCCESS,
+                f"Selected config {self.config_id} ring {self.ring_id} antenna {self.antenna_id}",
+            )
+
+        elif cmd == ErciCmd.SWITCH_RING:
+            if self.state != ErciState.RUNNING:
+                return self._wrongState(seq)
+            self.ring_id = data[ErciPosSwitchRing.RING_ID]
+            self.antenna_id = data[ErciPosSwitchRing.ANTENNA_ID]
+            return createCommandResult(
+                seq,
+                ErciResultCode.SUCCESS,
+                f"Switched to ring {self.ring_id} antenna {self.antenna_id}",
+            )
+
+        elif cmd == ErciCmd.START:
+            if self.state != ErciState.CONFIGURED:
+                return self._wrongState(seq)
+            self.state = ErciState.RUNNING
+            return createCommandResult(seq, ErciResultCode.SUCCESS, "Started ring.")
+
+        elif cmd == ErciCmd.STOP:
+            if self.state != ErciState.RUNNING:
+                return self._wrongState(seq)
+            self.state = ErciState.READY
+            self.config_id = ErciInvalid.CONFIG
+            self.ring_id = ErciInvalid.RING
+            self.antenna_id = ErciInvalid.ANTENNA
+            return createCommandResult(seq, ErciResultCode.SUCCESS, "Stopped ring.")
+
+        elif cmd == ErciCmd.DIAGNOSTIC_DESCRIPTION_QUERY:
+            response = createHeader(ErciCmd.DIAGNOSTIC_DESCRIPTION_RESPONSE, seq)
+            response += (
+                f"Config ID: {self.config_id} Ring ID: {self.ring_id} Antenna ID: {self.antenna_id}"
+                f" Configmode Flag: {self.configmode_flag}"
+            ).encode()
+            response.append(0)
+            return bytes(response)
+
+        elif cmd == ErciCmd.SWITCH_ANTENNA:
+            if self.state != ErciState.RUNNING:
+                return self._wrongState(seq)
+            self.antenna_id = data[ErciPosSwitchAntenna.ANTENNA_ID]
+            return createCommandResult(
+                seq, ErciResultCode.SUCCESS, f"Switched to antenna {self.antenna_id}"
+            )
+
+        elif cmd == ErciCmd.SET_CONFIGMODE:
+            self.configmode_flag = data[ErciPosSetConfigMode.CONFIG_MODE_FLAG]
+            return createCommandResult(
+                seq,
+                ErciResultCode.SUCCESS,
+                f"Switched configmode flag to {self.configmode_flag}",
+            )
+
+        elif cmd == ErciCmd.PASSPORT_QUERY:
+            pos_mac = ErciPosPassportQuery.MAC_ADDRESS
+            pos_serial = ErciPosPassportQuery.SERIAL_NUMBER
+            response = createHeader(ErciCmd.PASSPORT_QUERY_RESPONSE, seq)
+            response.append(ErciResultCode.SUCCESS)
+            response += data[pos_mac : pos_mac + MAC_ADDRESS_LENGTH]
+            response += data[pos_serial : pos_serial + SERIAL_NUMBER_LENGTH]
+            return bytes(response)
+
+        elif cmd == ErciCmd.REBOOT:
+            return createCommandResult(seq, ErciResultCode.SUCCESS, "Rebooting...")
+
+        elif cmd == ErciCmd.GET_CSI_QUERY:
+            response = createHeader(ErciCmd.GET_CSI_RESPONSE, seq)
+            response.append(ErciResultCode.SUCCESS)
+            for staId in (14, 29, 99):
+                response += staId.to_bytes(2, "big")
+            response += bytes(17 * 2 + 190 * 4)
+            return bytes(response)
+
+        return None
+
+
+class NetworkConditions:
+    """
+    Impairments applied to every response of the simulated fleet.
+
+    :param      latency:       Base delay of each response (in seconds)
+    :param      jitter:        Additional uniformly distributed delay (in seconds)
+    :param      loss:          Probability that a response is dropped
+    :param      reorder:       Probability that a response is held back by reorderDelay
+    :param      reorderDelay:  Delay of held back responses (in seconds)
+    :param      seed:          Seed for reproducible impairments
+    """
+
+    __slots__ = ("latency", "jitter", "loss", "reorder", "reorderDelay", "seed", "random")
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        reorder: float = 0.0,
+        reorderDelay: float = 0.01,
+        seed: Optional[int] = None,
+    ):
+        for name, value in (("loss", loss), ("reorder", reorder)):
+            if not 0.0 <= value <= 1.0:
+                raise ValueError(f"Argument {name} needs to be in the range 0..1!")
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.reorderDelay = reorderDelay
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    @property
+    def ideal(self) -> bool:
+        return not (self.latency or self.jitter or self.loss or self.reorder)
+
+    def delay(self) -> Optional[float]:
+        """
+        :returns:   Delay for the next response, None if it is to be dropped
+        """
+        rnd = self.random.random
+        if self.loss and rnd() < self.loss:
+            return None
+        delay = self.latency
+        if self.jitter:
+            delay += rnd() * self.jitter
+        if self.reorder and rnd() < self.reorder:
+            delay += self.reorderDelay
+        return delay
+
+
+class FleetStats:
+    __slots__ = ("received", "answered", "dropped", "invalid")
+
+    def __init__(self):
+        self.received = 0
+        self.answered = 0
+        self.dropped = 0
+        self.invalid = 0
+
+    def __repr__(self):
+        return (
+            f"received={self.received} answered={self.answered} "
+            f"dropped={self.dropped} invalid={self.invalid}"
+        )
+
+
+class VirtualErebProtocol(asyncio.DatagramProtocol):
+    __slots__ = ("ereb", "fleet", "transport")
+
+    def __init__(self, ereb: VirtualEreb, fleet: "FleetSimulator"):
+        self.ereb = ereb
+        self.fleet = fleet
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, sender):
+        fleet = self.fleet
+        stats = fleet.stats
+        stats.received += 1
+        response = self.ereb.handle(data)
+        if response is None:
+            stats.invalid += 1
+            return
+        if fleet.conditions is None:
+            self.transport.sendto(response, sender)
+            stats.answered += 1
+            return
+        delay = fleet.conditions.delay()
+        if delay is None:
+            stats.dropped += 1
+            return
+        stats.answered += 1
+        if delay > 0:
+            fleet.loop.call_later(delay, self.transport.sendto, response, sender)
+        else:
+            self.transport.sendto(response, sender)
+
+
+def fleetAddress(deviceId: int, base: IPv4Address = FLEET_BASE_ADDRESS) -> IPv4Address:
+    address = base + deviceId
+    if not address.is_loopback:
+        raise ValueError(f"Device {deviceId} does not map to a loopback address ({address})")
+    return address
+
+
+def fleetDeviceId(address: str, base: IPv4Address = FLEET_BASE_ADDRESS) -> int:
+    return int(ip_address(address)) - int(base)
+
+
+def raiseFileLimit(wanted: int) -> None:
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < wanted:
+            ts_print(f"File limit {hard} is too low for {wanted} sockets")
+
+
+class FleetSimulator:
+    """
+    Emulates many EREBs in one event loop. Every virtual EREB owns one UDP socket on
+    its own address (by default 127.1.0.1 + device id) and port PORT, so ErciClient
+    can address it like a real device.
+    Note that the client then has to use a different own port than PORT.
+    """
+
+    def __init__(
+        self,
+        addresses: Iterable[IPv4Address],
+        port: int = PORT,
+        conditions: Optional[NetworkConditions] = None,
+    ):
+        self.addresses = [ip_address(a) for a in addresses]
+        self.port = port
+        self.conditions = conditions if conditions is not None and not conditions.ideal else None
+        self.erebs = {}  # type: Dict[IPv4Address, VirtualEreb]
+        self.transports = []  # type: List[asyncio.DatagramTransport]
+        self.stats = FleetStats()
+        self.loop = None  # type: Optional[asyncio.AbstractEventLoop]
+
+    @classmethod
+    def fromCount(
+        cls,
+        count: int,
+        first: int = 0,
+        base: IPv4Address = FLEET_BASE_ADDRESS,
+        **kwargs,
+    ) -> "FleetSimulator":
+        return cls((fleetAddress(i, base) for i in range(first, first + count)), **kwargs)
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        raiseFileLimit(len(self.addresses) + 256)
+        for address in self.addresses:
+            ereb = VirtualEreb()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 16)
+            try:
+                sock.bind((str(address), self.port))
+            except OSError:
+                sock.close()
+                raise
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: VirtualErebProtocol(ereb, self), sock=sock
+            )
+            self.erebs[address] = ereb
+            self.transports.append(transport)
+
+    def close(self) -> None:
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+
+    async def serve(self, statsInterval: Optional[float] = None) -> None:
+        await self.start()
+        ts_print(
+            f"Simulating {len(self.erebs)} EREBs on {self.addresses[0]}..{self.addresses[-1]}:{self.port}"
+        )
+        try:
+            while True:
+                await asyncio.sleep(statsInterval if statsInterval else 3600)
+                if statsInterval:
+                    ts_print(f"Fleet {self.addresses[0]}: {self.stats}")
+        finally:
+            self.close()
+
+    def __getitem__(self, address) -> VirtualEreb:
+        return self.erebs[ip_address(address)]
+
+
+def _servePartition(
+    count: int,
+    first: int,
+    base: str,
+    port: int,
+    conditionArgs: Tuple,
+    statsInterval: Optional[float],
+    loop: str = "asyncio",
+) -> None:
+    conditions = NetworkConditions(*conditionArgs)
+    if conditions.seed is not None:
+        # Every partition draws its own reproducible sequence
+        conditions.random.seed(conditions.seed + first)
+    fleet = FleetSimulator.fromCount(count, first, IPv4Address(base), port=port, conditions=conditions)
+    try:
+        runMain(fleet.serve(statsInterval), loop)
+    except KeyboardInterrupt:
+        pass
+
+
+def serveFleet(
+    count: int,
+    processes: int = 1,
+    base: IPv4Address = FLEET_BASE_ADDRESS,
+    port: int = PORT,
+    conditions: Optional[NetworkConditions] = None,
+    statsInterval: Optional[float] = None,
+    loop: str = "asyncio",
+) -> None:
+    """
+    Run a fleet of count virtual EREBs, split into contiguous address ranges over
+    the given number of processes.
+    """
+    if conditions is None:
+        conditions = NetworkConditions()
+    conditionArgs = (
+        conditions.latency,
+        conditions.jitter,
+        conditions.loss,
+        conditions.reorder,
+        conditions.reorderDelay,
+        conditions.seed,
+    )
+    if processes <= 1:
+        _servePartition(count, 0, str(base), port, conditionArgs, statsInterval, loop)
+        return
+
+    import multiprocessing
+
+    perProcess = -(-count // processes)
+    workers = []
+    for first in range(0, count, perProcess):
+        worker = multiprocessing.Process(
+            target=_servePartition,
+            args=(min(perProcess, count - first), first, str(base), port, conditionArgs, statsInterval, loop),
+            daemon=True,
+        )
+        worker.start()
+        workers.append(worker)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
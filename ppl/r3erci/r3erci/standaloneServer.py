@@ -1,6 +1,7 @@
 import asyncio
+import time
 from ipaddress import IPv4Address
-from typing import NamedTuple, Optional, Tuple
+from typing import Dict, List, Tuple
 
 from r3erci.constants import (
     PORT,
@@ -20,25 +21,46 @@ from r3erci.constants import (
 from r3erci.constants import PacketLengthType as PLT
 from r3erci.exceptions import ResponseError
 from r3erci.udpServer import UdpServer
-from r3erci.util import ts_print, color_string_fail, colors
+from r3erci.util import StyleAdapter, getLogger, ts_print
 
-queue_tuple = NamedTuple("queue_tuple", [("data", bytes), ("address", Tuple[str, int])])
+logger = StyleAdapter(getLogger(__name__))
+
+
+class ErebState:
+    __slots__ = ("state", "config_id", "ring_id", "antenna_id", "configmode_flag")
+
+    def __init__(self):
+        self.state = ErciState.READY
+        self.config_id = ErciInvalid.CONFIG
+        self.ring_id = ErciInvalid.RING
+        self.antenna_id = ErciInvalid.ANTENNA
+        self.configmode_flag = 0
 
 
 class StandaloneServer(UdpServer):
-    queuedPackets = asyncio.Queue()  # type: asyncio.Queue[queue_tuple]
+    """
+    In-process transport answering like an EREB. Nothing is bound, responses are handed to
+    the dispatcher with call_soon like datagrams arriving from the network.
+    """
 
     def __init__(self):
-        super().__init__()
+        # No socket: skip UdpServer.__init__ on purpose
+        self.initDispatch()
+        self.active = True
         ts_print("r3erci running in standalone mode")
-        self.handlerFuture = asyncio.ensure_future(self.handlePackets())
 
-        self.erebStates = {}
+        self.erebStates = {}  # type: Dict[IPv4Address, ErebState]
+
+    @classmethod
+    async def create(cls) -> "StandaloneServer":
+        return cls()
 
     def shutdown(self):
-        if self.handlerFuture:
-            self.handlerFuture.cancel()
-            self.handlerFuture = None
+        self.active = False
+
+    def close(self) -> None:
+        # Nothing is bound, see UdpServer.close()
+        self.shutdown()
 
     def __del__(self):
         try:
@@ -46,6 +68,12 @@ class StandaloneServer(UdpServer):
         except Exception:
             pass
 
+    def erebState(self, address: IPv4Address) -> ErebState:
+        erebState = self.erebStates.get(address)
+        if erebState is None:
+            erebState = self.erebStates[address] = ErebState()
+        return erebState
+
     def createMessage(self, command: ErciCmd, sequence: int, otherdata: bytes) -> bytes:
         data = bytearray()
         data.append(RESERVED_VALUE)
@@ -58,25 +86,8 @@ class StandaloneServer(UdpServer):
         return data
 
     def enqueuePacket(self, data: bytes, address: IPv4Address) -> None:
-        self.queuedPackets.put_nowait(
-            queue_tuple(
-                data,
-                (str(address), PORT),
-            )
-        )
-
-    async def pumpPackets(self, timeout: Optional[float] = None) -> None:
-        while (not self.queuedPackets.empty()) or timeout is not None:
-            try:
-                curr = await asyncio.wait_for(self.queuedPackets.get(), timeout)
-            except asyncio.TimeoutError:
-                return
-            await self.receiveHandler(curr.data, curr.address)
-            self.queuedPackets.task_done()
-
-    async def handlePackets(self) -> None:
-        while True:
-            await self.pumpPackets(0.1)
+        if self.active:
+            asyncio.get_running_loop().call_soon(self.handleDatagram, bytes(data), (str(address), PORT))
 
     def enqueueCommandResult(
         self, address: IPv4Address, seq: int, code: ErciResultCode, status_msg=None
@@ -90,11 +101,18 @@ class StandaloneServer(UdpServer):
             self.createMessage(ErciCmd.COMMAND_RESULT, seq, otherdata), address
         )
 
+    def sendBurst(self, packets: List[Tuple[bytes, Tuple[IPv4Address, int]]]) -> List[float]:
+        sentAt = []
+        for data, (address, port) in packets:
+            self.sendPacket(data, address, port)
+            sentAt.append(time.perf_counter())
+        return sentAt
+
     def sendPacket(self, data: bytes, address: IPv4Address, port: int) -> None:
         le, plt = GetPacketLength(None)
         if len(data) < le:
-            ts_print(
-                f"STANDALONE: Short frame! ({len(data)}B vs. expect {str(plt).lower()} {le}B)!"
+            logger.warning(
+                "STANDALONE: Short frame! ({}B vs. expect {} {}B)!", len(data), str(plt).lower(), le
             )
             # TODO: How would the EREB respond wo/ knowing the seq?
             self.enqueueCommandResult(
@@ -108,14 +126,14 @@ class StandaloneServer(UdpServer):
         cmd = data[ErciPosHeader.COMMAND]
         seq = data[ErciPosHeader.SEQUENCE]
 
-        ts_print(f"STANDALONE: Have command {str(ErciCmd(cmd))} for station {address}")
+        logger.debug("STANDALONE: Have command {} for station {}", cmd, address)
 
         if data[ErciPosHeader.RESERVED] != RESERVED_VALUE:
-            ts_print(f"STANDALONE: Reserved field not {RESERVED_VALUE}!")
+            logger.warning("STANDALONE: Reserved field not {}!", RESERVED_VALUE)
             return
 
         if data[ErciPosHeader.PROTOCOL_VERSION] != PROTOCOL_VERSION:
-            ts_print(f"STANDALONE: Version field not 0x{PROTOCOL_VERSION}!")
+            logger.warning("STANDALONE: Version field not 0x{}!", PROTOCOL_VERSION)
             return
 
         if (
@@ -123,8 +141,8 @@ class StandaloneServer(UdpServer):
             or cmd == ErciCmd.COMMAND_RESULT
             or cmd == ErciCmd.STATE_RESPONSE
         ):
-            ts_print(
-                f"STANDALONE: Command {str(ErciCmd(cmd))} should not have been received. ({bytes(data)})"
+            logger.warning(
+                "STANDALONE: Command {} should not have been received. ({!r})", ErciCmd(cmd), bytes(data)
             )
             self.enqueueCommandResult(
                 address, seq, ErciResultCode.INVALID_MESSAGE_RECEIVED
@@ -133,8 +151,8 @@ class StandaloneServer(UdpServer):
         le, plt = GetPacketLength(cmd)
         if plt == PLT.MINIMUM:
             if len(data) < le:
-                ts_print(
-                    f"STANDALONE: {color_string_fail('Short frame!')} ({len(data)}B vs. expect {str(plt).lower()} {le}B)"
+                logger.warning(
+                    "STANDALONE: Short frame! ({}B vs. expect {} {}B)", len(data), str(plt).lower(), le
                 )
                 self.enqueueCommandResult(
                     address,
@@ -145,8 +163,8 @@ class StandaloneServer(UdpServer):
                 return
         elif plt == PLT.EXACT:
             if len(data) != le:
-                ts_print(
-                    f"STANDALONE: {color_string_fail('Wrong frame length!')} ({len(data)}B vs. expect {str(plt).lower()} {le}B)"
+                logger.warning(
+                    "STANDALONE: Wrong frame length! ({}B vs. expect {} {}B)", len(data), str(plt).lower(), le
                 )
                 self.enqueueCommandResult(
                     address,
@@ -157,8 +175,8 @@ class StandaloneServer(UdpServer):
                 return
         elif plt == PLT.MAXIMUM:
             if len(data) > le:
-                ts_print(
-                    f"STANDALONE: {color_string_fail('Long frame!')} ({len(data)}B vs. expect {str(plt).lower()} {le}B)"
+                logger.warning(
+                    "STANDALONE: Long frame! ({}B vs. expect {} {}B)", len(data), str(plt).lower(), le
                 )
                 self.enqueueCommandResult(
                     address,
@@ -173,96 +191,51 @@ class StandaloneServer(UdpServer):
             )
 
         if cmd == ErciCmd.SELECT_CONFIG:
-            erebState = self.erebStates.setdefault(
-                address,
-                {
-                    "state": ErciState.READY,
-                    "config_id": ErciInvalid.CONFIG,
-                    "ring_id": ErciInvalid.RING,
-                    "antenna_id": ErciInvalid.ANTENNA,
-                    "configmode_flag": 0,
-                },
-            )
+            erebState = self.erebState(address)
             # TODO: Could do some FSM check here, if BUSY/RUNNING then return error
-            erebState["state"] = ErciState.CONFIGURED
+            erebState.state = ErciState.CONFIGURED
 
-            erebState["config_id"] = data[ErciPosSelectConfig.CONFIG_ID]
-            erebState["ring_id"] = data[ErciPosSelectConfig.RING_ID]
-            erebState["antenna_id"] = data[ErciPosSelectConfig.ANTENNA_ID]
+            erebState.config_id = data[ErciPosSelectConfig.CONFIG_ID]
+            erebState.ring_id = data[ErciPosSelectConfig.RING_ID]
+            erebState.antenna_id = data[ErciPosSelectConfig.ANTENNA_ID]
             self.enqueueCommandResult(
                 address,
                 seq,
                 ErciResultCode.SUCCESS,
-                status_msg=f"Selected config {erebState['config_id']} ring {erebState['ring_id']} antenna {erebState['antenna_id']}",
+                status_msg=f"Selected config {erebState.config_id} ring {erebState.ring_id} antenna {erebState.antenna_id}",
             )
         elif cmd == ErciCmd.SWITCH_RING:
-            erebState = self.erebStates.setdefault(
-                address,
-                {
-                    "state": ErciState.READY,
-                    "config_id": ErciInvalid.CONFIG,
-                    "ring_id": ErciInvalid.RING,
-                    "antenna_id": ErciInvalid.ANTENNA,
-                    "configmode_flag": 0,
-                },
-            )
+            erebState = self.erebState(address)
             # TODO: Could do some FSM check here, if BUSY/RUNNING then return error
-            erebState["ring_id"] = data[ErciPosSwitchRing.RING_ID]
-            erebState["antenna_id"] = data[ErciPosSwitchRing.ANTENNA_ID]
+            erebState.ring_id = data[ErciPosSwitchRing.RING_ID]
+            erebState.antenna_id = data[ErciPosSwitchRing.ANTENNA_ID]
             self.enqueueCommandResult(
                 address,
                 seq,
                 ErciResultCode.SUCCESS,
-                status_msg=f"Switched to ring {erebState['ring_id']} antenna {erebState['antenna_id']}",
+                status_msg=f"Switched to ring {erebState.ring_id} antenna {erebState.antenna_id}",
             )
         elif cmd == ErciCmd.START:
-            erebState = self.erebStates.setdefault(
-                address,
-                {
-                    "state": ErciState.READY,
-                    "config_id": ErciInvalid.CONFIG,
-                    "ring_id": ErciInvalid.RING,
-                    "antenna_id": ErciInvalid.ANTENNA,
-                    "configmode_flag": 0,
-                },
-            )
+            erebState = self.erebState(address)
             # TODO: Could do some FSM check here, if config/ring zero then return error
-            erebState["state"] = ErciState.RUNNING
+            erebState.state = ErciState.RUNNING
             self.enqueueCommandResult(
                 address, seq, ErciResultCode.SUCCESS, status_msg="Started ring."
             )
         elif cmd == ErciCmd.STOP:
-            erebState = self.erebStates.setdefault(
-                address,
-                {
-                    "state": ErciState.READY,
-                    "config_id": ErciInvalid.CONFIG,
-                    "ring_id": ErciInvalid.RING,
-                    "antenna_id": ErciInvalid.ANTENNA,
-                    "configmode_flag": 0,
-                },
-            )
+            erebState = self.erebState(address)
             # TODO: Could do some FSM check here, if not RUNNING then return error
-            erebState["state"] = ErciState.READY
+            erebState.state = ErciState.READY
             self.enqueueCommandResult(
                 address, seq, ErciResultCode.SUCCESS, status_msg="Stopped ring."
             )
         elif cmd == ErciCmd.STATE_QUERY:
-            erebState = self.erebStates.setdefault(
-                address,
-                {
-                    "state": ErciState.READY,
-                    "config_id": ErciInvalid.CONFIG,
-                    "ring_id": ErciInvalid.RING,
-                    "antenna_id": ErciInvalid.ANTENNA,
-                    "configmode_flag": 0,
-                },
-            )
+            erebState = self.erebState(address)
             otherdata = bytearray()
-            otherdata.append(erebState["state"])
-            otherdata.append(erebState["config_id"])
-            otherdata.append(erebState["ring_id"])
-            otherdata.append(erebState["antenna_id"])
+            otherdata.append(erebState.state)
+            otherdata.append(erebState.config_id)
+            otherdata.append(erebState.ring_id)
+            otherdata.append(erebState.antenna_id)
             self.enqueuePacket(
                 self.createMessage(ErciCmd.STATE_RESPONSE, seq, otherdata), address
             )
@@ -278,43 +251,25 @@ class StandaloneServer(UdpServer):
                 address,
             )
         elif cmd == ErciCmd.SWITCH_ANTENNA:
-            erebState = self.erebStates.setdefault(
-                address,
-                {
-                    "state": ErciState.READY,
-                    "config_id": ErciInvalid.CONFIG,
-                    "ring_id": ErciInvalid.RING,
-                    "antenna_id": ErciInvalid.ANTENNA,
-                    "configmode_flag": 0,
-                },
-            )
-            erebState["antenna_id"] = data[ErciPosSwitchAntenna.ANTENNA_ID]
+            erebState = self.erebState(address)
+            erebState.antenna_id = data[ErciPosSwitchAntenna.ANTENNA_ID]
             self.enqueueCommandResult(
                 address,
                 seq,
                 ErciResultCode.SUCCESS,
-                status_msg=f"Switched to antenna {erebState['antenna_id']}",
+                status_msg=f"Switched to antenna {erebState.antenna_id}",
             )
         elif cmd == ErciCmd.SET_CONFIGMODE:
-            erebState = self.erebStates.setdefault(
-                address,
-                {
-                    "state": ErciState.READY,
-                    "config_id": ErciInvalid.CONFIG,
-                    "ring_id": ErciInvalid.RING,
-                    "antenna_id": ErciInvalid.ANTENNA,
-                    "configmode_flag": 0,
-                },
-            )
-            erebState["configmode_flag"] = data[ErciPosSetConfigMode.CONFIG_MODE_FLAG]
+            erebState = self.erebState(address)
+            erebState.configmode_flag = data[ErciPosSetConfigMode.CONFIG_MODE_FLAG]
             self.enqueueCommandResult(
                 address,
                 seq,
                 ErciResultCode.SUCCESS,
-                status_msg=f"Switched configmode flag to {erebState['configmode_flag']}",
+                status_msg=f"Switched configmode flag to {erebState.configmode_flag}",
             )
         elif cmd == ErciCmd.REBOOT:
             pass
 
         else:
-            ts_print("STANDALONE: Not answering.")
+            logger.debug("STANDALONE: Not answering.")
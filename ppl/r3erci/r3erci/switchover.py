@@ -0,0 +1,311 @@
+import asyncio
+import time
+from contextlib import ExitStack
+from functools import partial
+from ipaddress import ip_address
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from r3erci.client import PRIORITY_SAFETY, CommandQueue, ErciClient
+from r3erci.constants import PORT, ErciCmd, ErciState
+from r3erci.exceptions import ErciException, ResponseError, TimeoutError
+from r3erci.util import StyleAdapter, getLogger
+
+"""
+Coordinated ring changes across a group of EREBs
+
+    Every step prepares the frames of all members first and sends them back to back from one
+    socket, then collects the responses of all members at once. Each step reports per member
+    when its frame left, when its response arrived and how far apart the responses were (skew).
+
+    switchRing():     STATE_QUERY, SWITCH_RING
+    selectConfig():   STATE_QUERY, SELECT_CONFIG, START
+
+    The state query checks that all members are reachable and in a state allowing the change
+    before anything is changed, and remembers their previous config. If a member fails a step,
+    the members which changed (or did not answer) are rolled back to their previous config.
+"""
+
+logger = StyleAdapter(getLogger(__name__))
+
+# Arguments of one member: config_id, ring_id, antenna_id
+MemberArgsType = Dict[str, int]
+
+
+class MemberResult:
+    __slots__ = ("address", "sentAt", "receivedAt", "result", "error")
+
+    def __init__(self, address: str, sentAt: float):
+        self.address = address
+        self.sentAt = sentAt
+        self.receivedAt = None  # type: Optional[float]
+        self.result = None  # type: Optional[Dict[str, Any]]
+        self.error = None  # type: Optional[ErciException]
+
+    @property
+    def success(self) -> bool:
+        return self.error is None and self.result.get("success", True)
+
+    @property
+    def answered(self) -> bool:
+        return self.result is not None
+
+    @property
+    def latency(self) -> Optional[float]:
+        return None if self.receivedAt is None else self.receivedAt - self.sentAt
+
+    def __repr__(self):
+        outcome = self.error if self.error is not None else self.result.get("status_msg", self.result["type"])
+        return f"<MemberResult {self.address} {'ok' if self.success else 'failed'}: {outcome}>"
+
+
+class StepReport:
+    """
+    Results of one command sent to a group of members.
+    """
+
+    def __init__(self, command: ErciCmd, members: List[MemberResult]):
+        self.command = command
+        self.members = members
+
+    @property
+    def succeeded(self) -> List[MemberResult]:
+        return [member for member in self.members if member.success]
+
+    @property
+    def failed(self) -> List[MemberResult]:
+        return [member for member in self.members if not member.success]
+
+    @property
+    def success(self) -> bool:
+        return all(member.success for member in self.members)
+
+    @property
+    def dispatchSpread(self) -> float:
+        """Time between the first and the last frame leaving (in seconds)."""
+        return self.members[-1].sentAt - self.members[0].sentAt if self.members else 0.0
+
+    @property
+    def skew(self) -> Optional[float]:
+        """Time between the first and the last response (in seconds), None if nobody answered."""
+        received = [member.receivedAt for member in self.members if member.receivedAt is not None]
+        return max(received) - min(received) if received else None
+
+    def offset(self, member: MemberResult) -> Optional[float]:
+        """Time of the response of member after the first response of the step."""
+        received = [m.receivedAt for m in self.members if m.receivedAt is not None]
+        return None if member.receivedAt is None else member.receivedAt - min(received)
+
+    def __repr__(self):
+        skew = self.skew
+        return (
+            f"<StepReport {self.command} {len(self.succeeded)}/{len(self.members)} ok,"
+            f" skew {'-' if skew is None else f'{skew * 1000:.3f}ms'}>"
+        )
+
+
+class SwitchoverReport:
+    def __init__(self):
+        self.previous = {}  # type: Dict[str, Dict[str, Any]]
+        self.steps = []  # type: List[StepReport]
+        self.rollback = []  # type: List[StepReport]
+        self.aborted = None  # type: Optional[str]
+
+    @property
+    def success(self) -> bool:
+        return self.aborted is None and not self.rollback and all(step.success for step in self.steps)
+
+
+class RingSwitchover:
+    """
+    Changes the ring or config of a group of EREBs at once, see the module description.
+    Every step takes the turn of all members at once with safety priority, other commands
+    of the client to the members wait for the step.
+
+    :param members: Addresses of the EREBs
+    """
+
+    def __init__(self, client: ErciClient, members: Iterable[str], rollback: bool = True):
+        self.client = client
+        self.members = sorted({str(ip_address(member)) for member in members}, key=ip_address)
+        if not self.members:
+            raise ValueError("A switchover needs at least one member")
+        self.rollbackEnabled = rollback
+
+    async def fire(self, command: ErciCmd, args: Dict[str, MemberArgsType]) -> StepReport:
+        """
+        Sends command to the members in args at once and waits for all responses.
+
+        :param args: Arguments per member address (config_id, ring_id, antenna_id)
+        """
+        if not args:
+            raise ValueError("No members to send to")
+        for memberArgs in args.values():
+            ErciClient._check_ids(memberArgs.get("config_id"), memberArgs.get("ring_id"), memberArgs.get("antenna_id"))
+        client = self.client
+        udpServer = client.udpServer
+        addresses = [ip_address(address) for address in sorted(args, key=ip_address)]
+        queues = []  # type: List[CommandQueue]
+        try:
+            # Always taken in address order, other commands take one device at a time
+            for address in addresses:
+                queue = client.commandQueue(address)
+                await queue.acquire(PRIORITY_SAFETY)
+                queues.append(queue)
+
+            seqnos = [queue.nextSeqno() for queue in queues]
+            frames = []
+            for address, seqno in zip(addresses, seqnos):
+                memberArgs = args[str(address)]
+                data = client._create_msg(
+                    command,
+                    memberArgs.get("config_id"),
+                    memberArgs.get("ring_id"),
+                    memberArgs.get("antenna_id"),
+                    None,
+                    None,
+                    None,
+                    seqno,
+                )
+                frames.append((data, (address, PORT)))
+
+            with ExitStack() as waiters:
+                futures = [
+                    waiters.enter_context(udpServer.expectResponse(str(address), filterSeq=seqno))
+                    for address, seqno in zip(addresses, seqnos)
+                ]
+                receivedAt = [None] * len(futures)  # type: List[Optional[float]]
+                for i, future in enumerate(futures):
+                    future.add_done_callback(partial(self._received, receivedAt, i))
+
+                sentAt = udpServer.sendBurst(frames)
+                await asyncio.wait(futures, timeout=client.timeout)
+
+            members = []
+            for i, address in enumerate(addresses):
+                member = MemberResult(str(address), sentAt[i])
+                if futures[i].done():
+                    member.receivedAt = receivedAt[i]
+                    _, _, message, rxAddress = futures[i].result()
+                    try:
+                        member.result = client._handle_response(message, rxAddress, seqnos[i])
+                    except ResponseError as e:
+                        member.error = e
+                else:
+                    futures[i].cancel()
+                    member.error = TimeoutError(f"{address}: No response in {client.timeout} seconds.")
+                members.append(member)
+        finally:
+            for queue in queues:
+                queue.release()
+
+        report = StepReport(command, members)
+        logger.info("{}", report)
+        return report
+
+    @staticmethod
+    def _received(receivedAt: List[Optional[float]], i: int, future: asyncio.Future) -> None:
+        if not future.cancelled():
+            receivedAt[i] = time.perf_counter()
+
+    async def _prepare(self, report: SwitchoverReport, allowed: Tuple[ErciState, ...]) -> bool:
+        step = await self.fire(ErciCmd.STATE_QUERY, {address: {} for address in self.members})
+        report.steps.append(step)
+        if not step.success:
+            report.aborted = f"{len(step.failed)} members did not answer the state query"
+            return False
+        wrongState = [member for member in step.members if member.result["state"] not in allowed]
+        if wrongState:
+            report.aborted = "Not allowed in state " + ", ".join(
+                f"{member.address}: {member.result['state']}" for member in wrongState
+            )
+            return False
+        report.previous = {member.address: member.result for member in step.members}
+        return True
+
+    @staticmethod
+    def _affected(step: StepReport) -> List[str]:
+        # Members which did not answer may have executed the command all the same
+        return [member.address for member in step.members if member.success or not member.answered]
+
+    async def _rollback(self, report: SwitchoverReport, steps: List[Tuple[ErciCmd, Dict[str, MemberArgsType]]]) -> None:
+        if not self.rollbackEnabled:
+            return
+        for command, args in steps:
+            if args:
+                report.rollback.append(await self.fire(command, args))
+
+    async def switchRing(self, ring_id: int, antenna_id: int) -> SwitchoverReport:
+        """
+        Switches all members (RUNNING) to ring_id / antenna_id, or none of them.
+        """
+        report = SwitchoverReport()
+        if not await self._prepare(report, (ErciState.RUNNING,)):
+            return report
+        step = await self.fire(
+            ErciCmd.SWITCH_RING, {address: {"ring_id": ring_id, "antenna_id": antenna_id} for address in self.members}
+        )
+        report.steps.append(step)
+        if not step.success:
+            previous = report.previous
+            await self._rollback(
+                report,
+                [
+                    (
+                        ErciCmd.SWITCH_RING,
+                        {
+                            address: {"ring_id": previous[address]["ring_id"], "antenna_id": previous[address]["antenna_id"]}
+                            for address in self._affected(step)
+                        },
+                    )
+                ],
+            )
+        return report
+
+    async def selectConfig(self, config_id: int, ring_id: int, antenna_id: int, start: bool = True) -> SwitchoverReport:
+        """
+        Selects the config on all members (READY or CONFIGURED) and starts them together.
+        A failed START stops the started members again, in both cases members which were
+        CONFIGURED before get their previous config back.
+        """
+        report = SwitchoverReport()
+        if not await self._prepare(report, (ErciState.READY, ErciState.CONFIGURED)):
+            return report
+        previous = report.previous
+
+        def restoreConfig(addresses: Iterable[str]) -> Dict[str, MemberArgsType]:
+            return {
+                address: {
+                    "config_id": previous[address]["config_id"],
+                    "ring_id": previous[address]["ring_id"],
+                    "antenna_id": previous[address]["antenna_id"],
+                }
+                for address in addresses
+                if previous[address]["state"] == ErciState.CONFIGURED
+            }
+
+        step = await self.fire(
+            ErciCmd.SELECT_CONFIG,
+            {
+                address: {"config_id": config_id, "ring_id": ring_id, "antenna_id": antenna_id}
+                for address in self.members
+            },
+        )
+        report.steps.append(step)
+        if not step.success:
+            await self._rollback(report, [(ErciCmd.SELECT_CONFIG, restoreConfig(self._affected(step)))])
+            return report
+        if not start:
+            return report
+
+        step = await self.fire(ErciCmd.START, {address: {} for address in self.members})
+        report.steps.append(step)
+        if not step.success:
+            started = self._affected(step)
+            await self._rollback(
+                report,
+                [
+                    (ErciCmd.STOP, {address: {} for address in started}),
+                    (ErciCmd.SELECT_CONFIG, restoreConfig(self.members)),
+                ],
+            )
+        return report
@@ -0,0 +1,243 @@
+import json
+import time
+from typing import Any, Coroutine, Dict, Iterable, List, Optional, TextIO, Tuple
+
+from r3erci.util import runMain
+
+# Phases of a request/response round trip, in the order they happen
+PHASE_QUERY_LOCK = "queryLock"  # waiting in the command queue of the device
+PHASE_SERIALIZE = "serialize"  # building the request frame
+PHASE_SEND = "send"  # handing the frame to the socket
+PHASE_RECEIVE = "receive"  # from sent until the response reached its query (device RTT)
+PHASE_DISPATCH_LOCK = "dispatchLock"  # waiting for the dispatch lock of the UdpServer
+PHASE_DISPATCH = "dispatch"  # running the subscribers of a received frame
+PHASE_DESERIALIZE = "deserialize"  # parsing the response frame
+PHASE_HANDLER = "handler"  # whole command, from the call until the result is returned
+
+PHASES = (
+    PHASE_QUERY_LOCK,
+    PHASE_SERIALIZE,
+    PHASE_SEND,
+    PHASE_RECEIVE,
+    PHASE_DISPATCH_LOCK,
+    PHASE_DISPATCH,
+    PHASE_DESERIALIZE,
+    PHASE_HANDLER,
+)
+
+# Values below 2**SUB_BUCKET_BITS microseconds are exact, above the relative error is below 1/64
+SUB_BUCKET_BITS = 7
+_SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+
+def _bucketIndex(value: int) -> int:
+    if value < (1 << SUB_BUCKET_BITS):
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * _SUB_BUCKET_HALF + (value >> shift)
+
+
+def _bucketBounds(index: int) -> Tuple[int, int]:
+    if index < (1 << SUB_BUCKET_BITS):
+        return index, index
+    shift = index // _SUB_BUCKET_HALF - 1
+    mantissa = index - shift * _SUB_BUCKET_HALF
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class HdrHistogram:
+    """
+    Log-linear latency histogram in microseconds with a bounded relative error,
+    similar to HdrHistogram. Buckets are kept sparse.
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = {}  # type: Dict[int, int]
+        self.count = 0
+        self.total = 0
+        self.min = None  # type: Optional[int]
+        self.max = None  # type: Optional[int]
+
+    def record(self, seconds: float) -> None:
+        value = int(seconds * 1e6)
+        if value < 0:
+            value = 0
+        index = _bucketIndex(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "HdrHistogram") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, q: float) -> int:
+        """
+        :param q: Percentile in the range 0..100
+        :returns: Upper bound of the bucket holding the percentile in microseconds
+        """
+        if not self.count:
+            return 0
+        rank = max(1, int(q / 100.0 * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(_bucketBounds(index)[1], self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def getDict(self) -> dict:
+        return {
+            "count": self.count,
+            "min_us": self.min or 0,
+            "mean_us": round(self.mean, 1),
+            "p50_us": self.percentile(50),
+            "p90_us": self.percentile(90),
+            "p99_us": self.percentile(99),
+            "max_us": self.max or 0,
+            "buckets": [
+                [_bucketBounds(index)[0], self.counts[index]] for index in sorted(self.counts)
+            ],
+        }
+
+
+class Tracer:
+    """
+    Collects one HdrHistogram per phase, command and device. Disabled by default,
+    instrumented code checks `enabled` before taking any timestamps.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}  # type: Dict[Tuple[str, str, str], HdrHistogram]
+
+    @staticmethod
+    def now() -> float:
+        return time.perf_counter()
+
+    def record(self, phase: str, command, device, seconds: float) -> None:
+        key = (phase, str(command), str(device))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = HdrHistogram()
+        histogram.record(seconds)
+
+    def since(self, phase: str, command, device, start: float) -> float:
+        """Records the time passed since start and returns the current timestamp."""
+        now = time.perf_counter()
+        self.record(phase, command, device, now - start)
+        return now
+
+    def reset(self) -> None:
+        self.histograms = {}
+
+    def merged(self, byDevice: bool = False) -> Dict[Tuple[str, ...], HdrHistogram]:
+        """Histograms per phase and command (and device if byDevice)."""
+        result = {}  # type: Dict[Tuple[str, ...], HdrHistogram]
+        for (phase, command, device), histogram in self.histograms.items():
+            key = (phase, command, device) if byDevice else (phase, command)
+            if key not in result:
+                result[key] = HdrHistogram()
+            result[key].merge(histogram)
+        return result
+
+    def getDict(self) -> dict:
+        result = {}  # type: Dict[str, Dict[str, Dict[str, dict]]]
+        for (phase, command, device), histogram in sorted(self.histograms.items()):
+            result.setdefault(phase, {}).setdefault(command, {})[device] = histogram.getDict()
+        return result
+
+    def dumpJson(self, fp: TextIO) -> None:
+        json.dump(self.getDict(), fp, indent=2)
+
+    def formatTable(self, byDevice: bool = False) -> str:
+        order = {phase: i for i, phase in enumerate(PHASES)}
+        rows = []  # type: List[Iterable[str]]
+        header = ["phase", "command"] + (["device"] if byDevice else [])
+        header += ["count", "p50[us]", "p90[us]", "p99[us]", "max[us]"]
+        merged = self.merged(byDevice)
+        for key in sorted(merged, key=lambda k: (order.get(k[0], len(order)),) + k[1:]):
+            histogram = merged[key]
+            rows.append(
+                list(key)
+                + [
+                    str(histogram.count),
+                    str(histogram.percentile(50)),
+                    str(histogram.percentile(90)),
+                    str(histogram.percentile(99)),
+                    str(histogram.max),
+                ]
+            )
+        widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+        return "\n".join(
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in [header] + rows
+        )
+
+
+tracer = Tracer()
+
+
+def enableTracing(enable: bool = True) -> Tracer:
+    tracer.enabled = enable
+    return tracer
+
+
+def addStatsArguments(parser) -> None:
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        default=False,
+        help="Print per-phase latency statistics when done",
+    )
+    parser.add_argument(
+        "--stats-json",
+        type=str,
+        default=None,
+        metavar="FILE",
+        help="Write per-phase latency histograms as JSON to FILE ('-' for stdout)",
+    )
+
+
+def runMainWithStats(main: Coroutine, args, byDevice: bool = False) -> Any:
+    """
+    runMain() tracing the commands if --stats or --stats-json is given (see addStatsArguments()),
+    the statistics are written once main is done.
+    """
+    stats = args.stats or args.stats_json
+    if stats:
+        enableTracing()
+    result = runMain(main, args.loop)
+    if stats:
+        writeStats(args.stats, args.stats_json, byDevice)
+    return result
+
+
+def writeStats(table: bool = True, jsonPath: Optional[str] = None, byDevice: bool = False) -> None:
+    """
+    :param table: Print the collected statistics as a table
+    :param jsonPath: Write the histograms as JSON to this file, "-" for stdout
+    :param byDevice: Show one table row per device instead of per command
+    """
+    if table:
+        print(tracer.formatTable(byDevice))
+    if jsonPath == "-":
+        print(json.dumps(tracer.getDict(), indent=2))
+    elif jsonPath:
+        with open(jsonPath, "w") as fp:
+            tracer.dumpJson(fp)
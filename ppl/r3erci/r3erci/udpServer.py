@@ -1,17 +1,30 @@
 import asyncio
 import inspect
 import socket
-import traceback
+import time
+from collections import deque
 from contextlib import contextmanager
 from ipaddress import IPv4Address
-from typing import Any, Callable, Coroutine, Iterator, List, Optional, Tuple
+from typing import Any, Callable, Coroutine, Deque, Dict, Iterator, List, Optional, Tuple
 
 from r3erci.constants import PORT, ErciCmd, ErciPosHeader, GetPacketLength
-from r3erci.util import ts_print
+from r3erci.tracing import PHASE_DISPATCH, PHASE_DISPATCH_LOCK, tracer
+from r3erci.util import StyleAdapter, getLogger
+
+logger = StyleAdapter(getLogger(__name__))
+
+# Receive buffer requested from the kernel, bursts of responses from many devices overflow the default
+RCVBUF_SIZE = 4 * 1024 * 1024
+# Upper bound of datagrams drained per reader callback in batched mode
+RECV_BATCH_SIZE = 64
+RECV_DATAGRAM_SIZE = 65535
+# Upper bound of received packets waiting for coroutine subscribers, further packets are dropped
+SUBSCRIBER_QUEUE_SIZE = 1024
 
 CRType = Coroutine[Any, Any, bool]
 InternalSubscriberType = Callable[[ErciCmd, int, bytes, Tuple[str, int]], CRType]
 ExternalSubscriberType = Callable[[ErciCmd, int, bytes, Tuple[str, int]], CRType]
+PacketType = Tuple[Optional[ErciCmd], int, bytes, Tuple[str, int]]
 
 
 class UdpServerProtocol(asyncio.BaseProtocol):
@@ -24,16 +37,33 @@ class UdpServerProtocol(asyncio.BaseProtocol):
 
     def datagram_received(self, data, sender):
         try:
-            asyncio.ensure_future(self.handler(data, sender))
-        except Exception as e:
-            ts_print(e)
+            self.handler(data, sender)
+        except Exception:
+            logger.exception("Could not handle packet from {}", sender)
+
+
+class ResponseWaiter:
+    __slots__ = ("command", "sequence", "future")
+
+    def __init__(self, command: Optional[ErciCmd], sequence: Optional[int], future: asyncio.Future):
+        self.command = command
+        self.sequence = sequence
+        self.future = future
 
 
 class UdpServer:
     subscribers = []  # type: List[InternalSubscriberType]
     sock = None  # type: socket.socket
 
-    def __init__(self, ownaddress: str = "0.0.0.0", ownport: int = PORT):
+    def __init__(
+        self, ownaddress: str = "0.0.0.0", ownport: int = PORT, batched: bool = False, bind: bool = True
+    ):
+        """
+        :param batched: Drain the socket in batches from a reader callback and coalesce sends
+                        into one callback per loop iteration instead of one asyncio protocol
+                        callback and task per datagram
+        :param bind: Open the socket right away, use create() from within a running event loop
+        """
         try:
             IPv4Address(ownaddress)
         except ValueError:
@@ -42,37 +72,172 @@ class UdpServer:
             ownport = int(ownport)
         except ValueError:
             raise ValueError(f"{ownport} is not an integer")
-        self.dispatchLock = asyncio.Lock()
-        self.openSocket(ownaddress, ownport)
+        self.ownaddress = ownaddress
+        self.ownport = ownport
+        self.initDispatch()
+        self.batched = batched
+        self.loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self.transport = None  # type: Optional[asyncio.DatagramTransport]
+        self.sendQueue = deque()  # type: Deque[Tuple[bytes, Tuple[str, int]]]
+        self.sendScheduled = False
+        if bind:
+            self.openSocket(ownaddress, ownport)
 
-    def openSocket(self, ownaddress: str, ownport: int, timeout: float = 0.5) -> None:
+    @classmethod
+    async def create(
+        cls, ownaddress: str = "0.0.0.0", ownport: int = PORT, batched: bool = False
+    ) -> "UdpServer":
+        """
+        Creates the server from within a running event loop, the socket is listening on return.
+        """
+        self = cls(ownaddress, ownport, batched=batched, bind=False)
+        await self.openSocketAsync(self.ownaddress, self.ownport)
+        return self
+
+    def bindSocket(self, ownaddress: str, ownport: int, timeout: float = 0.5) -> None:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         except Exception:
             pass
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
+        except OSError:
+            pass
         self.sock.settimeout(timeout)
         self.sock.bind((ownaddress, ownport))
 
-        loop = asyncio.get_event_loop()
-        listen = loop.create_datagram_endpoint(
-            lambda: UdpServerProtocol(self.receiveHandler),
+    def listen(self, loop: asyncio.AbstractEventLoop) -> Optional[Coroutine]:
+        """
+        Registers the socket with the loop. Returns the endpoint coroutine to await
+        unless the socket is drained by a reader callback.
+        """
+        self.loop = loop
+        if self.batched:
+            self.sock.setblocking(False)
+            loop.add_reader(self.sock.fileno(), self._drainSocket)
+            return None
+        return loop.create_datagram_endpoint(
+            lambda: UdpServerProtocol(self.handleDatagram),
             sock=self.sock,
         )
+
+    def openSocket(self, ownaddress: str, ownport: int, timeout: float = 0.5) -> None:
+        self.bindSocket(ownaddress, ownport, timeout)
+        loop = asyncio.get_event_loop()
+        listen = self.listen(loop)
+        if listen is None:
+            return
         if loop.is_running():
             loop.create_task(listen)
         else:
-            transport, protocol = loop.run_until_complete(listen)
+            self.transport, protocol = loop.run_until_complete(listen)
+
+    async def openSocketAsync(self, ownaddress: str, ownport: int, timeout: float = 0.5) -> None:
+        self.bindSocket(ownaddress, ownport, timeout)
+        listen = self.listen(asyncio.get_running_loop())
+        if listen is not None:
+            self.transport, protocol = await listen
+
+    def close(self) -> None:
+        if self.batched:
+            self.loop.remove_reader(self.sock.fileno())
+            if self.sendScheduled:
+                self.loop.remove_writer(self.sock.fileno())
+        if self.transport is not None:
+            self.transport.close()
+        else:
+            self.sock.close()
 
     def sendPacket(self, data: bytes, address: IPv4Address, port: int) -> None:
-        self.sock.sendto(data, (str(address), port))
+        if not self.batched:
+            self.sock.sendto(data, (str(address), port))
+            return
+        self.sendQueue.append((data, (str(address), port)))
+        if not self.sendScheduled:
+            self.sendScheduled = True
+            self.loop.call_soon(self._flushSends)
+
+    def sendBurst(self, packets: List[Tuple[bytes, Tuple[IPv4Address, int]]]) -> List[float]:
+        """
+        Sends the packets back to back right away instead of coalescing them with other sends.
+
+        :returns: time.perf_counter() of each packet handed to the kernel (or queued if the
+                  socket buffer is full)
+        """
+        sentAt = []
+        if self.batched and self.sendQueue:
+            # Keep the order behind the packets already queued
+            for data, (address, port) in packets:
+                self.sendPacket(data, address, port)
+                sentAt.append(time.perf_counter())
+            return sentAt
+        sendto = self.sock.sendto
+        for i, (data, (address, port)) in enumerate(packets):
+            try:
+                sendto(data, (str(address), port))
+            except (BlockingIOError, InterruptedError):
+                for data, (address, port) in packets[i:]:
+                    self.sendPacket(data, address, port)
+                    sentAt.append(time.perf_counter())
+                break
+            sentAt.append(time.perf_counter())
+        return sentAt
+
+    def _flushSends(self) -> None:
+        sendto = self.sock.sendto
+        sendQueue = self.sendQueue
+        while sendQueue:
+            data, target = sendQueue[0]
+            try:
+                sendto(data, target)
+            except (BlockingIOError, InterruptedError):
+                # Socket buffer full, continue once it is writable again
+                self.loop.add_writer(self.sock.fileno(), self._resumeSends)
+                return
+            except OSError as e:
+                logger.warning("Sending to {}:{} failed: {}", target[0], target[1], e)
+            sendQueue.popleft()
+        self.sendScheduled = False
+
+    def _resumeSends(self) -> None:
+        self.loop.remove_writer(self.sock.fileno())
+        self._flushSends()
+
+    def _drainSocket(self) -> None:
+        batch = []
+        recvfrom = self.sock.recvfrom
+        try:
+            for _ in range(RECV_BATCH_SIZE):
+                batch.append(recvfrom(RECV_DATAGRAM_SIZE))
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            logger.warning("Receiving failed: {}", e)
+        handleDatagram = self.handleDatagram
+        for data, address in batch:
+            try:
+                handleDatagram(data, address)
+            except Exception:
+                logger.exception("Could not handle packet from {}", address)
+
+    def initDispatch(self) -> None:
+        self.dispatchLock = asyncio.Lock()
+        self.waiters = {}  # type: Dict[str, List[ResponseWaiter]]
+        self.subscriberQueue = deque()  # type: Deque[Tuple[PacketType, bool]]
+        self.subscriberTask = None  # type: Optional[asyncio.Future]
+        self.droppedPackets = 0
 
     async def receiveHandler(self, data: bytes, address: Tuple[str, int]) -> None:
+        self.handleDatagram(data, address)
+
+    def handleDatagram(self, data: bytes, address: Tuple[str, int]) -> None:
         le, plt = GetPacketLength(None)
         if len(data) < le:
-            ts_print(
-                f"Response from {address[0]}: \033[0;31mShort frame!\033[0m ({len(data)}B vs. expect {str(plt).lower} {le}B)"
+            logger.warning(
+                "Response from {}: Short frame! ({}B vs. expect {} {}B)",
+                address[0], len(data), str(plt).lower(), le,
             )
             return
 
@@ -82,28 +247,79 @@ class UdpServer:
             cmd = None
         seq = data[ErciPosHeader.SEQUENCE]
 
-        await self.dispatchPacket(cmd, seq, data, address)
+        self.routePacket(cmd, seq, data, address)
+
+    def routePacket(
+        self, command: Optional[ErciCmd], sequence: int, message: bytes, address: Tuple[str, int]
+    ) -> None:
+        """
+        Resolves the first query waiting for this packet directly and queues the packet for
+        the coroutine subscribers, which run one after another in a single task.
+        """
+        processed = False
+        waiters = self.waiters.get(address[0])
+        if waiters:
+            for waiter in waiters:
+                if waiter.command is not None and waiter.command != command:
+                    continue
+                if waiter.sequence is not None and waiter.sequence != sequence:
+                    continue
+                if not waiter.future.done():
+                    waiter.future.set_result((command, sequence, message, address))
+                    processed = True
+                    break
+
+        if self.subscribers:
+            if len(self.subscriberQueue) >= SUBSCRIBER_QUEUE_SIZE:
+                self.droppedPackets += 1
+                logger.debug("Subscribers fall behind, dropped packet {} from {}", sequence, address[0])
+                return
+            self.subscriberQueue.append(((command, sequence, message, address), processed))
+            if self.subscriberTask is None:
+                self.subscriberTask = asyncio.ensure_future(self._runSubscribers())
+        elif not processed:
+            logger.info(
+                "Received an unprocessed packet. Command {}, seq {} from {}:{}",
+                command, sequence, address[0], address[1],
+            )
+
+    async def _runSubscribers(self) -> None:
+        try:
+            while self.subscriberQueue:
+                packet, processed = self.subscriberQueue.popleft()
+                await self.dispatchPacket(*packet, processed=processed)
+        finally:
+            self.subscriberTask = None
 
     async def dispatchPacket(
-        self, command: ErciCmd, sequence: int, message: bytes, address: Tuple[str, int]
+        self,
+        command: ErciCmd,
+        sequence: int,
+        message: bytes,
+        address: Tuple[str, int],
+        processed: bool = False,
     ) -> None:
+        if tracer.enabled:
+            start = tracer.now()
         async with self.dispatchLock:
-            processed = False
+            if tracer.enabled:
+                start = tracer.since(PHASE_DISPATCH_LOCK, command, address[0], start)
             for proc in self.subscribers:
                 try:
                     if await proc(command, sequence, message, address):
                         processed = True
-                except Exception as e:
-                    proc_name = getattr(proc, "__qualname__", str(type(proc)))
-                    pack_name = getattr(message, "name", type(message))
-                    ts_print(
-                        f"An error occured during processing of Packet-Type {pack_name} in subscriber {proc_name}"
+                except Exception:
+                    logger.exception(
+                        "An error occured during processing of Packet-Type {} in subscriber {}",
+                        getattr(message, "name", type(message)),
+                        getattr(proc, "__qualname__", str(type(proc))),
                     )
-                    ts_print(e)
-                    ts_print(traceback.format_exc())
+            if tracer.enabled:
+                tracer.since(PHASE_DISPATCH, command, address[0], start)
             if not processed:
-                ts_print(
-                    f"Received an unprocessed packet. Command {str(command)}, seq {sequence} from {address[0]}:{address[1]}"
+                logger.info(
+                    "Received an unprocessed packet. Command {}, seq {} from {}:{}",
+                    command, sequence, address[0], address[1],
                 )
 
     def _check_subscriber(self, subscriber) -> None:
@@ -114,8 +330,7 @@ class UdpServer:
         # Check for the parameters required
         required = ["command", "sequence", "message", "address"]
         if set(required) > set(subscriber.__code__.co_varnames):
-            ts_print(subscriber)
-            ts_print(subscriber.__code__.co_varnames)
+            logger.debug("{} has parameters {}", subscriber, subscriber.__code__.co_varnames)
             raise AttributeError("Subscriber does not posess required parameters.")
 
     def subscribe(self, subscriber: InternalSubscriberType) -> None:
@@ -127,6 +342,28 @@ class UdpServer:
             raise ValueError("Not a valid subscriber!")
         self.subscribers.remove(subscriber)
 
+    @contextmanager
+    def expectResponse(
+        self,
+        filterAddr: str,
+        filterCmd: Optional[ErciCmd] = None,
+        filterSeq: Optional[int] = None,
+    ) -> Iterator[asyncio.Future]:
+        """
+        Yields a future resolved with (command, sequence, message, address) of the first
+        matching packet received while the context is active.
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiter = ResponseWaiter(filterCmd, filterSeq, future)
+        waiters = self.waiters.setdefault(filterAddr, [])
+        waiters.append(waiter)
+        try:
+            yield future
+        finally:
+            waiters.remove(waiter)
+            if not waiters and self.waiters.get(filterAddr) is waiters:
+                del self.waiters[filterAddr]
+
     @contextmanager
     def subscriberFilterContext(
         self,
@@ -146,11 +383,11 @@ class UdpServer:
                 return False
             return await subscriber(command, sequence, message, address)
 
-        # logger.debug("Subscribing filter SP {} seq {} addr {}", filterCmd, filterSeq, filterAddr)
+        logger.debug("Subscribing filter SP {} seq {} addr {}", filterCmd, filterSeq, filterAddr)
         self._check_subscriber(subscriber)
         self.subscribe(filtered_message)
         try:
             yield
         finally:
-            # logger.debug("Unsubscribing filter SP {} seq {} addr {}", filterCmd, filterSeq, filterAddr)
+            logger.debug("Unsubscribing filter SP {} seq {} addr {}", filterCmd, filterSeq, filterAddr)
             self.unsubscribe(filtered_message)
@@ -1,4 +1,15 @@
+import asyncio
+import atexit
+import json
+import logging
+import queue
+import socket
+import sys
 from datetime import datetime
+from ipaddress import ip_address
+from logging import getLogger  # noqa: F401
+from logging.handlers import QueueHandler, QueueListener
+from typing import IO, Any, Coroutine, Dict, List, Optional, Union
 
 
 class colors:
@@ -23,3 +34,184 @@ def color_string_success(str):
 def ts_print(msg=""):
     ts_str = datetime.strftime(datetime.now(), "%H:%M:%S.%f")
     print(ts_str, msg)
+
+
+def readIpList(iplist: IO[str]) -> List[str]:
+    """Reads one IP or FQDN per line, skips empty lines, comments (#) and invalid entries."""
+    ips = []  # type: List[str]
+    for ip_line in iplist.read().splitlines():
+        if not ip_line or ip_line[0] == "#":
+            continue
+        try:
+            ip_address(ip_line)
+        except ValueError:
+            try:
+                ip_address(socket.gethostbyname(ip_line))
+            except (socket.gaierror, ValueError) as e:
+                print(f"Skipping invalid IP/FQDN: {ip_line}: {e}")
+                continue
+        ips.append(ip_line)
+    return ips
+
+
+# Structured logging
+#
+# Modules log through StyleAdapter(getLogger(__name__)) with brace style arguments, e.g.
+# logger.debug("Packet from {} ({}B)", address, len(data)). The message is only formatted
+# if a handler actually consumes the record, so disabled levels cost one level check.
+
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class BraceMessage:
+    __slots__ = ("fmt", "args")
+
+    def __init__(self, fmt: str, args: tuple):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self) -> str:
+        return self.fmt.format(*self.args) if self.args else str(self.fmt)
+
+
+class StyleAdapter(logging.LoggerAdapter):
+    def __init__(self, logger: logging.Logger, extra: Optional[dict] = None):
+        super().__init__(logger, extra or {})
+
+    def log(self, level: int, msg, *args, **kwargs) -> None:
+        if self.isEnabledFor(level):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger._log(level, BraceMessage(msg, args), (), **kwargs)
+
+    def process(self, msg, kwargs):
+        if self.extra:
+            kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, fields passed as extra= are kept."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setupLogging(
+    level: Union[int, str] = logging.WARNING,
+    path: Optional[str] = None,
+    levels: Optional[Dict[str, Union[int, str]]] = None,
+) -> QueueListener:
+    """
+    Routes all log records through a queue to a background thread writing JSON lines.
+
+    :param level: Level of the root logger
+    :param path: File to append to, stderr if None
+    :param levels: Per-logger levels, e.g. {"ppl.protocol": "DEBUG"}
+    :returns: The started listener, stopped automatically at exit
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    handler = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonLineFormatter())
+    logQueue = queue.SimpleQueue()  # type: queue.SimpleQueue
+    _listener = QueueListener(logQueue, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(QueueHandler(logQueue))
+    root.setLevel(level)
+    for name, loggerLevel in (levels or {}).items():
+        logging.getLogger(name).setLevel(loggerLevel)
+
+    _listener.start()
+    return _listener
+
+
+def stopLogging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def addLoggingArguments(parser) -> None:
+    parser.add_argument(
+        "--log",
+        action="append",
+        default=[],
+        metavar="[LOGGER=]LEVEL",
+        help="Log level, optionally per logger (e.g. --log INFO --log ppl.protocol=DEBUG). Repeatable",
+    )
+    parser.add_argument(
+        "--log-file", type=str, default=None, help="Write JSON log lines to this file instead of stderr"
+    )
+
+
+def setupLoggingFromArgs(args, level: Union[int, str] = logging.WARNING) -> Optional[QueueListener]:
+    """Sets up logging if --log or --log-file was given (see addLoggingArguments)."""
+    if not args.log and not args.log_file:
+        return None
+    levels = {}  # type: Dict[str, str]
+    for spec in args.log:
+        name, _, value = spec.rpartition("=")
+        if name:
+            levels[name] = value.upper()
+        else:
+            level = value.upper()
+    return setupLogging(level, args.log_file, levels)
+
+
+_listener = None  # type: Optional[QueueListener]
+atexit.register(stopLogging)
+
+
+# Event loop selection
+#
+# Entry points run their main coroutine with runMain(main(), args.loop) instead of managing the
+# loop themselves. uvloop is optional and only imported if requested.
+
+EVENT_LOOPS = ("asyncio", "uvloop")
+
+
+def addLoopArguments(parser) -> None:
+    parser.add_argument(
+        "--loop",
+        choices=EVENT_LOOPS,
+        default="asyncio",
+        help="Event loop implementation, uvloop needs to be installed separately",
+    )
+
+
+def runMain(main: Coroutine, loop: str = "asyncio") -> Any:
+    """
+    Runs main in a new event loop like asyncio.run().
+
+    :param loop: One of EVENT_LOOPS
+    """
+    if loop == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            main.close()
+            raise SystemExit("--loop uvloop requires the uvloop package (pip install uvloop)")
+        if hasattr(uvloop, "run"):
+            return uvloop.run(main)
+        uvloop.install()
+    elif loop != "asyncio":
+        main.close()
+        raise ValueError(f"Unknown event loop {loop}")
+    return asyncio.run(main)
@@ -0,0 +1,57 @@
+import asyncio
+
+from r3erci.exporter import MAX_REQUEST_LINE, DiagnosticsExporter
+
+DEVICES = ["127.1.0.1", "127.1.0.2"]
+
+
+async def _request(port: int, data: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(data)
+    writer.write_eof()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+async def _scrape(*requests: bytes):
+    exporter = await DiagnosticsExporter.create(DEVICES, timeout=1, standalone=True)
+    try:
+        await exporter.pollOnce()
+        _, port = await exporter.startHttp(port=0)
+        return [await _request(port, request) for request in requests]
+    finally:
+        if exporter.httpServer is not None:
+            exporter.httpServer.close()
+        exporter.udpServer.close()
+
+
+def test_scrape():
+    (response,) = asyncio.run(_scrape(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n"))
+    head, _, body = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    for address in DEVICES:
+        assert f'r3erci_device_up{{device="{address}"}} 1'.encode() in body
+    assert body.endswith(b"# EOF\n")
+
+
+def test_head_and_unknown_path():
+    head, missing = asyncio.run(
+        _scrape(b"HEAD /metrics HTTP/1.1\r\n\r\n", b"GET /other HTTP/1.1\r\n\r\n")
+    )
+    assert head.startswith(b"HTTP/1.1 200 OK") and head.endswith(b"\r\n\r\n")
+    assert missing.startswith(b"HTTP/1.1 404 Not Found")
+
+
+def test_malformed_requests():
+    empty, blank, oversized, scrape = asyncio.run(
+        _scrape(
+            b"",
+            b"\r\n\r\n",
+            b"GET /" + b"x" * MAX_REQUEST_LINE + b" HTTP/1.1\r\n\r\n",
+            b"GET /metrics HTTP/1.1\r\n\r\n",
+        )
+    )
+    assert empty == blank == oversized == b""
+    # The server survives them
+    assert scrape.startswith(b"HTTP/1.1 200 OK")
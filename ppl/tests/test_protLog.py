@@ -0,0 +1,34 @@
+import ppl.packetDefinitions as pd
+from ppl.protLog import ProtLogReader, ProtLogWriter
+
+ENTRY_SIZE = 16
+
+
+def _writeLog(path, chunks: int = 2, entries: int = 4) -> None:
+    header = pd.ProtLogHeader(entrySize=ENTRY_SIZE, data=[0] * 1380)
+    with ProtLogWriter(path, header) as writer:
+        for index in range(chunks):
+            data = [index] * (entries * ENTRY_SIZE)
+            logData = pd.ProtLogData(
+                index=index, total=chunks, debugLength=len(data), padding=0, data=data + [0] * (1008 - len(data))
+            )
+            writer.append("10.0.0.1", logData, timestamp=float(index))
+
+
+def test_records(tmp_path):
+    path = str(tmp_path / "capture.plog")
+    _writeLog(path)
+    with ProtLogReader(path) as reader:
+        records = [(chunk, slot, bytes(entry)) for _, _, chunk, slot, entry in reader.records()]
+    assert records == [(chunk, slot, bytes([chunk]) * ENTRY_SIZE) for chunk in range(2) for slot in range(4)]
+
+
+def test_records_early_exit(tmp_path):
+    path = str(tmp_path / "capture.plog")
+    _writeLog(path)
+    with ProtLogReader(path) as reader:
+        for record in reader.records():
+            break
+    # The entry still referenced doesn't keep close() from succeeding
+    assert reader._mmap is None and reader.file.closed
+    assert record[2:4] == (0, 0)